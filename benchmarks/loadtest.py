@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+Load test: many concurrent eicproxy ProxyCommand processes against local stand-ins.
+
+A stub endpoint answers EC2 DescribeInstances and EC2 Instance Connect SendSSHPublicKey with
+configurable latency and throttling, and an sshd-like TCP server sends a version banner and
+echoes everything back.  With --eice, DescribeInstanceConnectEndpoints is answered too and the
+connections go through a WebSocket stand-in of the endpoint's tunnel to the same server.  Each connection runs the real eicproxy script, writes an SSH
+version line and cleartext key exchange up to NEWKEYS followed by a marker, and counts as set
+up once the marker comes back, i.e. when ssh could start authenticating.  Then a payload is
+echoed through the relay.
+
+Reports p50/p95/p99 setup latency, API calls per connection, peak RSS per process and relay
+throughput.
+
+    python benchmarks/loadtest.py --connections 200 --latency-ms 50 --json
+"""
+
+import argparse
+import base64
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import abspath, dirname, join
+from urllib.parse import parse_qs, urlsplit
+
+repo_root = dirname(dirname(abspath(__file__)))
+eicproxy_script = join(repo_root, 'eicproxy')
+sys.path.insert(0, repo_root)
+
+from libeicproxy import websocket  # noqa: E402
+
+banner = b'SSH-2.0-loadtest\r\n'
+marker = b'AUTH-MARKER'
+
+
+def ssh_packet(msg_type, body=b''):
+    payload = bytes([msg_type]) + body
+    padding = 8 - (5 + len(payload)) % 8
+    if padding < 4:
+        padding += 8
+    return (1 + len(payload) + padding).to_bytes(4, 'big') + bytes([padding]) + payload + bytes(padding)
+
+
+# version line, KEXINIT, KEX_ECDH_INIT, NEWKEYS: what a client sends before authenticating
+handshake = b'SSH-2.0-loadtest-client\r\n' + ssh_packet(20, bytes(600)) + ssh_packet(30, bytes(36)) + ssh_packet(21)
+
+
+class Stub(object):
+    """
+    EC2 and EC2 Instance Connect stand-in with latency, throttling and call counters.
+    """
+    def __init__(self, instances, latency, throttle_rps):
+        self.instances = instances
+        self.latency = latency
+        self.throttle_rps = throttle_rps
+        self.calls = {}
+        self.throttled = 0
+        self.tokens_ = float(throttle_rps)
+        self.refilled_ = time.monotonic()
+        self.lock_ = threading.Lock()
+
+    def admit(self, operation):
+        with self.lock_:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            if not self.throttle_rps:
+                return True
+            now = time.monotonic()
+            self.tokens_ = min(self.throttle_rps, self.tokens_ + (now - self.refilled_) * self.throttle_rps)
+            self.refilled_ = now
+            if self.tokens_ < 1:
+                self.throttled += 1
+                return False
+            self.tokens_ -= 1
+            return True
+
+    def describe(self, params):
+        filters = {}
+        for key, values in params.items():
+            if key.startswith('Filter.') and key.endswith('.Name'):
+                prefix = key[:-len('Name')]
+                filters[values[0]] = [v[0] for k, v in sorted(params.items()) if k.startswith(prefix + 'Value.')]
+        ids = [v[0] for k, v in params.items() if k.startswith('InstanceId.')]
+        selected = []
+        for instance_id, name in self.instances:
+            if ids and instance_id not in ids:
+                continue
+            if 'instance-id' in filters and instance_id not in filters['instance-id']:
+                continue
+            if 'tag:Name' in filters and name not in filters['tag:Name']:
+                continue
+            selected.append((instance_id, name))
+        if ids and len(selected) < len(ids):
+            return 400, ('<Response><Errors><Error><Code>InvalidInstanceID.NotFound</Code>'
+                         '<Message>not found</Message></Error></Errors></Response>')
+        items = ''.join(
+            f'<item><instanceId>{instance_id}</instanceId><instanceState><name>running</name></instanceState>'
+            f'<placement><availabilityZone>us-east-1a</availabilityZone></placement>'
+            f'<privateIpAddress>127.0.0.1</privateIpAddress><vpcId>vpc-1</vpcId><subnetId>subnet-1</subnetId><launchTime>2024-01-01T00:00:00.000Z</launchTime>'
+            f'<tagSet><item><key>Name</key><value>{name}</value></item></tagSet></item>'
+            for instance_id, name in selected)
+        return 200, (f'<DescribeInstancesResponse><reservationSet><item><ownerId>1</ownerId>'
+                     f'<instancesSet>{items}</instancesSet></item></reservationSet></DescribeInstancesResponse>')
+
+    def describe_endpoints(self):
+        return 200, ('<DescribeInstanceConnectEndpointsResponse><instanceConnectEndpointSet><item>'
+                     '<instanceConnectEndpointId>eice-1</instanceConnectEndpointId>'
+                     '<dnsName>eice-1.ec2-instance-connect-endpoint.us-east-1.amazonaws.com</dnsName>'
+                     '<state>create-complete</state><vpcId>vpc-1</vpcId><subnetId>subnet-1</subnetId>'
+                     '</item></instanceConnectEndpointSet></DescribeInstanceConnectEndpointsResponse>')
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body, content_type):
+                data = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                target = self.headers.get('X-Amz-Target')
+                if target:
+                    operation = target.rsplit('.', 1)[-1]
+                else:
+                    params = parse_qs(body.decode())
+                    operation = params.get('Action', ['?'])[0]
+                time.sleep(stub.latency)
+                if not stub.admit(operation):
+                    if target:
+                        self.reply(400, json.dumps({'__type': 'ThrottlingException', 'message': 'Rate exceeded'}),
+                                   'application/x-amz-json-1.1')
+                    else:
+                        self.reply(503, '<Response><Errors><Error><Code>RequestLimitExceeded</Code>'
+                                        '<Message>Request limit exceeded.</Message></Error></Errors></Response>',
+                                   'text/xml')
+                    return
+                if target:
+                    self.reply(200, json.dumps({'RequestId': 'loadtest', 'Success': True}),
+                               'application/x-amz-json-1.1')
+                elif operation == 'DescribeInstances':
+                    self.reply(*stub.describe(params), 'text/xml')
+                elif operation == 'DescribeInstanceConnectEndpoints':
+                    self.reply(*stub.describe_endpoints(), 'text/xml')
+                else:
+                    self.reply(400, f'<Response><Errors><Error><Code>InvalidAction</Code>'
+                                    f'<Message>{operation}</Message></Error></Errors></Response>', 'text/xml')
+
+        return Handler
+
+
+def serve_echo(listener):
+    def echo(conn):
+        with conn:
+            conn.sendall(banner)
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    return
+                conn.sendall(data)
+
+    while True:
+        try:
+            conn, _ = listener.accept()
+        except OSError:
+            return
+        threading.Thread(target=echo, args=(conn,), daemon=True).start()
+
+
+def serve_tunnels(listener, counts):
+    """
+    EC2 Instance Connect Endpoint stand-in: answers presigned openTunnel WebSocket handshakes and
+    bridges each tunnel to the requested port on localhost.
+    """
+    def refuse(conn, status):
+        conn.sendall(f'HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n'.encode())
+
+    def tunnel(conn):
+        with conn:
+            request = bytearray()
+            while b'\r\n\r\n' not in request:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    return
+                request += chunk
+            head, _, rest = bytes(request).partition(b'\r\n\r\n')
+            request_line, *header_lines = head.decode('iso-8859-1').split('\r\n')
+            headers = {name.strip().lower(): value.strip()
+                       for name, _, value in (line.partition(':') for line in header_lines)}
+            parts = urlsplit(request_line.split(' ')[1])
+            query = parse_qs(parts.query)
+            if parts.path != '/openTunnel' or 'X-Amz-Signature' not in query or 'remotePort' not in query:
+                counts['refused'] += 1
+                return refuse(conn, '403 Forbidden')
+            try:
+                upstream = socket.create_connection(('127.0.0.1', int(query['remotePort'][0])))
+            except OSError:
+                return refuse(conn, '502 Bad Gateway')
+            counts['tunnels'] += 1
+            conn.sendall(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                          f'Sec-WebSocket-Accept: {websocket.accept_key(headers["sec-websocket-key"])}\r\n\r\n').encode())
+            ws = websocket.WebSocket(conn, client=False, buffered=rest)
+
+            def downstream():
+                try:
+                    while True:
+                        data = upstream.recv(65536)
+                        if not data:
+                            break
+                        ws.send(data)
+                except OSError:
+                    pass
+                ws.close()
+
+            threading.Thread(target=downstream, daemon=True).start()
+            with upstream:
+                try:
+                    while True:
+                        data = ws.recv()
+                        if not data:
+                            break
+                        upstream.sendall(data)
+                except OSError:
+                    pass
+
+    while True:
+        try:
+            conn, _ = listener.accept()
+        except OSError:
+            return
+        threading.Thread(target=tunnel, args=(conn,), daemon=True).start()
+
+
+def read_exactly(stream, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = stream.read1(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data)
+
+
+def connect_once(command, env, payload):
+    """
+    Runs one eicproxy process through setup and a payload echo.
+
+    :return: dict with setup_ms, throughput_mb_s, max_rss_kb, ok and error
+    """
+    result = {'ok': False}
+    start = time.perf_counter()
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            env=env, cwd=repo_root)
+    try:
+        proc.stdin.write(handshake + marker)
+        proc.stdin.flush()
+        expected = banner + handshake + marker
+        if read_exactly(proc.stdout, len(expected)) != expected:
+            raise RuntimeError('setup did not complete')
+        result['setup_ms'] = (time.perf_counter() - start) * 1000
+
+        if payload:
+            writer = threading.Thread(target=lambda: (proc.stdin.write(payload), proc.stdin.flush()))
+            relay_start = time.perf_counter()
+            writer.start()
+            echoed = read_exactly(proc.stdout, len(payload))
+            writer.join()
+            if len(echoed) != len(payload):
+                raise RuntimeError(f'payload echo short by {len(payload) - len(echoed)} bytes')
+            result['throughput_mb_s'] = 2 * len(payload) / (time.perf_counter() - relay_start) / 1e6
+        result['ok'] = True
+    except (OSError, RuntimeError) as e:
+        result['error'] = str(e)
+    finally:
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        stderr = proc.stderr.read().decode(errors='replace').strip()
+        _pid, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        result['max_rss_kb'] = rusage.ru_maxrss
+        if not result['ok'] and stderr:
+            result['error'] = f"{result.get('error')}: {stderr.splitlines()[-1]}"
+    return result
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile of a list of numbers.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+
+def run_wave(commands, env, payload, concurrency):
+    results = [None] * len(commands)
+    slots = threading.Semaphore(concurrency)
+    start = threading.Event()
+
+    def worker(i):
+        start.wait()
+        with slots:
+            results[i] = connect_once(commands[i], env, payload)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(commands))]
+    for thread in threads:
+        thread.start()
+    wave_start = time.perf_counter()
+    start.set()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - wave_start
+
+
+def summarize(results, wall_seconds, stub_calls, throttled):
+    ok = [r for r in results if r['ok']]
+    setup = [r['setup_ms'] for r in ok]
+    throughput = [r['throughput_mb_s'] for r in ok if 'throughput_mb_s' in r]
+    rss = [r['max_rss_kb'] for r in results]
+    errors = {}
+    for r in results:
+        if not r['ok']:
+            errors[r.get('error')] = errors.get(r.get('error'), 0) + 1
+    return {
+        'connections': len(results),
+        'succeeded': len(ok),
+        'failed': len(results) - len(ok),
+        'wall_seconds': round(wall_seconds, 3),
+        'setup_ms': {name: round(percentile(setup, q), 1) if setup else None
+                     for name, q in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))},
+        'api_calls_per_connection': {op: round(n / len(results), 3) for op, n in sorted(stub_calls.items())},
+        'throttled_calls': throttled,
+        'peak_rss_kb': {'p50': percentile(rss, 50), 'max': max(rss) if rss else None},
+        'relay_mb_s': {'p50': round(percentile(throughput, 50), 1) if throughput else None,
+                       'total': round(sum(throughput), 1) if throughput else None},
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the eicproxy ProxyCommand with many concurrent connections.')
+    parser.add_argument('--connections', type=int, default=100, help='ProxyCommand processes to run. Default: 100')
+    parser.add_argument('--concurrency', type=int, default=0,
+                        help='Processes running at the same time. Default: all connections at once')
+    parser.add_argument('--instances', type=int, default=50, help='Distinct stub instances connected to. Default: 50')
+    parser.add_argument('--host-kind', choices=('id', 'name'), default='id',
+                        help='Connect by instance id or by tag Name (--use-tag-name). Default: id')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Added latency per API call. Default: 20')
+    parser.add_argument('--throttle-rps', type=float, default=0,
+                        help='API calls per second the stub admits before throttling, 0 for no limit. Default: 0')
+    parser.add_argument('--payload-kb', type=int, default=256, help='Bytes echoed through each relay. Default: 256')
+    parser.add_argument('--warm', action='store_true',
+                        help='Run every connection once before measuring, so caches and key pushes are warm.')
+    parser.add_argument('--agent', action='store_true', help='Run an eicproxy agent and go through it.')
+    parser.add_argument('--eice', action='store_true',
+                        help='Connect through a stand-in EC2 Instance Connect Endpoint tunnel (eicproxy --eice).')
+    parser.add_argument('--eicproxy-args', type=str, default='', help='Extra arguments for every eicproxy run.')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    args = parser.parse_args()
+
+    instances = [(f'i-{n + 1:017x}', f'loadtest-{n + 1}') for n in range(args.instances)]
+    stub = Stub(instances, args.latency_ms / 1000, args.throttle_rps)
+    api = ThreadingHTTPServer(('127.0.0.1', 0), stub.handler())
+    api.daemon_threads = True
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1024)
+    threading.Thread(target=serve_echo, args=(listener,), daemon=True).start()
+    ssh_port = listener.getsockname()[1]
+    tunnel_counts = {'tunnels': 0, 'refused': 0}
+    if args.eice:
+        tunnel_listener = socket.socket()
+        tunnel_listener.bind(('127.0.0.1', 0))
+        tunnel_listener.listen(1024)
+        threading.Thread(target=serve_tunnels, args=(tunnel_listener, tunnel_counts), daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(join(tmp, 'credentials'), 'w') as fh_:
+            fh_.write('[default]\naws_access_key_id = AKIDEXAMPLE\naws_secret_access_key = secret\n')
+        with open(join(tmp, 'config'), 'w') as fh_:
+            fh_.write('[default]\nregion = us-east-1\n')
+        public_key_file = join(tmp, 'id.pub')
+        with open(public_key_file, 'w') as fh_:
+            fh_.write(f'ssh-ed25519 {base64.b64encode(os.urandom(51)).decode()} loadtest\n')
+        env = dict(os.environ, AWS_SHARED_CREDENTIALS_FILE=join(tmp, 'credentials'), AWS_CONFIG_FILE=join(tmp, 'config'),
+                   AWS_EC2_METADATA_DISABLED='true', PYTHONPATH=repo_root, EICPROXY_CACHE_DIR=join(tmp, 'cache'),
+                   EICPROXY_ENDPOINT_URL=f'http://127.0.0.1:{api.server_port}/')
+        if args.eice:
+            env['EICPROXY_EICE_URL'] = f'ws://127.0.0.1:{tunnel_listener.getsockname()[1]}'
+        env.pop('AWS_PROFILE', None)
+        env.pop('AWS_DEFAULT_PROFILE', None)
+
+        common = ['--public-key-file', public_key_file] + shlex.split(args.eicproxy_args)
+        agent = None
+        if args.agent:
+            agent_socket = join(tmp, 'agent.sock')
+            agent = subprocess.Popen([sys.executable, eicproxy_script, 'agent', '--socket', agent_socket],
+                                     env=env, cwd=repo_root)
+            common += ['--agent-socket', agent_socket]
+            deadline = time.monotonic() + 10
+            while not os.path.exists(agent_socket) and time.monotonic() < deadline:
+                time.sleep(0.05)
+        else:
+            common.append('--no-agent')
+        if args.host_kind == 'name':
+            common.append('--use-tag-name')
+        if args.eice:
+            common.append('--eice')
+
+        commands = []
+        for i in range(args.connections):
+            instance_id, name = instances[i % len(instances)]
+            host = instance_id if args.host_kind == 'id' else name
+            commands.append([sys.executable, eicproxy_script, f'ec2-user@{host}:{ssh_port}'] + common)
+
+        payload = os.urandom(args.payload_kb * 1024)
+        concurrency = args.concurrency or args.connections
+        try:
+            if args.warm:
+                run_wave(commands, env, b'', concurrency)
+                with stub.lock_:
+                    stub.calls.clear()
+                    stub.throttled = 0
+            results, wall_seconds = run_wave(commands, env, payload, concurrency)
+        finally:
+            if agent is not None:
+                agent.terminate()
+                agent.wait()
+        report = summarize(results, wall_seconds, stub.calls, stub.throttled)
+    if args.eice:
+        report['eice'] = dict(tunnel_counts)
+
+    report['parameters'] = {key: value for key, value in vars(args).items() if key != 'json'}
+    if args.json:
+        print(json.dumps(report))
+        return
+    setup = report['setup_ms']
+    print(f"{report['succeeded']}/{report['connections']} connections in {report['wall_seconds']}s, "
+          f"{report['throttled_calls']} throttled API calls")
+    print(f"setup ms       p50 {setup['p50']}  p95 {setup['p95']}  p99 {setup['p99']}  max {setup['max']}")
+    print(f"api calls/conn {', '.join(f'{op} {n}' for op, n in report['api_calls_per_connection'].items()) or 'none'}")
+    print(f"peak rss kb    p50 {report['peak_rss_kb']['p50']}  max {report['peak_rss_kb']['max']}")
+    print(f"relay MB/s     p50 {report['relay_mb_s']['p50']}  total {report['relay_mb_s']['total']}")
+    if args.eice:
+        print(f"eice tunnels   {report['eice']['tunnels']} opened, {report['eice']['refused']} refused")
+    for error, count in report['errors'].items():
+        print(f'{count:5} x {error}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Relay throughput benchmark: libeicproxy.relay (splice and select modes) vs nclib.
+
+A local TCP server receives an upload of --megabytes through the relay's stdin, then sends
+the same amount back through the relay's stdout.  Each relay runs in its own process, like a
+ProxyCommand, and is timed by wall clock and by the CPU time it used.
+
+    python benchmarks/relay.py --megabytes 512
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from os.path import abspath, dirname
+
+repo_root = dirname(dirname(abspath(__file__)))
+
+relays = {
+    'splice': "from libeicproxy import relay; relay.relay(relay.connect('127.0.0.1', {port}), mode='splice')",
+    'select': "from libeicproxy import relay; relay.relay(relay.connect('127.0.0.1', {port}), mode='select')",
+    'nclib': "from nclib import Netcat; Netcat(server=('127.0.0.1', {port}), verbose=False).interact()",
+}
+
+chunk = b'\x5a' * (1 << 20)
+
+
+def serve_once(listener, size, result):
+    conn, _ = listener.accept()
+    received = 0
+    buf = bytearray(1 << 20)
+    while received < size:
+        n = conn.recv_into(buf)
+        if not n:
+            break
+        received += n
+    result['upload_done'] = time.perf_counter()
+    result['received'] = received
+    sent = 0
+    while sent < size:
+        conn.sendall(chunk[:min(len(chunk), size - sent)])
+        sent += min(len(chunk), size - sent)
+    conn.close()
+
+
+def run(name, code, size):
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    result = {}
+    server = threading.Thread(target=serve_once, args=(listener, size, result))
+    server.start()
+
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-c', code.format(port=listener.getsockname()[1])],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=repo_root,
+                            env=dict(os.environ, PYTHONPATH=repo_root))
+
+    def upload():
+        sent = 0
+        while sent < size:
+            proc.stdin.write(chunk[:min(len(chunk), size - sent)])
+            sent += min(len(chunk), size - sent)
+        proc.stdin.close()
+
+    uploader = threading.Thread(target=upload)
+    uploader.start()
+    received = 0
+    while True:
+        data = proc.stdout.read1(1 << 20)
+        if not data:
+            break
+        received += len(data)
+    end = time.perf_counter()
+    uploader.join()
+    server.join()
+    proc.wait()
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    listener.close()
+
+    if received != size or result.get('received') != size:
+        raise RuntimeError(f'{name}: expected {size} bytes each way, got up {result.get("received")} down {received}')
+    upload_seconds = result['upload_done'] - start
+    download_seconds = end - result['upload_done']
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return {'upload_mb_s': round(size / upload_seconds / 1e6, 1),
+            'download_mb_s': round(size / download_seconds / 1e6, 1),
+            'cpu_seconds': round(cpu, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure ProxyCommand relay throughput.')
+    parser.add_argument('--megabytes', type=int, default=256, help='Megabytes sent each way. Default: 256')
+    parser.add_argument('--relays', nargs='+', default=list(relays), choices=list(relays),
+                        help='Relays to measure. Default: all')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    args = parser.parse_args()
+
+    size = args.megabytes * (1 << 20)
+    results = {}
+    for name in args.relays:
+        if name == 'nclib' and importlib.util.find_spec('nclib') is None:
+            print('skipping nclib: not installed', file=sys.stderr)
+            continue
+        results[name] = run(name, relays[name], size)
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    for name, result in results.items():
+        print(f"{name:8} up {result['upload_mb_s']:8.1f} MB/s   down {result['download_mb_s']:8.1f} MB/s   "
+              f"cpu {result['cpu_seconds']:6.3f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+ssh config benchmark: libeicproxy.sshconf on generated fleet configs of 1k, 10k and 100k hosts.
+
+Times parsing, a bulk edit touching every host (set one value, add one value, unset one
+value), renaming and removing a tenth of the hosts and writing the config back out.  With --baseline the same edits run against the upstream
+sshconf package (pip install sshconf), whose operations scan every line, if installed; it is
+skipped for sizes above --baseline-max-hosts as it takes too long.
+
+    python benchmarks/sshconf.py --hosts 1000 10000 100000
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from libeicproxy import sshconf  # noqa: E402
+
+
+def fleet_config(hosts):
+    lines = ['# generated by eicproxy gen-config', 'Host *', '  ServerAliveInterval 30', '']
+    for i in range(hosts):
+        lines += [f'Host web-{i:06d}',
+                  f'  HostName i-{i:017x}',
+                  '  User ec2-user',
+                  '  ProxyCommand eicproxy %r@%h:%p',
+                  '']
+    return lines
+
+
+def timed(results, name, fn):
+    start = time.perf_counter()
+    value = fn()
+    results[name] = round(time.perf_counter() - start, 4)
+    return value
+
+
+def run(module, hosts):
+    lines = fleet_config(hosts)
+    names = [f'web-{i:06d}' for i in range(hosts)]
+    results = {}
+    config = timed(results, 'parse', lambda: module.SshConfig(list(lines)))
+
+    def bulk_edit():
+        for name in names:
+            config.set(name, User='admin', IdentityFile='~/.ssh/fleet')
+            config.unset(name, 'proxycommand')
+
+    timed(results, 'bulk_edit', bulk_edit)
+    tenth = names[::10]
+    timed(results, 'rename', lambda: [config.rename(name, f'{name}-old') for name in tenth])
+    timed(results, 'remove', lambda: [config.remove(f'{name}-old') for name in tenth])
+    timed(results, 'config', config.config)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure ssh config parsing and bulk edits.')
+    parser.add_argument('--hosts', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Config sizes in Host entries. Default: 1000 10000 100000')
+    parser.add_argument('--baseline', action='store_true', help='Also measure the upstream sshconf package.')
+    parser.add_argument('--baseline-max-hosts', type=int, default=10000,
+                        help='Largest size the baseline is measured at. Default: 10000')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        try:
+            import sshconf as baseline
+        except ImportError:
+            print('skipping baseline: sshconf is not installed', file=sys.stderr)
+
+    results = {}
+    for hosts in args.hosts:
+        results[f'indexed/{hosts}'] = run(sshconf, hosts)
+        if baseline is not None and hosts <= args.baseline_max_hosts:
+            results[f'baseline/{hosts}'] = run(baseline, hosts)
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    for name, result in results.items():
+        print(f'{name:18} ' + '  '.join(f'{phase} {seconds:8.3f}s' for phase, seconds in result.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark: boto3 vs libeicproxy.lite_client.
+
+Each sample is a fresh interpreter that imports the engine, creates a session and the EC2 and
+EC2 Instance Connect clients, which is the fixed cost every ProxyCommand run pays before its
+first API call.  Dummy credentials are used and no request is sent.
+
+    python benchmarks/startup.py --runs 20
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from os.path import abspath, dirname, join
+
+repo_root = dirname(dirname(abspath(__file__)))
+
+engines = {
+    'python': 'pass',
+    'boto3': ("import boto3\n"
+              "s = boto3.session.Session(profile_name='bench', region_name='us-east-1')\n"
+              "s.client('ec2'); s.client('ec2-instance-connect')\n"
+              "s.get_credentials().get_frozen_credentials()"),
+    'lite': ("from libeicproxy import lite_client\n"
+             "s = lite_client.Session(profile_name='bench', region_name='us-east-1')\n"
+             "s.client('ec2'); s.client('ec2-instance-connect')\n"
+             "s.get_credentials()"),
+}
+
+
+def sample(code, env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], env=env, cwd=repo_root, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure eicproxy engine cold start time.')
+    parser.add_argument('--runs', type=int, default=10, help='Samples per engine. Default: 10')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        credentials = join(tmp, 'credentials')
+        with open(credentials, 'w') as fh_:
+            fh_.write('[bench]\naws_access_key_id = AKIDEXAMPLE\naws_secret_access_key = secret\n')
+        env = dict(os.environ, AWS_SHARED_CREDENTIALS_FILE=credentials, AWS_CONFIG_FILE=join(tmp, 'config'),
+                   AWS_EC2_METADATA_DISABLED='true', PYTHONPATH=repo_root)
+
+        results = {}
+        for name, code in engines.items():
+            try:
+                sample(code, env)  # warm the OS page cache
+            except subprocess.CalledProcessError:
+                print(f'skipping {name}: not importable', file=sys.stderr)
+                continue
+            times = [sample(code, env) for _ in range(args.runs)]
+            results[name] = {'median_ms': round(statistics.median(times), 1),
+                             'min_ms': round(min(times), 1),
+                             'max_ms': round(max(times), 1)}
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    for name, result in results.items():
+        print(f"{name:8} median {result['median_ms']:8.1f} ms   min {result['min_ms']:8.1f} ms   max {result['max_ms']:8.1f} ms")
+    if 'boto3' in results and 'lite' in results:
+        saved = results['boto3']['median_ms'] - results['lite']['median_ms']
+        print(f'lite saves {saved:.1f} ms per cold start')
+
+
+if __name__ == '__main__':
+    main()
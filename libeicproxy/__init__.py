@@ -0,0 +1,3 @@
+"""
+Supporting library for the eicproxy ssh ProxyCommand.
+"""
@@ -0,0 +1,239 @@
+"""
+Optional resident eicproxy agent.
+
+The agent keeps a Broker (warm boto3 sessions and clients, lookup and key push state) alive
+and serves it over a Unix domain socket.  The eicproxy script only needs the standard library
+to talk to it, so a ProxyCommand run with an agent up skips the boto3 import, credential
+resolution and client creation entirely.
+
+Protocol: the client sends one JSON object terminated by a newline and reads one JSON object
+back.  Requests carry an 'op' ('authorize', 'target', 'authorize_target', 'remember_path',
+'invalidate' or 'ping'), responses either the result or an 'error' message.
+"""
+
+import argparse
+import json
+import os
+import socket
+import struct
+import sys
+
+from os.path import join
+
+from . import defaults, instrument
+
+SOCKET_ENV = 'EICPROXY_AGENT_SOCKET'
+default_timeout = 30
+default_idle_timeout = 0
+max_message_bytes = 1 << 20
+
+
+class AgentUnavailable(Exception):
+    """
+    Raised by call() when no agent is listening, the caller should fall back to in-process work.
+    """
+
+
+def default_socket_path():
+    """
+    Returns the agent socket path: EICPROXY_AGENT_SOCKET, or agent.sock in the cache directory.
+    """
+    return os.environ.get(SOCKET_ENV) or join(defaults.cache_dir(), 'agent.sock')
+
+
+def _read_message(sock):
+    data = bytearray()
+    while not data.endswith(b'\n'):
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > max_message_bytes:
+            raise ValueError('agent message too large')
+    return json.loads(data.decode()) if data else None
+
+
+def _write_message(sock, message):
+    sock.sendall(json.dumps(message).encode() + b'\n')
+
+
+def call(message, socket_path=None, timeout=default_timeout):
+    """
+    Sends one request to the agent and returns its response.
+
+    :param message: Request, e.g. {'op': 'authorize', ...} with the Broker.authorize request keys
+    :type message: dict
+    :param socket_path: Agent socket, defaults to default_socket_path()
+    :type socket_path: basestring
+    :param timeout: Seconds to wait for the agent's answer
+    :type timeout: float
+    :return: The agent's response
+    :rtype: dict
+    :raises AgentUnavailable: if no agent is listening or it went away mid-request
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path or default_socket_path())
+        _write_message(sock, message)
+        response = _read_message(sock)
+    except (OSError, ValueError) as e:
+        raise AgentUnavailable(str(e))
+    finally:
+        sock.close()
+    if response is None:
+        raise AgentUnavailable('agent closed the connection')
+    return response
+
+
+def _peer_uid(sock):
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return os.getuid()
+    _pid, uid, _gid = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                                         struct.calcsize('3i')))
+    return uid
+
+
+def handle(broker, message):
+    """
+    Dispatches one agent request to the broker.
+
+    :return: The response message
+    :rtype: dict
+    """
+    from .broker import BrokerError
+
+    op = message.get('op')
+    try:
+        if op == 'authorize':
+            return broker.authorize(message)
+        if op == 'target':
+            return broker.target(message)
+        if op == 'authorize_target':
+            broker.authorize_target(message['target'], message)
+            return {}
+        if op == 'remember_path':
+            broker.remember_path(message)
+            return {}
+        if op == 'invalidate':
+            broker.invalidate(message)
+            return {}
+        if op == 'ping':
+            from .throttle import stats
+            return {'pid': os.getpid(), 'throttle': stats.snapshot()}
+        return {'error': f'unknown agent op: {op}'}
+    except BrokerError as e:
+        return {'error': str(e)}
+    except Exception as e:
+        return {'error': f'eicproxy agent: {type(e).__name__}: {e}'}
+
+
+def serve(socket_path=None, idle_timeout=default_idle_timeout, warm=()):
+    """
+    Runs the agent until interrupted or idle for idle_timeout seconds.
+
+    :param socket_path: Socket to listen on, defaults to default_socket_path()
+    :type socket_path: basestring
+    :param idle_timeout: Exit after this many seconds without requests, 0 runs forever
+    :type idle_timeout: int
+    :param warm: (profile, region) pairs whose EC2 and EIC clients are created up front
+    :type warm: list
+    """
+    import socketserver
+    from .broker import Broker
+
+    socket_path = socket_path or default_socket_path()
+    broker = Broker()
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            if _peer_uid(self.request) != os.getuid():
+                return
+            self.request.settimeout(default_timeout)
+            try:
+                message = _read_message(self.request)
+                if message is not None:
+                    _write_message(self.request, handle(broker, message))
+            except (OSError, ValueError):
+                pass
+
+    class Server(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+        idle = False
+
+        def handle_timeout(self):
+            self.idle = True
+
+    try:
+        call({'op': 'ping'}, socket_path, timeout=1)
+    except AgentUnavailable:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+    else:
+        raise RuntimeError(f'an eicproxy agent is already listening on {socket_path}')
+
+    old_umask = os.umask(0o177)
+    try:
+        server = Server(socket_path, Handler)
+    finally:
+        os.umask(old_umask)
+
+    pool = broker.pool()
+    for profile, region in warm:
+        region = region or pool.default_region(profile)
+        for service in ('ec2', 'ec2-instance-connect'):
+            pool.client(profile, region, service)
+
+    server.timeout = idle_timeout or None
+    try:
+        while not server.idle:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def _detach():
+    if os.fork() > 0:
+        os._exit(0)
+    os.setsid()
+    if os.fork() > 0:
+        os._exit(0)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1):
+        os.dup2(devnull, fd)
+
+
+def main(argv):
+    """
+    Entry point for `eicproxy agent`.
+    """
+    parser = argparse.ArgumentParser(prog='eicproxy agent',
+                                     description='Resident eicproxy agent keeping AWS sessions, clients and lookup state warm.')
+    parser.add_argument('--socket', type=str, default=None, metavar='',
+                        help=f'Unix socket to listen on. Default: ${SOCKET_ENV} or agent.sock in the eicproxy cache directory')
+    parser.add_argument('--idle-timeout', type=int, default=default_idle_timeout, metavar='',
+                        help='Exit after this many seconds without requests, 0 runs until interrupted. Default: 0')
+    parser.add_argument('--warm', type=str, nargs='+', default=[], metavar='PROFILE:REGION',
+                        help='Create clients for these profile:region pairs at startup.')
+    parser.add_argument('--detach', action='store_true', help='Run in the background.')
+    parser.add_argument('--trace', type=str, default=None, metavar='',
+                        help='Record the phases of the requests the agent handles, see eicproxy --trace. Default: $EICPROXY_TRACE, off')
+    args = parser.parse_args(argv)
+    try:
+        instrument.configure(args.trace)
+    except (OSError, ValueError) as e:
+        parser.error(f'--trace: {e}')
+
+    warm = [tuple(pair.split(':', 1)) if ':' in pair else (pair, None) for pair in args.warm]
+    if args.detach:
+        _detach()
+    try:
+        serve(args.socket, idle_timeout=args.idle_timeout, warm=warm)
+    except RuntimeError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    return 0
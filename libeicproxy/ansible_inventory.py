@@ -0,0 +1,130 @@
+"""
+The inventory behind the eicproxy Ansible inventory plugin (ansible_plugins/inventory/eicproxy.py
+next to this module, which only hands the hosts built here over to Ansible).
+
+Instances are listed the way `eicproxy gen-config` lists them: one paged DescribeInstances call
+per profile and region for every instance carrying a Name tag, the Name tag giving the inventory
+hostname.  Each host connects to its instance id through an eicproxy ProxyCommand carrying the
+profile and the one region the instance lives in, and its lookup is written to the instance cache,
+so the ProxyCommands Ansible starts look nothing up.  With push_keys the key is pushed to every
+host while the inventory is built, recorded in the push ledger the ProxyCommands skip fresh
+pushes with.
+"""
+
+import re
+import shlex
+
+from argparse import Namespace
+from os.path import dirname, expanduser, join
+
+from . import cli, defaults, fleet_exec, gen_config
+
+PLUGIN_DIR = join(dirname(__file__), 'ansible_plugins', 'inventory')
+
+#: Plugin options and their defaults, see the plugin's DOCUMENTATION
+default_options = {
+    'profiles': [cli.default_aws_profile],
+    'regions': None,
+    'states': ['running'],
+    'alias_format': gen_config.default_alias_format,
+    'user': None,
+    'jumphost': None,
+    'jumphost_tag': None,
+    'proxy_args': '',
+    'eicproxy_command': 'eicproxy',
+    'cache_ttl': defaults.cache_ttl,
+    'push_keys': False,
+    'public_key_file': cli.default_key_file_path_public,
+    'key_reuse_seconds': defaults.key_reuse_seconds,
+    'push_workers': defaults.push_workers,
+    'max_region_workers': defaults.max_region_workers,
+    'page_size': gen_config.default_page_size,
+    'engine': defaults.engine,
+}
+
+_group_unsafe = re.compile(r'[^A-Za-z0-9_]')
+
+
+def group_name(prefix, value):
+    """
+    Returns a group name Ansible accepts, e.g. region_us_east_1.
+    """
+    return _group_unsafe.sub('_', f'{prefix}_{value}')
+
+
+def host_vars(info, entry, args):
+    """
+    Returns the variables of an inventory host.
+
+    :param info: Instance record with profile and tags, see gen_config.list_entries
+    :type info: libeicproxy.ec2_util.InstanceRecord
+    :param entry: The instance's ssh Host entry, see gen_config.host_entry
+    :type entry: dict
+    :rtype: dict
+    """
+    variables = {
+        'ansible_host': entry['HostName'],
+        # ansible splits ssh args like a shell, the ProxyCommand has to stay one word
+        'ansible_ssh_common_args': f'-o ProxyCommand={shlex.quote(entry["ProxyCommand"])}',
+        'eicproxy_profile': info.profile,
+        'ec2_instance_id': info.instance_id,
+        'ec2_region': info.region,
+        'ec2_availability_zone': info.availability_zone,
+        'ec2_state': info.state,
+        'ec2_private_ip': info.private_ip,
+        'ec2_public_ip': info.public_ip,
+        'ec2_ipv6_address': info.ipv6_address,
+        'ec2_vpc_id': info.vpc_id,
+        'ec2_subnet_id': info.subnet_id,
+        'ec2_launch_time': info.launch_time,
+        'ec2_tags': info.tags,
+    }
+    if args.user:
+        variables['ansible_user'] = args.user
+    return variables
+
+
+def build(options):
+    """
+    Lists the hosts of the inventory.
+
+    :param options: Plugin options, missing ones take their default_options value
+    :type options: dict
+    :return: List of (hostname, variables, groups) plus the messages of keys that could not be pushed
+    :rtype: tuple
+    :raises GenConfigError: if any profile and region could not be listed
+    """
+    from .broker import SessionPool
+    from .instance_cache import InstanceCache
+    from .key_publisher import KeyPushLedger, push_public_keys
+
+    args = Namespace(**dict(default_options, **{key: value for key, value in options.items() if value is not None}))
+    pool = SessionPool(args.engine)
+    pairs = [(profile, region) for profile in args.profiles
+             for region in (args.regions or [pool.default_region(profile)])]
+    desired = gen_config.desired_entries(pool, pairs, args, records=True)
+
+    hosts = []
+    cache = InstanceCache(args.cache_ttl)
+    for alias, (info, entry) in sorted(desired.items()):
+        if args.states and info.state not in args.states:
+            continue
+        if info.state == 'running':
+            cache.put(info.profile, info.instance_id, info)
+        groups = [group_name('region', info.region), group_name('profile', info.profile)]
+        hosts.append((alias, host_vars(info, entry, args), groups))
+
+    warnings = []
+    running = [info for info, _entry in desired.values() if info.state == 'running']
+    if args.push_keys and running:
+        with open(expanduser(args.public_key_file)) as f:
+            public_key = f.read()
+        ledger = KeyPushLedger(args.key_reuse_seconds)
+        for profile in args.profiles:
+            results = push_public_keys(lambda region: pool.client(profile, region, 'ec2-instance-connect'),
+                                       [info for info in running if info.profile == profile],
+                                       args.user or fleet_exec.default_os_user, public_key, ledger=ledger,
+                                       max_workers=args.push_workers)
+            warnings += [f'eicproxy: pushing the key to {instance_id} failed: {result}'
+                         for instance_id, result in results.items() if isinstance(result, Exception)]
+    return hosts, warnings
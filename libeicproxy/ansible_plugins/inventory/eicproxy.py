@@ -0,0 +1,147 @@
+"""
+Ansible inventory plugin listing EC2 instances reached through eicproxy, see
+libeicproxy.ansible_inventory.  Point Ansible at this directory, e.g. with
+ANSIBLE_INVENTORY_PLUGINS=$(eicproxy ansible-plugins).
+"""
+
+DOCUMENTATION = r'''
+    name: eicproxy
+    short_description: EC2 instances with a Name tag, connected to through eicproxy
+    description:
+        - Lists every instance carrying a Name tag with one paged DescribeInstances call per profile and region.
+        - Hosts are named after their Name tag and connect to their instance id through an eicproxy ProxyCommand
+          carrying the profile and region the instance lives in. Their lookups are written to the eicproxy
+          instance cache so the ProxyCommands make no DescribeInstances call.
+        - The inventory file name must end with eicproxy.yml or eicproxy.yaml.
+    extends_documentation_fragment:
+        - constructed
+    options:
+        plugin:
+            description: Marks the file as an eicproxy inventory.
+            required: true
+            choices: ['eicproxy']
+        profiles:
+            description: AWS profiles to list instances of. Defaults to $AWS_PROFILE or default.
+            type: list
+            elements: str
+        regions:
+            description: Regions to list instances in. Defaults to the region configured for each profile.
+            type: list
+            elements: str
+        states:
+            description: Instance states to include, an empty list includes every state but terminated.
+            type: list
+            elements: str
+            default: ['running']
+        alias_format:
+            description: Inventory hostname built from {name}, {instance_id}, {region} and {profile}.
+            type: str
+            default: '{name}'
+        user:
+            description: Sets ansible_user and is the OS user keys are pushed for.
+            type: str
+        jumphost:
+            description: ssh config Host to proxy through for instances without a public IP.
+            type: str
+        jumphost_tag:
+            description: Instance tag naming the jumphost of an instance, takes precedence over jumphost.
+            type: str
+        proxy_args:
+            description: Extra eicproxy options for every ProxyCommand.
+            type: str
+            default: ''
+        eicproxy_command:
+            description: eicproxy command in the ProxyCommands.
+            type: str
+            default: eicproxy
+        cache_ttl:
+            description: Seconds the instance lookups written to the eicproxy cache stay valid, 0 writes none.
+            type: int
+            default: 300
+        push_keys:
+            description:
+                - Push the public key to every running host while the inventory is built. Pushes are reused by the
+                  ProxyCommands for key_reuse_seconds, later connections push again themselves.
+            type: bool
+            default: false
+        public_key_file:
+            description: Public key pushed with push_keys.
+            type: str
+            default: ~/.ssh/id_rsa.pub
+        key_reuse_seconds:
+            description: Seconds a push is reused.
+            type: int
+            default: 40
+        push_workers:
+            description: SendSSHPublicKey calls in flight with push_keys.
+            type: int
+            default: 16
+        max_region_workers:
+            description: Profile and region pairs listed at the same time.
+            type: int
+            default: 4
+        page_size:
+            description: Instances per DescribeInstances page.
+            type: int
+            default: 1000
+        engine:
+            description: AWS client eicproxy uses.
+            type: str
+            choices: ['lite', 'boto3']
+            default: lite
+'''
+
+EXAMPLES = r'''
+# prod.eicproxy.yml
+plugin: eicproxy
+profiles: [prod]
+regions: [us-east-1, eu-west-1]
+user: ec2-user
+jumphost: My-Bastion
+keyed_groups:
+  - key: ec2_tags.Role
+    prefix: role
+'''
+
+from ansible.errors import AnsibleError, AnsibleParserError
+from ansible.plugins.inventory import BaseInventoryPlugin, Constructable
+
+try:
+    from libeicproxy import ansible_inventory
+    from libeicproxy.gen_config import GenConfigError
+except ImportError as e:
+    ansible_inventory = None
+    import_error = e
+
+
+class InventoryModule(BaseInventoryPlugin, Constructable):
+
+    NAME = 'eicproxy'
+
+    def verify_file(self, path):
+        return super().verify_file(path) and path.endswith(('eicproxy.yml', 'eicproxy.yaml'))
+
+    def parse(self, inventory, loader, path, cache=True):
+        super().parse(inventory, loader, path, cache)
+        if ansible_inventory is None:
+            raise AnsibleError(f'the eicproxy inventory plugin needs eicproxy installed: {import_error}')
+        self._read_config_data(path)
+        options = {name: self.get_option(name) for name in ansible_inventory.default_options}
+        try:
+            hosts, warnings = ansible_inventory.build(options)
+        except (GenConfigError, OSError) as e:
+            raise AnsibleParserError(str(e))
+        for warning in warnings:
+            self.display.warning(warning)
+
+        strict = self.get_option('strict')
+        for hostname, variables, groups in hosts:
+            self.inventory.add_host(hostname)
+            for group in groups:
+                self.inventory.add_group(group)
+                self.inventory.add_child(group, hostname)
+            for name, value in variables.items():
+                self.inventory.set_variable(hostname, name, value)
+            self._set_composite_vars(self.get_option('compose'), variables, hostname, strict=strict)
+            self._add_host_to_composed_groups(self.get_option('groups'), variables, hostname, strict=strict)
+            self._add_host_to_keyed_groups(self.get_option('keyed_groups'), variables, hostname, strict=strict)
@@ -0,0 +1,687 @@
+"""
+Resolves an ssh host token to an instance address and authorizes the ssh user on it.
+
+The Broker is what the eicproxy script runs in-process, and what the eicproxy agent keeps
+resident so that sessions, clients and lookup state stay warm between connections.  AWS
+clients come from libeicproxy.lite_client by default, boto3 is only imported for profiles
+the lite client cannot handle or when the boto3 engine is asked for.
+"""
+
+import threading
+import time
+
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+
+from . import defaults, ec2_util, happy_eyeballs, instrument, parse_connection, resolvers
+from .instance_cache import InstanceCache, default_ttl as default_cache_ttl
+from .key_publisher import KeyPushLedger, key_fingerprint, push_public_keys
+from .name_index import NameIndex, best_first
+from .region_affinity import RegionAffinity
+from .region_search import RegionSearchError, first_hit
+from .single_flight import FlightFailed, SingleFlight
+
+fallback_region = 'us-east-1'
+
+
+class BrokerError(Exception):
+    """
+    Raised when a connection cannot be authorized. The message is meant for the ssh user.
+    """
+
+
+def error_code(error):
+    """
+    Returns the AWS error code of an API exception, or None for other exceptions.
+    """
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
+
+
+class SessionPool(object):
+    """
+    Keeps one session and client per (profile, region, service) alive.
+    """
+    def __init__(self, engine=defaults.engine):
+        """
+        :param engine: 'lite' to use libeicproxy.lite_client where possible, 'boto3' to always use boto3
+        :type engine: basestring
+        """
+        self.engine = engine
+        self.credential_cache_ = None
+        self.rate_limiter_ = None
+        self.sessions_ = {}
+        self.clients_ = {}
+        self.lock_ = threading.Lock()
+
+    def session(self, profile, region=None):
+        """
+        Returns the session for a profile and region, creating it on first use.
+        """
+        key = (profile, region)
+        with self.lock_:
+            if key not in self.sessions_:
+                self.sessions_[key] = self._new_session(profile, region)
+            return self.sessions_[key]
+
+    def credential_cache(self):
+        if self.credential_cache_ is None:
+            from .credential_cache import CredentialCache
+            self.credential_cache_ = CredentialCache()
+        return self.credential_cache_
+
+    def rate_limiter(self):
+        if self.rate_limiter_ is None:
+            from .throttle import RateLimiter
+            self.rate_limiter_ = RateLimiter()
+        return self.rate_limiter_
+
+    def _new_session(self, profile, region):
+        if self.engine == 'lite':
+            from . import lite_client
+            try:
+                with instrument.phase('session', engine='lite', profile=profile, region=region):
+                    return lite_client.Session(profile_name=profile, region_name=region)
+            except lite_client.UnsupportedProfile:
+                pass
+            try:
+                # assume role, SSO and the like: boto3 resolves the credentials once per lifetime,
+                # the lite client uses them from the credential cache in the meantime
+                with instrument.phase('session', engine='lite', profile=profile, region=region, cached_credentials=True):
+                    return lite_client.Session(profile_name=profile, region_name=region,
+                                               credentials_provider=self.credential_cache().credentials)
+            except lite_client.UnsupportedProfile:
+                pass
+        with instrument.phase('session', engine='boto3', profile=profile, region=region):
+            import boto3
+            session = boto3.session.Session(profile_name=profile, region_name=region)
+        if instrument.enabled():
+            # boto3 resolves credentials lazily on the first call, resolve them here to time them apart
+            with instrument.phase('credentials', engine='boto3', profile=profile):
+                session.get_credentials()
+        return session
+
+    def client(self, profile, region, service):
+        """
+        Returns the client for a service in a profile and region, creating it on first use.
+        Its calls are rate limited and retried, see libeicproxy.throttle.
+        """
+        key = (profile, region, service)
+        client = self.clients_.get(key)
+        if client is None:
+            session = self.session(profile, region)
+            with self.lock_:
+                # boto3 sessions are not thread safe, client creation is serialized
+                client = self.clients_.get(key)
+                if client is None:
+                    from .throttle import Throttle
+                    client = Throttle(self.rate_limiter(), profile, region or session.region_name,
+                                      service).install(session.client(service))
+                    self.clients_[key] = client
+        return client
+
+    def default_region(self, profile):
+        """
+        Returns the region configured for a profile, or fallback_region.
+        """
+        return self.session(profile).region_name or fallback_region
+
+
+class Broker(object):
+    """
+    Resolves, caches and authorizes ssh connections to EC2 instances.
+    """
+    def __init__(self, pool=None):
+        self.pools_ = {pool.engine: pool} if pool else {}
+        self.caches_ = {}
+        self.ledgers_ = {}
+        self.name_index_ = None
+        self.path_memory_ = None
+        self.region_affinity_ = None
+        self.eice_endpoints_ = None
+        self.single_flight_ = None
+        self.lock_ = threading.Lock()
+
+    def pool(self, engine=None):
+        """
+        Returns the session pool for an engine, see defaults.engines.
+        """
+        engine = engine or defaults.engine
+        with self.lock_:
+            if engine not in self.pools_:
+                self.pools_[engine] = SessionPool(engine)
+            return self.pools_[engine]
+
+    def instance_cache(self, ttl):
+        with self.lock_:
+            if ttl not in self.caches_:
+                self.caches_[ttl] = InstanceCache(ttl=ttl)
+            return self.caches_[ttl]
+
+    def ledger(self, reuse_seconds):
+        with self.lock_:
+            if reuse_seconds not in self.ledgers_:
+                self.ledgers_[reuse_seconds] = KeyPushLedger(reuse_seconds=reuse_seconds)
+            return self.ledgers_[reuse_seconds]
+
+    def regions(self, request):
+        return request.get('regions') or [self.pool(request.get('engine')).default_region(request['profile'])]
+
+    def name_index(self):
+        with self.lock_:
+            if self.name_index_ is None:
+                self.name_index_ = NameIndex()
+            return self.name_index_
+
+    def path_memory(self):
+        with self.lock_:
+            if self.path_memory_ is None:
+                self.path_memory_ = happy_eyeballs.PathMemory()
+            return self.path_memory_
+
+    def region_affinity(self):
+        with self.lock_:
+            if self.region_affinity_ is None:
+                self.region_affinity_ = RegionAffinity()
+            return self.region_affinity_
+
+    def eice_endpoints(self):
+        with self.lock_:
+            if self.eice_endpoints_ is None:
+                from .eice import EndpointCache
+                self.eice_endpoints_ = EndpointCache()
+            return self.eice_endpoints_
+
+    def single_flight(self):
+        with self.lock_:
+            if self.single_flight_ is None:
+                self.single_flight_ = SingleFlight()
+            return self.single_flight_
+
+    def describe_instance(self, region, instance_id, request):
+        """
+        Describes one instance by id in a region.
+
+        :return: Instance record, or None if the instance is not in this region
+        :rtype: libeicproxy.ec2_util.InstanceRecord
+        """
+        ec2_client = self.pool(request.get('engine')).client(request['profile'], region, 'ec2')
+        with instrument.phase('describe', region=region, instance_id=instance_id) as timing:
+            try:
+                response = ec2_client.describe_instances(InstanceIds=[instance_id])
+            except Exception as e:
+                if error_code(e) in ('InvalidInstanceID.NotFound', 'InvalidInstanceID.Malformed'):
+                    timing.set(found=False)
+                    return None
+                raise
+        reservation = response['Reservations'][0]
+        return ec2_util.instance_info(reservation['Instances'][0], region, reservation.get('OwnerId'))
+
+    def find_named(self, region, request):
+        """
+        Looks the requested tag Name up in one region's name index.
+
+        :return: Instance record of the best ranked match with the ids of the other
+           matches in duplicates, or None if no instance in this region carries the name
+        :rtype: libeicproxy.ec2_util.InstanceRecord
+        """
+        profile = request['profile']
+        ec2_client = self.pool(request.get('engine')).client(profile, region, 'ec2')
+        with instrument.phase('tag_lookup', region=region, host=request['host_token']) as timing:
+            found = self.name_index().lookup(ec2_client, profile, region, request['host_token'],
+                                            flight=self.single_flight())
+            timing.set(matches=len(found))
+        if not found:
+            return None
+        instance_info = found[0]
+        if instance_info.state != 'running':
+            # the index may predate a start, the instance itself has the final say
+            instance_info = self.describe_instance(region, instance_info.instance_id, request) or instance_info
+        instance_info.duplicates = [other.instance_id for other in found[1:]]
+        return instance_info
+
+    def find_matching(self, region, request, filters):
+        """
+        Looks instances up in one region by DescribeInstances filters, e.g. by address or tag.
+
+        :return: Instance record of the best ranked match (see name_index.best_first) with
+           the ids of the other matches in duplicates, or None if no instance matches
+        :rtype: libeicproxy.ec2_util.InstanceRecord
+        """
+        ec2_client = self.pool(request.get('engine')).client(request['profile'], region, 'ec2')
+        with instrument.phase('describe', region=region, filters=filters) as timing:
+            found = best_first(ec2_util.describe_matching(ec2_client, region, filters))
+            timing.set(matches=len(found))
+        if not found:
+            return None
+        found[0].duplicates = [other.instance_id for other in found[1:]]
+        return found[0]
+
+    def host_kind(self, request):
+        """
+        Returns the kind of the requested host, see parse_connection.HOST_KINDS.
+        """
+        if request.get('use_tag_name'):
+            return 'name'
+        return request.get('host_kind') or parse_connection.host_kind(request['host_token'])
+
+    def resolve(self, request):
+        """
+        Resolves the requested host, from the instance cache when possible. Processes resolving
+        the same host at the same time share one lookup, see single_flight.
+
+        :param request: Connection request, see authorize
+        :type request: dict
+        :return: Instance record
+        :rtype: libeicproxy.ec2_util.InstanceRecord
+        :raises BrokerError: if the host cannot be found
+        """
+        profile = request['profile']
+        host_token = request['host_token']
+        cache = self.instance_cache(request.get('cache_ttl', 0))
+        asked = time.time()
+        instance_info = None if request.get('refresh_cache') else cache.get(profile, host_token)
+        instrument.event('instance_cache', host=host_token, hit=bool(instance_info))
+        if instance_info:
+            return instance_info
+
+        key = ('describe', profile, host_token, self.host_kind(request), self.regions(request),
+               request.get('tag_keys'), request.get('name_conflict'))
+        try:
+            return self.single_flight().run(key, lambda: self.lookup(request, cache), ec2_util.InstanceRecord.as_dict,
+                                            lambda fields: ec2_util.InstanceRecord(**fields), since=asked)
+        except FlightFailed as e:
+            raise BrokerError(str(e))
+
+    def lookup(self, request, cache):
+        """
+        Looks the requested host up through the resolver chain and caches the instance it
+        resolved to, see resolve.
+
+        :param cache: Instance cache to fill
+        :type cache: libeicproxy.instance_cache.InstanceCache
+        :rtype: libeicproxy.ec2_util.InstanceRecord
+        :raises BrokerError: if the host cannot be found
+        """
+        profile = request['profile']
+        host_token = request['host_token']
+        kind = self.host_kind(request)
+        instance_info = None
+        # region affinity is learned for instance ids, other hosts are not unique across regions
+        affinity = self.region_affinity() if cache.ttl > 0 and kind == 'instance_id' else None
+        errors = {}
+        searched = []
+        for resolver in resolvers.chain(kind, request.get('tag_keys')):
+            regions = resolver.regions(host_token, self.regions(request))
+            searched += [region for region in regions if region not in searched]
+            if affinity is None:
+                stages = [regions]
+            else:
+                stages = affinity.stages(profile, host_token, regions, ignore_misses=request.get('refresh_cache'))
+                instrument.event('region_affinity', host=host_token, stages=stages)
+
+            def find(region, resolver=resolver):
+                instance_info = resolver.find(self, region, host_token, request)
+                if instance_info is None and affinity is not None:
+                    affinity.miss(profile, host_token, region)
+                return instance_info
+
+            for stage in stages:
+                try:
+                    instance_info = first_hit(find, stage, max_workers=request.get('max_region_workers', len(stage)),
+                                              ordered=resolver.ordered, errors=errors)
+                except RegionSearchError as e:
+                    # a region listed earlier failed: a match further down the order may not be the instance meant
+                    if resolver.ordered:
+                        raise BrokerError(self.lookup_errors(host_token, e.errors))
+                if instance_info:
+                    break
+            if instance_info:
+                break
+        if not instance_info and errors:
+            raise BrokerError(self.lookup_errors(host_token, errors))
+        if instance_info and errors:
+            # instance ids are unique, the hit stands, but the failing regions are not hidden
+            instrument.event('region_errors', host=host_token, errors={region: str(error) for region, error in errors.items()})
+        if not instance_info:
+            if affinity is not None and not stages:
+                raise BrokerError(f'Error: Did not find {host_token} in any region: {searched} '
+                                  f'(all missed within the last {affinity.miss_ttl} seconds, --refresh-cache looks again)')
+            raise BrokerError(f'Error: Did not find {host_token} ({kind.replace("_", " ")}) in any region: {searched}')
+        if affinity is not None:
+            affinity.hit(profile, host_token, instance_info.region, getattr(instance_info, 'account', None))
+        duplicates = getattr(instance_info, 'duplicates', None)
+        if duplicates and request.get('name_conflict', defaults.name_conflict) == 'error':
+            raise BrokerError(f'Error: {host_token} names {len(duplicates) + 1} instances in {instance_info.region}: '
+                              f'{", ".join([instance_info.instance_id] + duplicates)}')
+        if instance_info.state == 'running':
+            cache.put(profile, host_token, instance_info)
+        return instance_info
+
+    def lookup_errors(self, host_token, errors):
+        """
+        Returns the BrokerError message of regions whose lookup failed.
+        """
+        return '\n'.join(f'Error: lookup of {host_token} in region {region} failed: {error}'
+                         for region, error in errors.items())
+
+    def listing_errors(self, errors):
+        """
+        Returns the BrokerError message of regions whose instances could not be listed.
+        """
+        return '\n'.join(f'Error: listing instances in region {region} failed: {error}'
+                         for region, error in errors.items())
+
+    def push_key(self, instance_info, request):
+        """
+        Pushes the request's public key to the instance unless a fresh push can be reused.
+
+        :return: True if the key was pushed, by this process or one it shared the push with
+        :rtype: bool
+        """
+        os_user = request['os_user']
+        pub_key = request['public_key']
+        ledger = self.ledger(request.get('key_reuse_seconds', 0))
+        fingerprint = key_fingerprint(pub_key)
+        asked = time.time()
+        if ledger.is_fresh(instance_info.instance_id, os_user, fingerprint):
+            instrument.event('key_push', instance_id=instance_info.instance_id, reused=True)
+            return False
+
+        pool = self.pool(request.get('engine'))
+
+        def push():
+            connect_client = pool.client(request['profile'], instance_info.region, 'ec2-instance-connect')
+            pushed_at = time.time()
+            with instrument.phase('key_push', instance_id=instance_info.instance_id, reused=False):
+                connect_client.send_ssh_public_key(
+                    InstanceId=instance_info.instance_id,
+                    InstanceOSUser=os_user,
+                    SSHPublicKey=pub_key,
+                    AvailabilityZone=instance_info.availability_zone
+                )
+            ledger.record(instance_info.instance_id, os_user, fingerprint, pushed_at)
+            return True
+
+        # processes pushing the same key at the same time share one push
+        return self.single_flight().run(('push', request['profile'], instance_info.instance_id, os_user, fingerprint),
+                                        push, since=asked)
+
+    def target(self, request):
+        """
+        Resolves the requested host to the address to connect to, without pushing the key.
+
+        :param request: Connection request, see authorize
+        :type request: dict
+        :return: dict with the ip to connect to, the candidates to race for a direct connection
+           (see happy_eyeballs.candidates) and the network they lead into, plus instance_id, region
+           and availability_zone, and a warning when the tag Name matched several instances. With
+           eice in the request, the presigned tunnel_url and endpoint_id of the instance's EC2
+           Instance Connect Endpoint, see tunnel
+        :rtype: dict
+        :raises BrokerError: if the host cannot be found, or has no endpoint to tunnel through
+        """
+        instance_info = self.resolve(request)
+        network = happy_eyeballs.network_of(instance_info)
+        preferred = self.path_memory().get(network)
+        response = {'ip': self.address(instance_info, request),
+                    'candidates': happy_eyeballs.candidates(instance_info, request.get('use_private_ip'), preferred),
+                    'network': network,
+                    'instance_id': instance_info.instance_id,
+                    'region': instance_info.region,
+                    'availability_zone': instance_info.availability_zone}
+        duplicates = getattr(instance_info, 'duplicates', None)
+        if duplicates:
+            response['warning'] = (f'Warning: {request["host_token"]} also names {", ".join(duplicates)}, '
+                                   f'using {instance_info.state} {instance_info.instance_id}')
+        if request.get('eice'):
+            response['ip'] = instance_info.private_ip
+            response['tunnel_url'], response['endpoint_id'] = self.tunnel(instance_info, request)
+        return response
+
+    def tunnel(self, instance_info, request):
+        """
+        Signs the url of a tunnel to the instance's private address and the request's port through
+        the EC2 Instance Connect Endpoint of its VPC.
+
+        :return: (presigned url, endpoint id)
+        :rtype: tuple
+        :raises BrokerError: if the instance is not in a VPC with a ready endpoint
+        """
+        from . import eice
+
+        if not instance_info.vpc_id or not instance_info.private_ip:
+            raise BrokerError(f'Error: {instance_info.instance_id} has no private address in a VPC to tunnel to')
+        pool = self.pool(request.get('engine'))
+        profile, region = request['profile'], instance_info.region
+        try:
+            endpoint_id, dns_name = self.eice_endpoints().lookup(pool.client(profile, region, 'ec2'), profile, region,
+                                                                 instance_info.vpc_id, instance_info.subnet_id,
+                                                                 flight=self.single_flight())
+        except (eice.NoEndpoint, FlightFailed) as e:
+            raise BrokerError(f'Error: {e}')
+        except Exception as e:
+            raise BrokerError(f'Error: looking up the EC2 Instance Connect Endpoint of {instance_info.vpc_id} failed: {e}')
+        credentials = pool.session(profile, region).get_credentials()
+        # boto3 credentials may refresh underneath, sign with one consistent set
+        if hasattr(credentials, 'get_frozen_credentials'):
+            credentials = credentials.get_frozen_credentials()
+        return eice.tunnel_url(dns_name, endpoint_id, instance_info.private_ip, request.get('port', 22), region,
+                               credentials), endpoint_id
+
+    def authorize_target(self, target, request):
+        """
+        Pushes the request's ssh key to a target returned by target().
+
+        :raises BrokerError: if the key cannot be pushed
+        """
+        try:
+            self.push_key(Namespace(**target), request)
+        except Exception as e:
+            raise BrokerError(f'Error while pushing the public key:\n{e}')
+
+    def authorize(self, request):
+        """
+        Resolves the requested host and pushes the ssh key to it.
+
+        :param request: Connection request with the keys os_user, host_token, profile, public_key and
+           optionally regions, use_private_ip, use_tag_name, host_kind, tag_keys, cache_ttl, refresh_cache,
+           key_reuse_seconds, max_region_workers, name_conflict and engine
+        :type request: dict
+        :return: See target
+        :rtype: dict
+        :raises BrokerError: if the host cannot be found or the key cannot be pushed
+        """
+        target = self.target(request)
+        self.authorize_target(target, request)
+        return target
+
+    def resolve_many(self, request, hosts, errors=None):
+        """
+        Resolves many hosts (instance ids or tag Names) with batched DescribeInstances calls.
+
+        Cached hosts cost nothing, the rest are looked up in every requested region at once. A
+        name found in several regions resolves in the first region of the request's order, several
+        instances sharing a name are ranked like the name index does, see name_index.best_first.
+
+        :param request: Connection request without host_token, see authorize
+        :type request: dict
+        :param hosts: Host tokens to resolve
+        :type hosts: list
+        :param errors: Filled with region -> exception for the regions that could not be listed, the
+           hosts found elsewhere are still returned. Without it a failing region raises BrokerError
+        :type errors: dict
+        :return: dict of host token to instance record, unresolved hosts are absent
+        :rtype: dict
+        :raises BrokerError: if a region could not be listed and errors is not given
+        """
+        profile = request['profile']
+        cache = self.instance_cache(request.get('cache_ttl', 0))
+        resolved = {}
+        if not request.get('refresh_cache'):
+            for host in hosts:
+                instance_info = cache.get(profile, host)
+                if instance_info:
+                    resolved[host] = instance_info
+        ids = [host for host in hosts if host not in resolved and ec2_util.INSTANCE_ID_RE.match(host)]
+        names = [host for host in hosts if host not in resolved and not ec2_util.INSTANCE_ID_RE.match(host)]
+        if not ids and not names:
+            return resolved
+
+        pool = self.pool(request.get('engine'))
+        regions = self.regions(request)
+
+        failed = {}
+
+        def lookup(region):
+            try:
+                client = pool.client(profile, region, 'ec2')
+                return list(ec2_util.describe_in_batches(client, region, ids, names))
+            except Exception as e:
+                failed[region] = e
+                return []
+
+        with ThreadPoolExecutor(max_workers=max(1, min(request.get('max_region_workers', len(regions)),
+                                                       len(regions)))) as executor:
+            found = list(executor.map(lookup, regions))
+        if failed and errors is None:
+            raise BrokerError(self.listing_errors(failed))
+        if failed:
+            errors.update(failed)
+
+        id_set = set(ids)
+        name_set = set(names)
+        for region_found in found:
+            region_resolved = {}
+            for instance_info in region_found:
+                matches = [host for host in (instance_info.instance_id, instance_info.name)
+                           if host in id_set or host in name_set]
+                for host in matches:
+                    if host in resolved:
+                        continue
+                    best = region_resolved.get(host)
+                    region_resolved[host] = best_first([instance_info, best] if best else [instance_info])[0]
+            resolved.update(region_resolved)
+            for host, instance_info in region_resolved.items():
+                if instance_info.state == 'running':
+                    cache.put(profile, host, instance_info)
+        return resolved
+
+    def select_tagged(self, request, tags):
+        """
+        Lists the running instances carrying all the given tags in every requested region.
+
+        :param request: Connection request without host_token, see authorize
+        :type request: dict
+        :param tags: (key, value) pairs, an instance has to match all of them
+        :type tags: list
+        :return: Instance records by region order, then instance id
+        :rtype: list
+        :raises BrokerError: if any region could not be listed
+        """
+        filters = [{'Name': f'tag:{key}', 'Values': [value]} for key, value in tags]
+        pool = self.pool(request.get('engine'))
+        regions = self.regions(request)
+
+        def select(region):
+            client = pool.client(request['profile'], region, 'ec2')
+            with instrument.phase('describe', region=region, filters=filters) as timing:
+                found = [info for info in ec2_util.describe_matching(client, region, filters)
+                         if info.state == 'running']
+                timing.set(matches=len(found))
+            return sorted(found, key=lambda info: info.instance_id)
+
+        selected = []
+        with ThreadPoolExecutor(max_workers=max(1, min(request.get('max_region_workers', len(regions)), len(regions)))) as executor:
+            futures = [executor.submit(select, region) for region in regions]
+            errors = {}
+            for region, future in zip(regions, futures):
+                try:
+                    selected += future.result()
+                except Exception as e:
+                    errors[region] = e
+        if errors:
+            raise BrokerError(self.listing_errors(errors))
+        return selected
+
+    def prefetch(self, request, hosts, push_keys=True, max_workers=None, errors=None):
+        """
+        Resolves many hosts in bulk and pushes the request's key to the running ones in parallel,
+        filling the lookup cache and push ledger the following ProxyCommand runs use.
+
+        :param request: Connection request without host_token, see authorize
+        :type request: dict
+        :param hosts: Host tokens to prefetch
+        :type hosts: list
+        :param push_keys: Whether to push the public key
+        :type push_keys: bool
+        :param max_workers: Maximum number of key pushes in flight, defaults to defaults.push_workers
+        :type max_workers: int
+        :param errors: See resolve_many
+        :type errors: dict
+        :return: One dict per host with host, instance_id, region, ip, state and status
+        :rtype: list
+        :raises BrokerError: if a region could not be listed and errors is not given
+        """
+        resolved = self.resolve_many(request, hosts, errors=errors)
+        pushes = {}
+        if push_keys:
+            pool = self.pool(request.get('engine'))
+            running = {info.instance_id: info for info in resolved.values() if info.state == 'running'}
+            pushes = push_public_keys(
+                lambda region: pool.client(request['profile'], region, 'ec2-instance-connect'),
+                running.values(), request['os_user'], request['public_key'],
+                ledger=self.ledger(request.get('key_reuse_seconds', 0)),
+                max_workers=max_workers or defaults.push_workers)
+
+        results = []
+        for host in hosts:
+            instance_info = resolved.get(host)
+            if instance_info is None:
+                results.append({'host': host, 'status': 'not found'})
+                continue
+            pushed = pushes.get(instance_info.instance_id)
+            if instance_info.state != 'running':
+                status = instance_info.state
+            elif isinstance(pushed, Exception):
+                status = f'key push failed: {pushed}'
+            else:
+                status = {True: 'key pushed', False: 'key fresh', None: 'resolved'}[pushed]
+            results.append({'host': host,
+                            'instance_id': instance_info.instance_id,
+                            'region': instance_info.region,
+                            'ip': self.address(instance_info, request),
+                            'state': instance_info.state,
+                            'status': status})
+        return results
+
+    def address(self, instance_info, request):
+        """
+        Returns the address to connect to, the private ip if asked for or if there is no public ip.
+        """
+        if request.get('use_private_ip') or not instance_info.public_ip:
+            return instance_info.private_ip
+        return instance_info.public_ip
+
+    def remember_path(self, request):
+        """
+        Records the network path a connection got through, later targets in the same network
+        list it first.
+
+        :param request: dict with the network and path of the winning candidate
+        :type request: dict
+        """
+        self.path_memory().put(request.get('network'), request['path'])
+
+    def invalidate(self, request):
+        """
+        Forgets the cached lookup for the requested host, e.g. when its address was unreachable, and
+        with eice in the request the endpoint of its VPC.
+        """
+        cache = self.instance_cache(request.get('cache_ttl') or default_cache_ttl)
+        instance_info = cache.get(request['profile'], request['host_token'])
+        cache.invalidate(request['profile'], request['host_token'])
+        if self.host_kind(request) == 'name' and instance_info is not None:
+            self.name_index().forget(request['profile'], instance_info.instance_id)
+        if request.get('eice') and instance_info is not None and instance_info.vpc_id:
+            self.eice_endpoints().forget(request['profile'], instance_info.region, instance_info.vpc_id)
+
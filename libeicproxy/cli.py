@@ -0,0 +1,94 @@
+"""
+Command line options shared by the eicproxy ProxyCommand and its subcommands.
+"""
+
+import argparse
+import os
+import sys
+
+from os.path import expanduser
+
+from . import defaults
+
+default_key_file_path_public = f'{expanduser("~")}/.ssh/id_rsa.pub'
+
+# resolved the same way boto3 does, without paying for importing it
+default_aws_profile = os.environ.get('AWS_PROFILE') or os.environ.get('AWS_DEFAULT_PROFILE') or 'default'
+
+default_use_private_ip = False
+
+
+def add_common_arguments(parser):
+    """
+    Adds the AWS, lookup cache and key push options to an argparse parser.
+    """
+    parser.add_argument('--public-key-file', type=argparse.FileType('r'),
+                        default=None, help=f'Public key file to use for connection. Default: {default_key_file_path_public}')
+    parser.add_argument('--regions', type=str, nargs='+', default=None, help='Look for the instance in the given regions. Default: the region configured for the profile, or us-east-1')
+    parser.add_argument('--max-region-workers', type=int, default=defaults.max_region_workers, help=f'Maximum number of regions searched at the same time. Default: {defaults.max_region_workers}', metavar='')
+    parser.add_argument('--use-private-ip', action='store_true', help='Use private IP even if public IP is available. eicproxy will use private ip automatically, if no public IP is available.', default=default_use_private_ip)
+    parser.add_argument('--tag-keys', type=str, nargs='+', default=[], metavar='KEY',
+                        help='Tag keys besides Name whose value a host may be, tried in order after the Name tag, e.g. Hostname.')
+    parser.add_argument('--profile', action='store', help='AWS Config Profile', type=str, default=default_aws_profile, metavar='')
+    parser.add_argument('--cache-ttl', action='store', help=f'Seconds to reuse a cached instance lookup, 0 disables the cache. Default: {defaults.cache_ttl}', type=int, default=defaults.cache_ttl, metavar='')
+    parser.add_argument('--refresh-cache', action='store_true', help='Ignore any cached instance lookup and replace it with a fresh one.')
+    parser.add_argument('--no-cache', action='store_true', help='Neither read nor write the instance lookup cache.')
+    parser.add_argument('--key-reuse-seconds', type=int, default=defaults.key_reuse_seconds, help=f'Skip SendSSHPublicKey if the same key was pushed to the instance and user within this many seconds, 0 always pushes. Default: {defaults.key_reuse_seconds}', metavar='')
+    parser.add_argument('--trace', type=str, default=None, metavar='',
+                        help='Record how long each phase (session, credentials, describe, key push, connect, ...) takes as JSON lines to stderr (- or stderr) or a file, or as metrics to statsd://host:port. Default: $EICPROXY_TRACE, off')
+    parser.add_argument('--engine', choices=defaults.engines, default=defaults.engine, help=f'AWS client to use. lite is a built-in client for the three API calls eicproxy makes and falls back to boto3 for profiles it cannot handle (assume role, SSO, credential_process). Default: {defaults.engine}')
+
+
+def request_from_args(args, **fields):
+    """
+    Builds a Broker request from parsed common options plus the given fields. The public key is
+    read from --public-key-file unless the fields carry one.
+
+    :param args: Parsed arguments of a parser set up with add_common_arguments
+    :type args: argparse.Namespace
+    :return: Broker request
+    :rtype: dict
+    """
+    request = {
+        'profile': args.profile,
+        'regions': args.regions,
+        'use_private_ip': args.use_private_ip,
+        'tag_keys': args.tag_keys,
+        'cache_ttl': 0 if args.no_cache else args.cache_ttl,
+        'refresh_cache': args.refresh_cache,
+        'key_reuse_seconds': args.key_reuse_seconds,
+        'max_region_workers': args.max_region_workers,
+        'engine': args.engine,
+    }
+    request.update(fields)
+    if 'public_key' not in request:
+        request['public_key'] = read_public_key(args)
+    return request
+
+
+def read_public_key(args):
+    """
+    Returns the contents of --public-key-file, or of the default public key file.
+    """
+    if args.public_key_file is not None:
+        return args.public_key_file.read()
+    try:
+        with open(default_key_file_path_public) as f:
+            return f.read()
+    except OSError as e:
+        sys.exit(f"can't open public key file {default_key_file_path_public}: {e}")
+
+
+def read_hosts(hosts, hosts_file=None):
+    """
+    Returns host tokens given on the command line plus those in hosts_file ('-' for stdin),
+    one per line, ignoring blank lines and # comments. Each host is listed once, in the order
+    it was first given.
+    """
+    hosts = list(hosts or ())
+    if hosts_file:
+        for line in hosts_file:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                hosts.append(line)
+    return list(dict.fromkeys(hosts))
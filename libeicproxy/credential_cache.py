@@ -0,0 +1,154 @@
+"""
+Persistent cache of the temporary credentials of profiles only boto3 can resolve.
+
+Profiles with role_arn, MFA, SSO or credential_process make boto3 run AssumeRole (and prompt
+for an MFA code), read the SSO token cache or run a process on every eicproxy run.  Here the
+resulting temporary credentials are kept in a sqlite database readable by the user only, so
+that happens once per credential lifetime and every run in between goes straight to the lite
+client without importing boto3.  A lock file per profile makes concurrent runs that all find
+the credentials stale wait for the one that refreshes them instead of each assuming the role.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import time
+
+from contextlib import contextmanager
+from os.path import dirname, expanduser, join
+
+from . import lite_client, state
+
+DB_NAME = 'credentials.sqlite'
+SCHEMA_VERSION = 1
+SCHEMA = (
+    '''CREATE TABLE credentials (
+           profile TEXT NOT NULL PRIMARY KEY,
+           fingerprint TEXT NOT NULL,
+           access_key TEXT NOT NULL,
+           secret_key TEXT NOT NULL,
+           token TEXT,
+           expiry_time REAL NOT NULL
+       ) WITHOUT ROWID''',
+)
+
+# cached credentials are replaced this many seconds before they expire, like botocore's advisory refresh
+refresh_margin = 15 * 60
+
+
+def profile_fingerprint(profile):
+    """
+    Returns a digest of the profile's configuration, cached credentials of a profile whose
+    role, source profile or MFA device changed since are not used.
+    """
+    config_file = expanduser(os.environ.get('AWS_CONFIG_FILE', '~/.aws/config'))
+    try:
+        section = lite_client._config_section(lite_client._read_ini(config_file), profile)
+    except lite_client.UnsupportedProfile:
+        section = None
+    return hashlib.sha256(json.dumps([config_file, profile, section], sort_keys=True).encode()).hexdigest()
+
+
+def boto3_credentials(profile):
+    """
+    Resolves a profile's credentials with boto3: assumes the role, prompts for the MFA code,
+    reads the SSO token or runs credential_process as the profile says.
+
+    :rtype: lite_client.Credentials
+    :raises lite_client.UnsupportedProfile: if boto3 finds no credentials either
+    """
+    import boto3
+    import botocore.exceptions
+
+    try:
+        credentials = boto3.session.Session(profile_name=profile).get_credentials()
+    except botocore.exceptions.ProfileNotFound as e:
+        raise lite_client.UnsupportedProfile(str(e))
+    if credentials is None:
+        raise lite_client.UnsupportedProfile(f'no credentials found for profile {profile}')
+    # freezing refreshes deferred credentials, the expiry is only known after that
+    frozen = credentials.get_frozen_credentials()
+    expiry = getattr(credentials, '_expiry_time', None)
+    return lite_client.Credentials(frozen.access_key, frozen.secret_key, frozen.token,
+                                   expiry.timestamp() if expiry is not None else None)
+
+
+class CredentialCache(object):
+    """
+    sqlite backed profile -> temporary credentials cache shared by all eicproxy processes.
+    """
+    def __init__(self, resolve=boto3_credentials, margin=refresh_margin, path=None):
+        """
+        :param resolve: Resolves a profile's credentials when the cache has no fresh ones
+        :type resolve: callable
+        :param margin: Seconds before their expiry cached credentials count as stale
+        :type margin: int
+        :param path: Explicit database path, defaults to the eicproxy cache directory
+        :type path: basestring
+        """
+        self.resolve = resolve
+        self.margin = margin
+        self.db_ = state.Database(DB_NAME, SCHEMA, SCHEMA_VERSION, path=path)
+        # sqlite gives the -wal and -shm files the mode of the database
+        os.chmod(self.db_.path, 0o600)
+
+    def get(self, profile):
+        """
+        Returns the profile's cached credentials if they are fresh and were resolved with the
+        profile's current configuration, otherwise None.
+
+        :rtype: lite_client.Credentials
+        """
+        row = self.db_.execute(
+            'SELECT access_key, secret_key, token, expiry_time FROM credentials '
+            'WHERE profile = ? AND fingerprint = ? AND expiry_time > ?',
+            (profile, profile_fingerprint(profile), time.time() + self.margin)).fetchone()
+        return lite_client.Credentials(*row) if row is not None else None
+
+    def put(self, profile, credentials):
+        """
+        Stores temporary credentials, credentials without expiry are not cached.
+        """
+        if credentials.expiry_time is None:
+            return
+        self.db_.execute(
+            'INSERT OR REPLACE INTO credentials (profile, fingerprint, access_key, secret_key, token, expiry_time) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (profile, profile_fingerprint(profile), credentials.access_key, credentials.secret_key,
+             credentials.token, credentials.expiry_time))
+
+    def forget(self, profile):
+        """
+        Drops a profile's cached credentials, e.g. when AWS rejected them.
+        """
+        self.db_.execute('DELETE FROM credentials WHERE profile = ?', (profile,))
+
+    @contextmanager
+    def _locked(self, profile):
+        digest = hashlib.sha256(str(profile).encode()).hexdigest()[:16]
+        fd = os.open(join(dirname(self.db_.path), f'credentials-{digest}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def credentials(self, profile):
+        """
+        Returns fresh credentials for a profile, from the cache or resolved and cached. Usable
+        as the credentials_provider of a lite_client.Session.
+
+        :rtype: lite_client.Credentials
+        :raises lite_client.UnsupportedProfile: if no credentials can be found for the profile
+        """
+        credentials = self.get(profile)
+        if credentials is not None:
+            return credentials
+        with self._locked(profile):
+            # another process may have refreshed them while this one waited for the lock
+            credentials = self.get(profile)
+            if credentials is None:
+                credentials = self.resolve(profile)
+                self.put(profile, credentials)
+        return credentials
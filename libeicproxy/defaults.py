@@ -0,0 +1,70 @@
+"""
+Defaults shared by the eicproxy script and the library.
+
+Kept free of heavy imports: the script reads these before it knows whether an eicproxy
+agent will do the actual work.
+"""
+
+import os
+
+from os.path import expanduser, join
+
+CACHE_DIR_ENV = 'EICPROXY_CACHE_DIR'
+
+# seconds a cached instance lookup is reused
+cache_ttl = 300
+# seconds a SendSSHPublicKey push is reused, EIC keeps a pushed key for 60 seconds
+key_reuse_seconds = 40
+# regions searched at the same time
+max_region_workers = 4
+# SendSSHPublicKey calls running at the same time for bulk pushes
+push_workers = 16
+# seconds after which the tag Name index of a region is refreshed in the background
+name_index_refresh_after = 300
+# seconds after which the tag Name index of a region is refreshed before it is used
+name_index_max_age = 86400
+# what to do when several instances share a tag Name: 'first' picks the best ranked, 'error' refuses
+name_conflict = 'first'
+name_conflicts = ('first', 'error')
+# pre-generated ephemeral keys kept ready per key type
+key_pool_size = 4
+ephemeral_key_type = 'ed25519'
+ephemeral_key_types = ('ed25519', 'rsa')
+# seconds ssh-agent keeps an ephemeral key, EIC accepts a pushed key for 60 seconds
+ephemeral_key_lifetime = 120
+# seconds a multiplexed jumphost connection stays up after its last ssh -W stream closed, 0 disables
+jumphost_persist = 600
+# seconds a region an instance id was not found in is skipped when looking the id up again
+region_miss_ttl = 600
+# seconds a connection attempt to one address of an instance gets before the next address is tried too
+connect_attempt_delay = 0.25
+# seconds the EC2 Instance Connect Endpoint of a VPC is reused before it is looked up again
+eice_endpoint_ttl = 3600
+# seconds an EC2 Instance Connect Endpoint keeps a tunnel open at most, 3600 is the service maximum
+eice_max_tunnel_duration = 3600
+# attempts per AWS API call, retryable errors are retried with full jitter exponential backoff
+api_max_attempts = 5
+# seconds the backoff before the first retry is at most, doubling with each retry up to retry_max_delay
+retry_base_delay = 0.1
+retry_max_delay = 5.0
+# seconds a process waits for another one making the same lookup or key push before making it itself
+single_flight_wait = 60
+# AWS client implementation: 'lite' (libeicproxy.lite_client, falls back to boto3) or 'boto3'
+engine = 'lite'
+engines = ('lite', 'boto3')
+
+
+def cache_dir():
+    """
+    Returns the eicproxy cache directory, creating it if needed.
+
+    Honours EICPROXY_CACHE_DIR, then XDG_CACHE_HOME, then ~/.cache/eicproxy.
+
+    :return: Path to the cache directory
+    :rtype: basestring
+    """
+    path = os.environ.get(CACHE_DIR_ENV)
+    if not path:
+        path = join(os.environ.get('XDG_CACHE_HOME') or expanduser('~/.cache'), 'eicproxy')
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
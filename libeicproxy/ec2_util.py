@@ -11,64 +11,300 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
-from argparse import Namespace
-import sys
+"""
+EC2 instance lookups, as streams of small records.
 
+describe() pages through DescribeInstances by instance id and/or filters and yields one
+InstanceRecord per instance, built from the few fields eicproxy uses; each page is dropped
+before the next is requested, so listing a fleet of any size takes the memory of a page plus
+what the caller keeps.  Lookups that fail are yielded as InstanceError results in the stream,
+records() turns them back into exceptions for callers that want them raised.
+"""
 
-def get_instance_data(session, instance_id):
+import datetime
+import re
+
+INSTANCE_ID_RE = re.compile(r'^i-[0-9a-f]{8,17}$')
+# DescribeInstances accepts at most 200 values per filter
+filter_values_max = 200
+live_states = ['pending', 'running', 'shutting-down', 'stopping', 'stopped']
+# launch times are kept as ISO 8601 UTC text, so they compare and sort as strings
+launch_time_format = '%Y-%m-%dT%H:%M:%SZ'
+
+
+class InstanceRecord(object):
     """
-    Calls EC2 DescribeInstances API to get the DNS Names and IP addresses of the instance both Public and Private
-    and also gets the Availability Zone of an instance
+    What eicproxy knows about an instance. Attributes not set are None.
+    """
+    #: Fields read from DescribeInstances
+    FIELDS = ('instance_id', 'region', 'availability_zone', 'state', 'public_ip', 'private_ip',
+              'public_dns_name', 'private_dns_name', 'ipv6_address', 'subnet_id', 'vpc_id', 'name',
+              'launch_time')
+    # account: owner of the reservation, tags: all tags when asked for, profile and duplicates
+    # (ids of other instances matching the same host) are filled in by the caller
+    __slots__ = FIELDS + ('account', 'tags', 'profile', 'duplicates')
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, fields.pop(field, None))
+        if fields:
+            raise TypeError(f'unknown instance fields: {", ".join(fields)}')
+
+    def as_dict(self):
+        """
+        Returns the attributes that are set, InstanceRecord(**record.as_dict()) copies a record.
+        """
+        return {field: getattr(self, field) for field in self.__slots__ if getattr(self, field) is not None}
+
+    def __repr__(self):
+        return 'InstanceRecord(' + ', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__
+                                             if getattr(self, field) is not None) + ')'
+
+
+class InstanceError(Exception):
+    """
+    A lookup that failed, yielded by describe() in place of records, or raised.
+    """
+    code = None
+
+
+class InstanceNotFound(InstanceError):
+    """
+    An instance id asked for is not in the region, or terminated.
+    """
+    code = 'InvalidInstanceID.NotFound'
+
+    def __init__(self, instance_id, region):
+        self.instance_id = instance_id
+        self.region = region
+        super().__init__(f'instance {instance_id} not found in region {region}')
+
+
+class DescribeFailed(InstanceError):
+    """
+    A DescribeInstances call failed, the instances it asked for are unknown.
+    """
+    def __init__(self, error, region, instance_ids=()):
+        """
+        :param error: The exception the client raised
+        :type error: Exception
+        :param instance_ids: The ids the call asked for, if any
+        :type instance_ids: list
+        """
+        self.error = error
+        self.region = region
+        self.instance_ids = list(instance_ids)
+        # shaped like a botocore ClientError, so error codes read the same from either
+        self.response = getattr(error, 'response', {})
+        self.code = self.response.get('Error', {}).get('Code')
+        super().__init__(str(error))
+
+
+class NoAddress(InstanceError):
+    """
+    An instance has no address to connect to.
+    """
+    def __init__(self, instance_id, region):
+        self.instance_id = instance_id
+        self.region = region
+        super().__init__(f'no hostname or IPs found for instance {instance_id} in region {region}')
+
+
+def client_region(client):
+    """
+    Returns the region of an EC2 client (boto3 or lite_client).
+    """
+    return getattr(client, 'region_name', None) or client.meta.region_name
+
+
+def get_instance_data(session, instance_id, cache=None, profile=None):
+    """
+    Looks one instance up by id with DescribeInstances.
 
     :param session: A Botocore session to use to generate the EC2 client
     :type session: Botocore.session.Session
     :param instance_id: InstanceID of the instance
     :type instance_id: basestring
-    :return: Namespace with Public DNS Name, Private DNS Name, Public IP, Private IP and Availability Zone
-    :rtype: argparse.Namespace
+    :param cache: Optional resolution cache. A fresh entry is returned without calling DescribeInstances.
+    :type cache: libeicproxy.instance_cache.InstanceCache
+    :param profile: AWS profile name, used as part of the cache key
+    :type profile: basestring
+    :return: The instance's addresses, DNS names, Availability Zone, subnet, VPC and state
+    :rtype: InstanceRecord
+    :raises InstanceError: InstanceNotFound, NoAddress or DescribeFailed
     """
+    if cache is not None:
+        instance_info = cache.get(profile, instance_id)
+        if instance_info is not None:
+            return instance_info
+
+    client = session.create_client('ec2')
+    region = client_region(client)
+    for instance_info in records(describe(client, region, instance_ids=[instance_id]), missing=True):
+        if not (instance_info.public_dns_name or instance_info.private_dns_name or instance_info.public_ip
+                or instance_info.private_ip or instance_info.ipv6_address):
+            raise NoAddress(instance_id, region)
+        if cache is not None and instance_info.state == 'running':
+            cache.put(profile, instance_info.instance_id, instance_info)
+        return instance_info
+    raise InstanceNotFound(instance_id, region)
+
 
+def launch_time(value):
+    """
+    Normalizes a LaunchTime to ISO 8601 UTC, e.g. 2024-01-01T12:00:00Z.
+
+    boto3 parses it into a datetime, lite_client keeps the API's text
+    (2024-01-01T12:00:00.000Z); both end up in the same format.
+
+    :param value: LaunchTime as DescribeInstances returned it
+    :type value: datetime.datetime or basestring
+    :return: The launch time, '' when unknown, the value itself when it cannot be parsed
+    :rtype: basestring
+    """
+    if not value:
+        return ''
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc)
+        return value.strftime(launch_time_format)
     try:
-        client = session.create_client('ec2')
-        instance_id = [instance_id]
-        response = client.describe_instances(InstanceIds=instance_id)
-        availability_zone = response['Reservations'][0]['Instances'][0]['Placement']['AvailabilityZone']
-        try:
-            public_dns_name = response['Reservations'][0]['Instances'][0]['PublicDnsName']
-        except:
-            public_dns_name = None
-            pass
-        try:
-            private_dns_name = response['Reservations'][0]['Instances'][0]['PrivateDnsName']
-        except:
-            private_dns_name = None
-            pass
-        try:
-            public_ip = response['Reservations'][0]['Instances'][0]['PublicIpAddress']
-        except:
-            public_ip = None
-            pass
+        return datetime.datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S').strftime(launch_time_format)
+    except ValueError:
+        return value
+
+
+def instance_info(instance, region, owner=None, tags=False):
+    """
+    Builds the record eicproxy works with from a DescribeInstances instance dict.
+
+    :param instance: One entry of a reservation's Instances list
+    :type instance: dict
+    :param region: Region the instance was found in
+    :type region: basestring
+    :param owner: Account id owning the reservation
+    :type owner: basestring
+    :param tags: Keep all tags as a dict in the record's tags, not just the Name
+    :type tags: bool
+    :rtype: InstanceRecord
+    """
+    tag_dict = {tag['Key']: tag['Value'] for tag in instance.get('Tags', ())}
+    return InstanceRecord(instance_id=instance['InstanceId'],
+                          region=region,
+                          availability_zone=instance['Placement']['AvailabilityZone'],
+                          state=instance['State']['Name'],
+                          public_ip=instance.get('PublicIpAddress'),
+                          private_ip=instance.get('PrivateIpAddress'),
+                          public_dns_name=instance.get('PublicDnsName') or None,
+                          private_dns_name=instance.get('PrivateDnsName') or None,
+                          ipv6_address=instance.get('Ipv6Address'),
+                          subnet_id=instance.get('SubnetId'),
+                          vpc_id=instance.get('VpcId'),
+                          name=tag_dict.get('Name'),
+                          launch_time=launch_time(instance.get('LaunchTime')),
+                          account=owner,
+                          tags=tag_dict if tags else None)
+
+
+def _pages(client, filters, page_size):
+    paginator = client.get_paginator('describe_instances')
+    return paginator.paginate(Filters=filters, PaginationConfig={'PageSize': page_size})
+
+
+def describe(client, region, instance_ids=(), filters=(), page_size=1000, tags=False):
+    """
+    Streams the instances with the given ids and/or matching DescribeInstances filters,
+    terminated ones excepted.
+
+    Ids are sent as instance-id filters, filter_values_max per call, so unknown ids do not fail
+    the call they share. Without ids every instance matching the filters is listed.
+
+    :param client: EC2 client (boto3 or lite_client)
+    :param region: Region of the client
+    :type region: basestring
+    :param instance_ids: Instance ids to look up
+    :type instance_ids: list
+    :param filters: DescribeInstances filters, e.g. [{'Name': 'tag:Role', 'Values': ['web']}]
+    :type filters: list
+    :param page_size: MaxResults per DescribeInstances page
+    :type page_size: int
+    :param tags: Keep every tag in the records, see instance_info
+    :type tags: bool
+    :return: Generator of InstanceRecord, of InstanceNotFound for every id asked for that was not
+       found and of DescribeFailed for every call that failed
+    """
+    filters = list(filters) + [{'Name': 'instance-state-name', 'Values': live_states}]
+    instance_ids = list(dict.fromkeys(instance_ids))
+    chunks = [instance_ids[start:start + filter_values_max]
+              for start in range(0, len(instance_ids), filter_values_max)] if instance_ids else [None]
+    for chunk in chunks:
+        chunk_filters = filters if chunk is None else [{'Name': 'instance-id', 'Values': chunk}] + filters
+        missing = set(chunk or ())
         try:
-            private_ip = response['Reservations'][0]['Instances'][0]['PrivateIpAddress']
-        except:
-            private_ip = None
-            pass
-    except Exception as e:
-        print(str(e))
-        sys.exit(1)
-    else:
-        if len(availability_zone) == 0:
-            print("Instance zone information not found")
-            sys.exit(7)
-        if not (public_dns_name or private_dns_name or public_ip or private_ip):
-            print("No hostname or IPs found")
-            sys.exit(8)
-        else:
-            instance_info = Namespace(public_dns_name=public_dns_name,
-                                      private_dns_name=private_dns_name,
-                                      public_ip=public_ip,
-                                      private_ip=private_ip,
-                                      availability_zone=availability_zone
-                                      )
-
-    return instance_info
+            for page in _pages(client, chunk_filters, page_size):
+                for reservation in page['Reservations']:
+                    owner = reservation.get('OwnerId')
+                    for instance in reservation['Instances']:
+                        missing.discard(instance['InstanceId'])
+                        yield instance_info(instance, region, owner, tags)
+        except Exception as e:
+            yield DescribeFailed(e, region, chunk or ())
+            continue
+        for instance_id in chunk or ():
+            if instance_id in missing:
+                yield InstanceNotFound(instance_id, region)
+
+
+def records(results, missing=False):
+    """
+    Passes the records of a describe() stream on, raising its DescribeFailed results.
+
+    :param missing: Raise InstanceNotFound results too, instead of dropping them
+    :type missing: bool
+    :return: Generator of InstanceRecord
+    :raises DescribeFailed: when a DescribeInstances call failed
+    """
+    for result in results:
+        if isinstance(result, InstanceRecord):
+            yield result
+        elif missing or not isinstance(result, InstanceNotFound):
+            raise result
+
+
+def describe_in_batches(client, region, instance_ids=(), names=(), page_size=1000):
+    """
+    Looks up many instances by id and/or tag Name with as few DescribeInstances calls as possible.
+
+    :param instance_ids: Instance ids to look up
+    :type instance_ids: list
+    :param names: Name tag values to look up
+    :type names: list
+    :return: Generator of InstanceRecord, ids and names not found are absent
+    :raises DescribeFailed: when a DescribeInstances call failed
+    """
+    if instance_ids:
+        yield from records(describe(client, region, instance_ids=instance_ids, page_size=page_size))
+    names = list(names)
+    for start in range(0, len(names), filter_values_max):
+        yield from records(describe(client, region, page_size=page_size,
+                                    filters=[{'Name': 'tag:Name', 'Values': names[start:start + filter_values_max]}]))
+
+
+def describe_matching(client, region, filters, page_size=1000, tags=False):
+    """
+    Lists every instance matching DescribeInstances filters, terminated ones excepted.
+
+    :return: Generator of InstanceRecord
+    :raises DescribeFailed: when a DescribeInstances call failed
+    """
+    return records(describe(client, region, filters=filters, page_size=page_size, tags=tags))
+
+
+def describe_named(client, region, page_size=1000, tags=False):
+    """
+    Lists every instance carrying a Name tag, terminated ones excepted.
+
+    :return: Generator of InstanceRecord
+    :raises DescribeFailed: when a DescribeInstances call failed
+    """
+    return describe_matching(client, region, [{'Name': 'tag-key', 'Values': ['Name']}], page_size, tags)
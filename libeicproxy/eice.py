@@ -0,0 +1,210 @@
+"""
+Connecting to private instances through an EC2 Instance Connect Endpoint (EICE).
+
+An EICE in the instance's VPC opens a TCP connection to the instance's private address on
+behalf of a WebSocket client: the client opens wss://<endpoint dns name>/openTunnel with the
+instance, port and endpoint in a SigV4 presigned query string, and every binary message then
+carries the TCP stream.  No bastion, no second ssh handshake.
+
+The endpoint of each VPC is looked up with DescribeInstanceConnectEndpoints once and kept in
+endpoints.sqlite, as is the absence of one for a while.  The broker signs the tunnel url (so
+an agent holding the credentials can hand it to the ProxyCommand), the ProxyCommand opens the
+tunnel and relays it: open_tunnel() bridges the WebSocket to a local socket pair, so the
+regular relay (with its gate and statistics) runs on it unchanged.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from urllib.parse import urlencode
+
+from . import defaults, instrument, state, websocket
+
+DB_NAME = 'endpoints.sqlite'
+SCHEMA_VERSION = 1
+SCHEMA = (
+    '''CREATE TABLE endpoints (
+           profile TEXT NOT NULL,
+           region TEXT NOT NULL,
+           vpc_id TEXT NOT NULL,
+           endpoint_id TEXT,
+           dns_name TEXT,
+           expires REAL NOT NULL,
+           PRIMARY KEY (profile, region, vpc_id)
+       ) WITHOUT ROWID''',
+)
+
+SIGNING_NAME = 'ec2-instance-connect'
+# ws://host:port (or wss://) the tunnel is opened on instead of the endpoint's DNS name, for tests
+TUNNEL_URL_ENV = 'EICPROXY_EICE_URL'
+# seconds the presigned tunnel url is valid, the tunnel has to be opened within them
+url_expires = 60
+# seconds a VPC without an endpoint is remembered as such
+missing_ttl = 300
+ready_state = 'create-complete'
+# bytes read from the local end of the bridge per WebSocket message
+message_bytes = 64 * 1024
+
+
+class NoEndpoint(Exception):
+    """
+    Raised when the instance's VPC has no usable EC2 Instance Connect Endpoint.
+    """
+
+
+def pick_endpoint(endpoints, subnet_id=None):
+    """
+    Picks the endpoint to use among a VPC's: ready ones only, one in the instance's subnet
+    first, then the lowest id.
+
+    :param endpoints: DescribeInstanceConnectEndpoints entries
+    :type endpoints: list
+    :return: The endpoint, or None
+    :rtype: dict
+    """
+    ready = [endpoint for endpoint in endpoints if endpoint.get('State') == ready_state and endpoint.get('DnsName')]
+    ready.sort(key=lambda endpoint: (endpoint.get('SubnetId') != subnet_id, endpoint['InstanceConnectEndpointId']))
+    return ready[0] if ready else None
+
+
+class EndpointCache(object):
+    """
+    sqlite backed (profile, region, VPC) -> EC2 Instance Connect Endpoint.
+    """
+    def __init__(self, ttl=defaults.eice_endpoint_ttl, path=None):
+        """
+        :param ttl: Seconds an endpoint lookup is reused
+        :type ttl: int
+        :param path: Explicit database path, defaults to the eicproxy cache directory
+        :type path: basestring
+        """
+        self.ttl = ttl
+        self.path = path
+        self.db_ = None
+
+    def _db(self):
+        # opened on first use: the cache is an optimization, failing to open it is a miss
+        if self.db_ is None:
+            self.db_ = state.Database(DB_NAME, SCHEMA, SCHEMA_VERSION, path=self.path)
+        return self.db_
+
+    def lookup(self, client, profile, region, vpc_id, subnet_id=None, flight=None):
+        """
+        Returns the endpoint of a VPC, from the cache or DescribeInstanceConnectEndpoints.
+
+        :param client: EC2 client for the region (boto3 or lite_client)
+        :param flight: Shares the DescribeInstanceConnectEndpoints call with other processes
+           looking up the same VPC at the same time
+        :type flight: libeicproxy.single_flight.SingleFlight
+        :return: (endpoint id, DNS name)
+        :rtype: tuple
+        :raises NoEndpoint: if the VPC has no ready endpoint
+        """
+        asked = time.time()
+        try:
+            row = self._db().execute('SELECT endpoint_id, dns_name FROM endpoints '
+                                     'WHERE profile = ? AND region = ? AND vpc_id = ? AND expires > ?',
+                                     (profile, region, vpc_id, asked)).fetchone()
+        except sqlite3.Error:
+            row = None
+        if row is None:
+            def describe():
+                with instrument.phase('eice_lookup', region=region, vpc_id=vpc_id) as timing:
+                    response = client.describe_instance_connect_endpoints(
+                        Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]}])
+                    endpoint = pick_endpoint(response.get('InstanceConnectEndpoints', []), subnet_id)
+                    timing.set(endpoint_id=endpoint and endpoint['InstanceConnectEndpointId'])
+                found = [endpoint['InstanceConnectEndpointId'], endpoint['DnsName']] if endpoint else [None, None]
+                try:
+                    self._db().execute('INSERT OR REPLACE INTO endpoints VALUES (?, ?, ?, ?, ?, ?)',
+                                       (profile, region, vpc_id, *found,
+                                        time.time() + (self.ttl if endpoint else missing_ttl)))
+                except sqlite3.Error:
+                    pass
+                return found
+
+            row = flight.run(('eice', profile, region, vpc_id), describe, since=asked) if flight else describe()
+        if row[0] is None:
+            raise NoEndpoint(f'no EC2 Instance Connect Endpoint in {vpc_id} ({region}), create one or use --jumphost')
+        return tuple(row)
+
+    def forget(self, profile, region, vpc_id):
+        """
+        Drops a VPC's endpoint, e.g. after opening a tunnel through it failed.
+        """
+        try:
+            self._db().execute('DELETE FROM endpoints WHERE profile = ? AND region = ? AND vpc_id = ?',
+                               (profile, region, vpc_id))
+        except sqlite3.Error:
+            pass
+
+
+def tunnel_url(dns_name, endpoint_id, private_ip, port, region, credentials,
+               max_duration=defaults.eice_max_tunnel_duration):
+    """
+    Returns the presigned openTunnel url of an instance's address and port.
+
+    :param credentials: Credentials with access_key, secret_key and token
+    :param max_duration: Seconds the endpoint keeps the tunnel open at most
+    :type max_duration: int
+    :rtype: basestring
+    """
+    from .lite_client import presign_url
+
+    base = os.environ.get(TUNNEL_URL_ENV) or f'wss://{dns_name}'
+    query = urlencode({'instanceConnectEndpointId': endpoint_id, 'maxTunnelDuration': str(max_duration),
+                       'privateIpAddress': private_ip, 'remotePort': str(port)})
+    return presign_url('GET', f'{base.rstrip("/")}/openTunnel?{query}', region, SIGNING_NAME, credentials,
+                       expires=url_expires)
+
+
+def _to_websocket(local, ws):
+    try:
+        while True:
+            data = local.recv(message_bytes)
+            if not data:
+                break
+            ws.send(data)
+    except OSError:
+        pass
+    # a WebSocket cannot be half closed: ask to close, what the instance still sends comes in until
+    # the endpoint answers
+    ws.close()
+
+
+def _from_websocket(local, ws):
+    try:
+        while True:
+            data = ws.recv()
+            if not data:
+                break
+            local.sendall(data)
+    except OSError:
+        pass
+    finally:
+        ws.close()
+        ws.sock.close()
+        try:
+            local.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+def open_tunnel(url, timeout=websocket.default_timeout):
+    """
+    Opens a tunnel and returns a socket standing for the TCP connection to the instance.
+
+    :param url: Presigned openTunnel url, see tunnel_url
+    :type url: basestring
+    :return: One end of a socket pair, the WebSocket is bridged to the other by two threads
+    :rtype: socket.socket
+    :raises OSError: if the tunnel cannot be opened
+    """
+    ws = websocket.connect(url, timeout=timeout)
+    local, bridged = socket.socketpair()
+    for direction in (_to_websocket, _from_websocket):
+        threading.Thread(target=direction, args=(bridged, ws), daemon=True).start()
+    return local
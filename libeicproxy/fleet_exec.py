@@ -0,0 +1,280 @@
+"""
+`eicproxy exec`: runs a command on many instances at a bounded concurrency.
+
+One process does the setup for the whole fleet: the hosts are resolved with batched
+DescribeInstances calls (or selected by tag), and the key is pushed a batch of --concurrency
+instances at a time, just before the batch's turn so pushes do not expire waiting.  ssh then
+connects straight to each instance's address, no ProxyCommand and so no Python interpreter per
+host.  Every host's output is streamed prefixed with the host, or as JSON lines, and the exit
+codes are collected.
+"""
+
+import argparse
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+from . import cli, defaults, instrument
+
+default_concurrency = 32
+default_os_user = 'ec2-user'
+default_connect_timeout = 10
+# exit code of a host that was not found, not running or could not be authorized
+setup_failed = 255
+
+
+class Output(object):
+    """
+    Serializes the lines of all hosts onto stdout and stderr.
+    """
+    def __init__(self, as_json, width):
+        self.as_json = as_json
+        self.width = width
+        self.lock_ = threading.Lock()
+
+    def emit(self, record):
+        """
+        Writes a record: a dict with the host and either a line of its output (plus the stream
+        it came from), its exit code or an error.
+        """
+        if self.as_json:
+            text, out = json.dumps(record) + '\n', sys.stdout
+        elif 'line' in record:
+            text = f"{record['host']:{self.width}} | {record['line']}\n"
+            out = sys.stderr if record['stream'] == 'stderr' else sys.stdout
+        elif 'error' in record:
+            text, out = f"{record['host']:{self.width}} ! {record['error']}\n", sys.stderr
+        else:
+            text, out = f"{record['host']:{self.width}} = exit {record['exit_code']} in {record['seconds']:.1f}s\n", sys.stderr
+        with self.lock_:
+            out.write(text)
+            out.flush()
+
+
+def ssh_command(args, instance_info, address, identity_file):
+    """
+    Returns the ssh command running args.command on one instance.
+    """
+    command = ['ssh', '-T', '-p', str(args.port), '-l', args.user,
+               '-o', 'BatchMode=yes',
+               # known_hosts entries follow the instance, not whatever address it has today
+               '-o', f'HostKeyAlias={instance_info.instance_id}',
+               '-o', f'StrictHostKeyChecking={args.strict_host_key_checking}',
+               '-o', f'ConnectTimeout={args.connect_timeout}']
+    if identity_file:
+        command += ['-i', identity_file, '-o', 'IdentitiesOnly=yes']
+    if args.jumphost:
+        command += ['-J', args.jumphost]
+    for option in args.ssh_option:
+        command += ['-o', option]
+    return command + ['--', address] + args.command
+
+
+def _stream(pipe, host, name, output, instance_id):
+    with pipe:
+        for raw in iter(pipe.readline, b''):
+            output.emit({'host': host, 'instance_id': instance_id, 'stream': name,
+                         'line': raw.decode(errors='replace').rstrip('\n')})
+
+
+def run_one(args, broker, request, host, instance_info, identity_file, output, pushed_at=None):
+    """
+    Runs the command on one instance, re-pushing the key if the batch push went stale.
+
+    :param pushed_at: time.monotonic() of the batch push of the key to the instance, None if it was
+       not pushed then
+    :type pushed_at: float
+    :return: The host's exit code, setup_failed if it could not be reached
+    :rtype: int
+    """
+    from .broker import BrokerError
+
+    started = time.monotonic()
+    # the batch push is used as is while fresh, whatever --key-reuse-seconds says
+    if pushed_at is None or started - pushed_at >= defaults.key_reuse_seconds:
+        try:
+            broker.authorize_target({'instance_id': instance_info.instance_id, 'region': instance_info.region,
+                                     'availability_zone': instance_info.availability_zone}, request)
+        except BrokerError as e:
+            output.emit({'host': host, 'instance_id': instance_info.instance_id, 'error': str(e).replace('\n', ' ')})
+            return setup_failed
+    address = broker.address(instance_info, request)
+    with instrument.phase('exec', host=host, instance_id=instance_info.instance_id) as timing:
+        process = subprocess.Popen(ssh_command(args, instance_info, address, identity_file),
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        readers = [threading.Thread(target=_stream, args=(pipe, host, name, output, instance_info.instance_id))
+                   for pipe, name in ((process.stdout, 'stdout'), (process.stderr, 'stderr'))]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        exit_code = process.wait()
+        timing.set(exit_code=exit_code)
+    output.emit({'host': host, 'instance_id': instance_info.instance_id, 'exit_code': exit_code,
+                 'seconds': round(time.monotonic() - started, 3)})
+    return exit_code
+
+
+def identity_for(args):
+    """
+    Returns the private key matching --public-key-file, None to leave it to ssh.
+    """
+    public_path = args.public_key_file.name if args.public_key_file is not None else cli.default_key_file_path_public
+    if public_path.endswith('.pub') and os.path.exists(public_path[:-len('.pub')]):
+        return public_path[:-len('.pub')]
+    return None
+
+
+def main(argv):
+    """
+    Entry point for `eicproxy exec`.
+    """
+    parser = argparse.ArgumentParser(prog='eicproxy exec',
+                                     description='Run a command on many EC2 instances over ssh, pushing the key with EC2 Instance Connect.',
+                                     usage='eicproxy exec [options] (HOST ... | --hosts-file FILE | --tag KEY=VALUE ...) -- COMMAND ...')
+    parser.add_argument('hosts', type=str, nargs='*', help='Instance ids or Name tags to run the command on.')
+    parser.add_argument('--hosts-file', type=argparse.FileType('r'), default=None, metavar='',
+                        help='Read more hosts from this file, one per line, - for stdin.')
+    parser.add_argument('--tag', type=str, action='append', default=[], metavar='KEY=VALUE',
+                        help='Run on every running instance carrying this tag in the --regions, repeat to require several tags.')
+    parser.add_argument('--user', type=str, default=default_os_user, metavar='',
+                        help=f'OS user to run the command as. Default: {default_os_user}')
+    parser.add_argument('--port', type=int, default=22, metavar='', help='ssh port. Default: 22')
+    parser.add_argument('--concurrency', type=int, default=default_concurrency, metavar='',
+                        help=f'Hosts the command runs on at the same time, and keys pushed per batch. Default: {default_concurrency}')
+    parser.add_argument('--jumphost', type=str, default=None, metavar='',
+                        help='ssh config Host to jump through, implies --use-private-ip.')
+    parser.add_argument('--ssh-option', type=str, action='append', default=[], metavar='',
+                        help='Extra ssh -o option, repeatable, e.g. --ssh-option ServerAliveInterval=15')
+    parser.add_argument('--strict-host-key-checking', type=str, default='accept-new', metavar='',
+                        help='ssh StrictHostKeyChecking, host keys are recorded under the instance id. Default: accept-new')
+    parser.add_argument('--connect-timeout', type=int, default=default_connect_timeout, metavar='',
+                        help=f'ssh ConnectTimeout in seconds. Default: {default_connect_timeout}')
+    parser.add_argument('--json', action='store_true',
+                        help='Print JSON lines: one per line of output with host, stream and line, one per host with its exit_code or error.')
+    cli.add_common_arguments(parser)
+    if '--' in argv:
+        split = argv.index('--')
+        argv, command = argv[:split], argv[split + 1:]
+    else:
+        command = []
+    args = parser.parse_args(argv)
+    args.command = command
+    if not args.command:
+        parser.error('no command given, put it after --')
+    if args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+    tags = []
+    for selector in args.tag:
+        key, equals, value = selector.partition('=')
+        if not equals or not key:
+            parser.error(f'--tag {selector}: KEY=VALUE expected')
+        tags.append((key, value))
+    hosts = cli.read_hosts(args.hosts, args.hosts_file)
+    if not hosts and not tags:
+        parser.error('no hosts given, name them or select them with --tag')
+    if args.jumphost:
+        args.use_private_ip = True
+    try:
+        instrument.configure(args.trace)
+    except (OSError, ValueError) as e:
+        parser.error(f'--trace: {e}')
+
+    from .broker import Broker, BrokerError
+    from .ec2_util import InstanceError
+    from .key_publisher import push_public_keys
+
+    broker = Broker()
+    request = cli.request_from_args(args, os_user=args.user)
+    try:
+        with instrument.phase('exec_resolve', hosts=len(hosts), tags=len(tags)):
+            resolved = broker.resolve_many(request, hosts) if hosts else {}
+            targets = []
+            known = set()
+            for host in hosts:
+                info = resolved.get(host)
+                if info is not None:
+                    # a Name and an instance id may both name the same instance, run on it once
+                    if info.instance_id in known:
+                        continue
+                    known.add(info.instance_id)
+                targets.append((host, info))
+            if tags:
+                labels = set(hosts)
+                for info in broker.select_tagged(request, tags):
+                    if info.instance_id in known:
+                        continue
+                    # instances sharing a Name are told apart by their id
+                    label = info.name if info.name and info.name not in labels else info.instance_id
+                    labels.add(label)
+                    targets.append((label, info))
+    except (BrokerError, InstanceError) as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    if not targets:
+        print('Error: no instance carries the tags given', file=sys.stderr)
+        return 1
+
+    output = Output(args.json, max(len(host) for host, _info in targets))
+    exit_codes = {}
+    runnable = []
+    for host, info in targets:
+        if info is None or info.state != 'running':
+            output.emit({'host': host, 'error': 'not found' if info is None else info.state})
+            exit_codes[host] = setup_failed
+        else:
+            runnable.append((host, info))
+
+    identity_file = identity_for(args)
+    pool = broker.pool(request.get('engine'))
+    ledger = broker.ledger(request.get('key_reuse_seconds', 0))
+    # holds at most one batch beyond the running hosts, so pushed keys are used before they expire
+    work = queue.Queue(maxsize=args.concurrency)
+
+    workers = max(1, min(args.concurrency, len(runnable)))
+
+    def feed():
+        for start in range(0, len(runnable), args.concurrency):
+            batch = runnable[start:start + args.concurrency]
+            with instrument.phase('key_push_batch', instances=len(batch)):
+                pushed_at = time.monotonic()
+                pushes = push_public_keys(lambda region: pool.client(request['profile'], region, 'ec2-instance-connect'),
+                                          [info for _host, info in batch], request['os_user'], request['public_key'],
+                                          ledger=ledger, max_workers=args.concurrency)
+            for host, info in batch:
+                work.put((host, info, pushed_at if pushes.get(info.instance_id) is True else None))
+        for _ in range(workers):
+            work.put(None)
+
+    def worker():
+        while True:
+            target = work.get()
+            if target is None:
+                return
+            host, info, pushed_at = target
+            try:
+                exit_codes[host] = run_one(args, broker, request, host, info, identity_file, output, pushed_at)
+            except OSError as e:
+                output.emit({'host': host, 'instance_id': info.instance_id, 'error': f'could not run ssh: {e}'})
+                exit_codes[host] = setup_failed
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    threads += [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    from .throttle import stats
+
+    failed = sorted(host for host, code in exit_codes.items() if code != 0)
+    if not args.json:
+        print(f'{len(exit_codes) - len(failed)} of {len(exit_codes)} hosts succeeded'
+              + (f', failed: {" ".join(failed)}' if failed else ''), file=sys.stderr)
+        if stats.summary():
+            print(stats.summary(), file=sys.stderr)
+    return 1 if failed else 0
@@ -0,0 +1,301 @@
+"""
+`eicproxy gen-config`: writes ssh Host entries for a whole fleet into a managed ssh config file.
+
+Every instance carrying a Name tag in the requested profiles and regions becomes
+
+    Host <alias from the Name tag>
+      HostName <instance id>
+      ProxyCommand eicproxy %r@%h:%p --profile <profile> --regions <region>
+
+so users connect by name while eicproxy looks the instance up by id in the one region it
+lives in.  DescribeInstances is paged through and every page is dropped once its entries are
+built, only what ranks instances sharing an alias is kept next to each entry, and tags are
+only asked for with --jumphost-tag.  Only the entries that changed are edited, and the file is only replaced, atomically,
+when something did change.  --include-into adds the Include line ~/.ssh/config needs.
+"""
+
+import argparse
+import collections
+import os
+import re
+import shlex
+import sys
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+from os.path import expanduser
+
+from . import cli, defaults, ec2_util, sshconf
+
+default_output = '~/.ssh/eicproxy.conf'
+default_ssh_config = '~/.ssh/config'
+default_alias_format = '{name}'
+default_page_size = 1000
+header = ['# Generated by eicproxy gen-config, changes to this file are overwritten.', '']
+
+# what name_index.best_first ranks instances sharing an alias by, kept instead of their records
+Rank = collections.namedtuple('Rank', ('instance_id', 'state', 'launch_time'))
+
+# characters ssh treats as pattern syntax or separators in Host lines
+_alias_unsafe = re.compile(r'[\s*?!#,"]+')
+
+
+class GenConfigError(Exception):
+    """
+    Raised when the fleet cannot be listed completely, the config file is left alone then.
+    """
+
+
+def alias_for(alias_format, instance_info, profile):
+    """
+    Returns the Host alias of an instance, see --alias-format.
+    """
+    alias = alias_format.format(name=instance_info.name, instance_id=instance_info.instance_id,
+                                region=instance_info.region, profile=profile)
+    return _alias_unsafe.sub('-', alias).strip('-')
+
+
+def host_entry(instance_info, profile, jumphost, args):
+    """
+    Returns the settings of an instance's Host entry.
+
+    :return: dict of ssh config keys to values
+    :rtype: dict
+    """
+    command = [args.eicproxy_command, '%r@%h:%p', '--profile', shlex.quote(profile),
+               '--regions', instance_info.region]
+    if jumphost:
+        command += ['--use-private-ip', '--jumphost', shlex.quote(jumphost)]
+    if args.proxy_args:
+        command.append(args.proxy_args)
+    entry = {'HostName': instance_info.instance_id, 'ProxyCommand': ' '.join(command)}
+    if args.user:
+        entry['User'] = args.user
+    return entry
+
+
+def list_entries(pool, profile, region, args, records=False):
+    """
+    Builds the Host entries of one profile and region, a DescribeInstances page at a time.
+
+    :param records: Keep each instance's record, with the profile and all its tags, instead of
+       its Rank only
+    :type records: bool
+    :return: List of (alias, instance record or Rank, entry)
+    :rtype: list
+    """
+    from .name_index import best_first
+
+    client = pool.client(profile, region, 'ec2')
+    entries = {}
+    for info in ec2_util.describe_named(client, region, args.page_size, tags=records or bool(args.jumphost_tag)):
+        jumphost = info.tags.get(args.jumphost_tag) if args.jumphost_tag else None
+        if not jumphost and not info.public_ip:
+            jumphost = args.jumphost
+        alias = alias_for(args.alias_format, info, profile)
+        if not alias:
+            continue
+        if records:
+            info.profile = profile
+        rank = info if records else Rank(info.instance_id, info.state, info.launch_time)
+        if alias in entries and best_first([entries[alias][0], rank])[0] is not rank:
+            continue
+        entries[alias] = (rank, host_entry(info, profile, jumphost, args))
+    return [(alias, info, entry) for alias, (info, entry) in entries.items()]
+
+
+def desired_entries(pool, pairs, args, records=False):
+    """
+    Lists the fleet in all (profile, region) pairs at once.
+
+    :param records: See list_entries
+    :type records: bool
+    :return: dict of alias to (instance record or Rank, entry), ranked like the name index where
+       several instances end up with the same alias
+    :rtype: dict
+    :raises GenConfigError: if any region could not be listed
+    """
+    from .name_index import best_first
+
+    def lookup(pair):
+        try:
+            return list_entries(pool, pair[0], pair[1], args, records), None
+        except Exception as e:
+            return None, e
+
+    desired = {}
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, min(args.max_region_workers, len(pairs)))) as executor:
+        for (profile, region), (entries, error) in zip(pairs, executor.map(lookup, pairs)):
+            if error is not None:
+                errors.append(f'Error: listing instances of profile {profile} in region {region} failed: {error}')
+                continue
+            for alias, info, entry in entries:
+                if alias in desired and best_first([desired[alias][0], info])[0] is not info:
+                    continue
+                desired[alias] = (info, entry)
+    if errors:
+        raise GenConfigError('\n'.join(errors))
+    return desired
+
+
+def apply_entries(config, desired):
+    """
+    Brings the Host entries of config in line with desired, editing only what differs.
+
+    :param config: The managed config
+    :type config: libeicproxy.sshconf.SshConfig
+    :param desired: See desired_entries
+    :type desired: dict
+    :return: Counts of added, updated, removed and unchanged entries
+    :rtype: dict
+    """
+    counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+    existing = set(config.hosts())
+    for alias, (_info, entry) in desired.items():
+        if alias not in existing:
+            config.add(alias, **entry)
+            counts['added'] += 1
+            continue
+        current = config.host(alias)
+        changed = {key: value for key, value in entry.items() if current.get(key.lower()) != value}
+        stale = [key for key in current if key not in {name.lower() for name in entry}]
+        if changed:
+            config.set(alias, **changed)
+        if stale:
+            config.unset(alias, *stale)
+        counts['updated' if changed or stale else 'unchanged'] += 1
+    for alias in existing - desired.keys():
+        config.remove(alias)
+        counts['removed'] += 1
+    return counts
+
+
+def _squeeze_blank(lines):
+    # removed entries leave their trailing blank line behind, keep repeated runs from piling up
+    blank = False
+    for line in lines:
+        if not line.strip():
+            if blank:
+                continue
+            blank = True
+        else:
+            blank = False
+        yield line
+
+
+def write_atomic(path, lines):
+    """
+    Replaces path with lines in one step: readers see either the old or the new file.
+
+    :param lines: Lines without line endings
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for line in lines:
+                f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def ensure_include(ssh_config_path, include_path):
+    """
+    Puts an Include line for include_path at the top of an ssh config file, unless one is there.
+
+    :return: True if the line was added
+    :rtype: bool
+    """
+    try:
+        with open(ssh_config_path) as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        lines = []
+    targets = {include_path, expanduser(include_path)}
+    for line in lines:
+        words = line.split('#')[0].split()
+        if len(words) > 1 and words[0].lower() == 'include' and targets & {expanduser(w) for w in words[1:]}:
+            return False
+    # Include has to precede every Host entry to apply to all hosts
+    write_atomic(ssh_config_path, [f'Include {include_path}', ''] + lines)
+    return True
+
+
+def main(argv):
+    """
+    Entry point for `eicproxy gen-config`.
+    """
+    parser = argparse.ArgumentParser(prog='eicproxy gen-config',
+                                     description='Write ssh Host entries for every EC2 instance with a Name tag into a managed ssh config file.')
+    parser.add_argument('--profiles', type=str, nargs='+', default=[cli.default_aws_profile], metavar='PROFILE',
+                        help=f'AWS profiles to list instances of. Default: {cli.default_aws_profile}')
+    parser.add_argument('--regions', type=str, nargs='+', default=None,
+                        help='Regions to list instances in. Default: the region configured for each profile, or us-east-1')
+    parser.add_argument('--output', type=str, default=default_output, metavar='',
+                        help=f'Managed ssh config file, entries in it that no longer match an instance are removed. Default: {default_output}')
+    parser.add_argument('--include-into', type=str, nargs='?', const=default_ssh_config, default=None, metavar='SSH_CONFIG',
+                        help=f'Add "Include <output>" at the top of this ssh config unless it is there. Default when given without a value: {default_ssh_config}')
+    parser.add_argument('--alias-format', type=str, default=default_alias_format, metavar='',
+                        help='Host alias of an instance built from {name}, {instance_id}, {region} and {profile}, e.g. '
+                             f'"{{profile}}-{{name}}" when names repeat across accounts. Default: {default_alias_format}')
+    parser.add_argument('--user', type=str, default=None, metavar='', help='Add a User line to every entry.')
+    parser.add_argument('--jumphost', type=str, default=None, metavar='',
+                        help='ssh config Host to proxy through for instances without a public IP.')
+    parser.add_argument('--jumphost-tag', type=str, default=None, metavar='',
+                        help='Instance tag naming the jumphost of an instance, takes precedence over --jumphost.')
+    parser.add_argument('--proxy-args', type=str, default='', metavar='',
+                        help='Extra eicproxy options for every ProxyCommand, e.g. "--ephemeral-key agent".')
+    parser.add_argument('--eicproxy-command', type=str, default='eicproxy', metavar='',
+                        help='eicproxy command in the ProxyCommand lines. Default: eicproxy')
+    parser.add_argument('--max-region-workers', type=int, default=defaults.max_region_workers, metavar='',
+                        help=f'Profile and region pairs listed at the same time. Default: {defaults.max_region_workers}')
+    parser.add_argument('--page-size', type=int, default=default_page_size, metavar='',
+                        help=f'Instances per DescribeInstances page. Default: {default_page_size}')
+    parser.add_argument('--engine', choices=defaults.engines, default=defaults.engine,
+                        help=f'AWS client to use, see eicproxy --engine. Default: {defaults.engine}')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing anything.')
+    args = parser.parse_args(argv)
+
+    from .broker import SessionPool
+
+    pool = SessionPool(args.engine)
+    pairs = []
+    for profile in args.profiles:
+        try:
+            regions = args.regions or [pool.default_region(profile)]
+        except Exception as e:
+            # unknown profile, unreadable credentials or config file
+            print(f'Error: profile {profile}: {e}', file=sys.stderr)
+            return 1
+        pairs += [(profile, region) for region in regions]
+    try:
+        desired = desired_entries(pool, pairs, args)
+    except GenConfigError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+
+    path = expanduser(args.output)
+    try:
+        config = sshconf.read_ssh_config(path)
+    except FileNotFoundError:
+        config = sshconf.SshConfig(list(header))
+    counts = apply_entries(config, desired)
+    changed = counts['added'] or counts['updated'] or counts['removed'] or not os.path.exists(path)
+    if changed and not args.dry_run:
+        write_atomic(path, _squeeze_blank(config.iter_lines()))
+    included = False
+    if args.include_into and not args.dry_run:
+        included = ensure_include(expanduser(args.include_into), args.output)
+
+    print(f"{'would write' if args.dry_run else 'wrote' if changed else 'unchanged'} {args.output}: "
+          f"{counts['added']} added, {counts['updated']} updated, {counts['removed']} removed, "
+          f"{counts['unchanged']} unchanged" + (f', Include added to {args.include_into}' if included else ''))
+    return 0
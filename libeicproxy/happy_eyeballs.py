@@ -0,0 +1,203 @@
+"""
+Races connections to an instance's addresses, RFC 8305 (Happy Eyeballs) style.
+
+An instance may be reachable over its public IPv4, its private IPv4 (VPN, peering, Direct
+Connect), its IPv6 address or its DNS names, and which of them work depends on where ssh runs.
+Rather than waiting out a TCP timeout on an unreachable address, connection attempts start one
+after another, attempt_delay apart or as soon as the previous attempt failed, and the first
+connection to succeed wins while the others are closed.
+
+The network path (public_ipv4, private_ipv4, ipv6, public_dns, private_dns) that won is
+remembered per subnet (or VPC), later connections into the same subnet try it first.  A
+remembered path only changes the order of the attempts, so a stale one costs one attempt delay.
+"""
+
+import queue
+import socket
+import threading
+import time
+
+from . import defaults, relay
+
+DB_NAME = 'paths.sqlite'
+SCHEMA_VERSION = 1
+SCHEMA = (
+    '''CREATE TABLE paths (
+           network TEXT NOT NULL PRIMARY KEY,
+           path TEXT NOT NULL,
+           updated REAL NOT NULL
+       ) WITHOUT ROWID''',
+)
+
+# network path -> instance data attribute holding its address
+path_attributes = (
+    ('public_ipv4', 'public_ip'),
+    ('private_ipv4', 'private_ip'),
+    ('ipv6', 'ipv6_address'),
+    ('public_dns', 'public_dns_name'),
+    ('private_dns', 'private_dns_name'),
+)
+# remembered paths older than this are ignored, the way to an instance may have changed
+max_path_age = 30 * 86400
+
+
+def network_of(instance_info):
+    """
+    Returns the subnet, or else the VPC, an instance lives in, None if neither is known.
+    """
+    return getattr(instance_info, 'subnet_id', None) or getattr(instance_info, 'vpc_id', None)
+
+
+def candidates(instance_info, use_private_ip=False, preferred=None):
+    """
+    Lists the addresses to race, in the order the attempts start.
+
+    Without a remembered path the public IPv4 comes first as it always did, then IPv6, then the
+    private IPv4, then the DNS names.  Without a public IPv4 the private one leads.
+
+    :param instance_info: Instance data, see ec2_util.instance_info
+    :type instance_info: libeicproxy.ec2_util.InstanceRecord
+    :param use_private_ip: Only use the private IPv4 address and DNS name
+    :type use_private_ip: bool
+    :param preferred: Network path to try first, see PathMemory
+    :type preferred: basestring
+    :return: List of [path, address]
+    :rtype: list
+    """
+    addresses = {path: getattr(instance_info, attribute, None) for path, attribute in path_attributes}
+    if use_private_ip:
+        order = ['private_ipv4', 'private_dns']
+    elif addresses['public_ipv4']:
+        order = ['public_ipv4', 'ipv6', 'private_ipv4', 'public_dns', 'private_dns']
+    else:
+        order = ['private_ipv4', 'ipv6', 'public_dns', 'private_dns']
+    if preferred in order:
+        order.remove(preferred)
+        order.insert(0, preferred)
+    return [[path, addresses[path]] for path in order if addresses[path]]
+
+
+class PathMemory(object):
+    """
+    sqlite backed network (subnet or VPC id) -> network path that connected last.
+    """
+    def __init__(self, max_age=max_path_age, path=None):
+        """
+        :param max_age: Seconds a remembered path is used
+        :type max_age: int
+        :param path: Explicit database path, defaults to the eicproxy cache directory
+        :type path: basestring
+        """
+        # imported here, the eicproxy script races connections without touching sqlite
+        from . import state
+
+        self.max_age = max_age
+        self.db_ = state.Database(DB_NAME, SCHEMA, SCHEMA_VERSION, path=path)
+
+    def get(self, network):
+        """
+        Returns the network path that last connected into a network, or None.
+        """
+        if not network:
+            return None
+        row = self.db_.execute('SELECT path FROM paths WHERE network = ? AND updated > ?',
+                               (network, time.time() - self.max_age)).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, network, path):
+        """
+        Remembers the network path that connected into a network.
+        """
+        if network:
+            self.db_.execute('INSERT OR REPLACE INTO paths (network, path, updated) VALUES (?, ?, ?)',
+                             (network, path, time.time()))
+
+
+def race(addresses, port, attempt_delay=defaults.connect_attempt_delay,
+         timeout=relay.default_connect_timeout, buffer_size=0):
+    """
+    Connects to the first reachable address.
+
+    :param addresses: [path, address] pairs in order, see candidates(). DNS names are resolved
+       by their attempt and only connected to at addresses no earlier attempt used.
+    :type addresses: list
+    :param port: TCP port
+    :type port: int
+    :param attempt_delay: Seconds to wait for an attempt before starting the next one
+    :type attempt_delay: float
+    :param timeout: Seconds after which all attempts are given up
+    :type timeout: float
+    :param buffer_size: See relay.tune_socket
+    :type buffer_size: int
+    :return: The tuned, blocking socket and the [path, address] it connected over
+    :rtype: tuple
+    :raises OSError: if no address could be connected to
+    """
+    if len(addresses) == 1:
+        return relay.connect(addresses[0][1], port, timeout=timeout, buffer_size=buffer_size), addresses[0]
+
+    deadline = time.monotonic() + timeout
+    results = queue.Queue()
+    lock = threading.Lock()
+    attempted = set()
+    done = []
+
+    def attempt(candidate):
+        sock = error = None
+        try:
+            for family, socktype, proto, _name, address in socket.getaddrinfo(candidate[1], port, type=socket.SOCK_STREAM):
+                with lock:
+                    if done or address[0] in attempted:
+                        continue
+                    attempted.add(address[0])
+                sock = socket.socket(family, socktype, proto)
+                try:
+                    sock.settimeout(max(0.001, deadline - time.monotonic()))
+                    sock.connect(address)
+                    break
+                except OSError as e:
+                    sock.close()
+                    sock, error = None, e
+            else:
+                error = error or OSError('resolves to addresses already tried')
+        except OSError as e:
+            error = e
+        with lock:
+            if done and sock is not None:
+                # another attempt won
+                sock.close()
+                return
+            results.put((sock, candidate, error))
+
+    pending = list(reversed(addresses))
+    running = 0
+    errors = []
+    try:
+        while pending or running:
+            if pending:
+                threading.Thread(target=attempt, args=(pending.pop(),), daemon=True).start()
+                running += 1
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                sock, candidate, error = results.get(timeout=min(attempt_delay, remaining) if pending else remaining)
+            except queue.Empty:
+                continue
+            running -= 1
+            if error is None:
+                sock.settimeout(None)
+                relay.tune_socket(sock, buffer_size)
+                return sock, candidate
+            # a failed attempt starts the next one right away
+            errors.append(f'{candidate[0]} {candidate[1]}: {error}')
+    finally:
+        with lock:
+            done.append(True)
+        while not results.empty():
+            sock = results.get()[0]
+            if sock is not None:
+                sock.close()
+    if running:
+        errors.append('timed out')
+    raise OSError(f'no address of the instance reachable: {"; ".join(errors)}')
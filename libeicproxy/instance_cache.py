@@ -0,0 +1,123 @@
+"""
+Persistent cache of instance resolutions.
+
+Maps (aws profile, ssh host token) to the region, addresses, availability zone and state
+of the instance it resolved to, so a reconnect within the TTL needs no DescribeInstances
+call at all.  The host token is whatever ssh passed as %h: an instance id or a tag Name.
+"""
+
+import time
+
+from . import defaults, state
+from .ec2_util import InstanceRecord
+
+DB_NAME = 'instances.sqlite'
+SCHEMA_VERSION = 2
+SCHEMA = (
+    '''CREATE TABLE instances (
+           profile TEXT NOT NULL,
+           host_token TEXT NOT NULL,
+           instance_id TEXT NOT NULL,
+           region TEXT NOT NULL,
+           availability_zone TEXT,
+           state TEXT,
+           public_ip TEXT,
+           private_ip TEXT,
+           public_dns_name TEXT,
+           private_dns_name TEXT,
+           ipv6_address TEXT,
+           subnet_id TEXT,
+           vpc_id TEXT,
+           expires REAL NOT NULL,
+           PRIMARY KEY (profile, host_token)
+       ) WITHOUT ROWID''',
+    'CREATE INDEX instances_by_id ON instances (instance_id)',
+)
+
+FIELDS = ('instance_id', 'region', 'availability_zone', 'state', 'public_ip', 'private_ip',
+          'public_dns_name', 'private_dns_name', 'ipv6_address', 'subnet_id', 'vpc_id')
+
+default_ttl = defaults.cache_ttl
+
+
+class InstanceCache(object):
+    """
+    sqlite backed (profile, host token) -> instance data cache with a TTL.
+    """
+    def __init__(self, ttl=default_ttl, path=None):
+        """
+        :param ttl: Seconds an entry stays valid. 0 disables reads and writes.
+        :type ttl: int
+        :param path: Explicit database path, defaults to the eicproxy cache directory
+        :type path: basestring
+        """
+        self.ttl = ttl
+        self.db_ = state.Database(DB_NAME, SCHEMA, SCHEMA_VERSION, path=path) if ttl > 0 else None
+
+    def get(self, profile, host_token):
+        """
+        Returns the cached instance data for a host token.
+
+        :param profile: AWS profile the instance was resolved with
+        :type profile: basestring
+        :param host_token: Instance id or tag Name ssh passed in
+        :type host_token: basestring
+        :return: Record with the FIELDS attributes, or None on a miss or expired entry
+        :rtype: libeicproxy.ec2_util.InstanceRecord
+        """
+        if self.db_ is None:
+            return None
+        row = self.db_.execute(
+            f'SELECT {", ".join(FIELDS)} FROM instances '
+            'WHERE profile = ? AND host_token = ? AND expires > ?',
+            (profile, host_token, time.time())).fetchone()
+        if row is None:
+            return None
+        return InstanceRecord(**dict(zip(FIELDS, row)))
+
+    def put(self, profile, host_token, instance_info):
+        """
+        Stores instance data for a host token, replacing any previous entry.
+
+        :param profile: AWS profile the instance was resolved with
+        :type profile: basestring
+        :param host_token: Instance id or tag Name ssh passed in
+        :type host_token: basestring
+        :param instance_info: Instance data, see ec2_util.get_instance_data
+        :type instance_info: libeicproxy.ec2_util.InstanceRecord
+        """
+        if self.db_ is None:
+            return
+        values = [getattr(instance_info, field, None) for field in FIELDS]
+        self.db_.execute(
+            f'INSERT OR REPLACE INTO instances (profile, host_token, {", ".join(FIELDS)}, expires) '
+            f'VALUES (?, ?, {", ".join("?" * len(FIELDS))}, ?)',
+            [profile, host_token] + values + [time.time() + self.ttl])
+
+    def invalidate(self, profile=None, host_token=None, instance_id=None):
+        """
+        Drops cached entries. With no arguments the whole cache is cleared.
+
+        :param profile: Only drop entries for this profile
+        :type profile: basestring
+        :param host_token: Only drop the entry for this host token
+        :type host_token: basestring
+        :param instance_id: Only drop entries resolving to this instance id
+        :type instance_id: basestring
+        """
+        if self.db_ is None:
+            return
+        clauses, params = [], []
+        for column, value in (('profile', profile), ('host_token', host_token), ('instance_id', instance_id)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+        self.db_.execute(f'DELETE FROM instances{where}', params)
+
+    def purge_expired(self):
+        """
+        Deletes expired entries to keep the database compact.
+        """
+        if self.db_ is not None:
+            self.db_.execute('DELETE FROM instances WHERE expires <= ?', (time.time(),))
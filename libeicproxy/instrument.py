@@ -0,0 +1,183 @@
+"""
+Per-phase timing of eicproxy runs, to find out where connection setup time goes.
+
+Instrumentation is off by default and then close to free: phase() hands out one shared no-op
+context manager and event() returns right away.  configure(), fed by the --trace option or
+EICPROXY_TRACE, sends one record per phase or event to
+
+- stderr: 'stderr' or '-', one JSON object per line
+- a file: any other value is a path, JSON lines are appended
+- statsd: 'statsd://host:port' or 'udp://host:port', durations as timers and byte counts as
+  counters, named eicproxy.<event>
+
+Records never go to stdout, a ProxyCommand's stdout is the ssh protocol stream.
+"""
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+TRACE_ENV = 'EICPROXY_TRACE'
+default_statsd_port = 8125
+statsd_prefix = 'eicproxy'
+
+_sink = None
+_context = {}
+
+
+class _StreamSink(object):
+    """
+    Writes JSON lines to a text stream.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock_ = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self.lock_:
+            self.stream.write(line)
+            self.stream.flush()
+
+
+class _StatsdSink(object):
+    """
+    Sends statsd metrics over UDP, fire and forget.
+    """
+    def __init__(self, host, port):
+        self.address = (host, port)
+        self.sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_DGRAM)
+
+    def emit(self, record):
+        name = f'{statsd_prefix}.{record["event"]}'
+        lines = []
+        if 'ms' in record:
+            lines.append(f'{name}:{record["ms"]}|ms')
+        for key, value in record.items():
+            if key.startswith('bytes') and isinstance(value, int):
+                lines.append(f'{name}.{key}:{value}|c')
+        if not lines:
+            lines.append(f'{name}:1|c')
+        try:
+            self.sock.sendto('\n'.join(lines).encode(), self.address)
+        except OSError:
+            pass
+
+
+def configure(destination=None, **context):
+    """
+    Turns instrumentation on or off.
+
+    :param destination: 'stderr', '-', a file path or statsd://host:port. Default: $EICPROXY_TRACE,
+       instrumentation stays off if neither is set
+    :type destination: basestring
+    :param context: Fields added to every record, e.g. the host token
+    :raises OSError: if the trace file cannot be opened
+    :raises ValueError: if a statsd destination has no host
+    """
+    global _sink
+    destination = destination or os.environ.get(TRACE_ENV)
+    _context.clear()
+    _context.update(context, pid=os.getpid())
+    if not destination:
+        _sink = None
+    elif destination in ('stderr', '-'):
+        _sink = _StreamSink(sys.stderr)
+    elif destination.startswith(('statsd://', 'udp://')):
+        from urllib.parse import urlsplit
+        parts = urlsplit(destination)
+        if not parts.hostname:
+            raise ValueError(f'no host in trace destination {destination}')
+        _sink = _StatsdSink(parts.hostname, parts.port or default_statsd_port)
+    else:
+        _sink = _StreamSink(open(destination, 'a', buffering=1))
+
+
+def enabled():
+    return _sink is not None
+
+
+def event(name, **fields):
+    """
+    Records a point event, e.g. event('relay', bytes_up=..., bytes_down=...). A field ms is
+    reported as the event's duration.
+    """
+    if _sink is None:
+        return
+    record = {'event': name, 'ts': round(time.time(), 6)}
+    record.update(_context)
+    record.update(fields)
+    _sink.emit(record)
+
+
+class _Phase(object):
+    """
+    Times a with block and records it as an event with its duration in ms.
+    """
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.started = None
+
+    def set(self, **fields):
+        """
+        Adds fields learned inside the block, e.g. whether a cache was hit.
+        """
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ms = round((time.perf_counter() - self.started) * 1000, 3)
+        if exc_type is not None:
+            self.fields['error'] = exc_type.__name__
+        event(self.name, ms=ms, **self.fields)
+        return False
+
+
+class _NoPhase(object):
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_no_phase = _NoPhase()
+
+
+def phase(name, **fields):
+    """
+    Returns a context manager timing a phase of the run:
+
+        with instrument.phase('describe', region=region) as p:
+            ...
+            p.set(found=True)
+    """
+    if _sink is None:
+        return _no_phase
+    return _Phase(name, fields)
+
+
+def process_age():
+    """
+    Returns seconds since this process was started, covering interpreter startup and imports,
+    or None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # the command name in parentheses may contain spaces, fields are counted after it
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
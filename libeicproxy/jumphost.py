@@ -0,0 +1,57 @@
+"""
+ssh -W through a jumphost over one long-lived multiplexed connection per jumphost.
+
+The first connection through a jumphost starts an ssh ControlMaster that moves to the
+background, every later `ssh -W` opens a channel on it instead of a new connection, which
+saves a whole ssh handshake and, for a jumphost reached through eicproxy itself, a key push.
+The master exits once no stream used it for the persist time.  The bastion only has to
+authenticate when a master starts, so its key is pushed then and needs no refresh while the
+master lives.
+"""
+
+import os
+import stat
+import tempfile
+
+from os.path import join
+
+from . import defaults
+
+# unix socket paths are limited to 104-108 bytes, %C expands to 40 hex digits
+max_control_path = 100
+
+
+def control_dir():
+    """
+    Returns the private directory for ControlMaster sockets, in the eicproxy cache directory
+    unless its path is too long for a unix socket.
+
+    :raises OSError: if a fallback directory exists but is not private to this user
+    """
+    path = join(defaults.cache_dir(), 'cm')
+    if len(path) + 41 > max_control_path:
+        path = join(tempfile.gettempdir(), f'eicproxy-{os.getuid()}-cm')
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise OSError(f'{path} is not a private directory')
+    return path
+
+
+def command(jumphost, host, port, persist=defaults.jumphost_persist):
+    """
+    Returns the ssh command relaying stdin/stdout to host:port through jumphost.
+
+    :param jumphost: ssh config Host of the jumphost
+    :type jumphost: basestring
+    :param persist: Seconds the multiplexed connection stays up when unused, 0 connects directly
+    :type persist: int
+    :rtype: list
+    """
+    command_list = ['ssh']
+    if persist:
+        command_list += ['-o', 'ControlMaster=auto',
+                         '-o', f'ControlPath={join(control_dir(), "%C")}',
+                         '-o', f'ControlPersist={persist}']
+    command_list += [jumphost, '-W', f'{host}:{port}']
+    return command_list
@@ -0,0 +1,280 @@
+"""
+Ephemeral ssh keys for single connections.
+
+Instead of pushing a long-lived ~/.ssh key, eicproxy can push a fresh key per connection and
+hand its private half to ssh, either through ssh-agent (with a lifetime) or as a temporary
+identity file.  Keys are generated ahead of time into a pool under the cache directory so
+generation stays off the connect path: a connection claims a ready key with one atomic
+rename, and the pool is topped up again in a background thread.
+
+Keys are generated with libeicproxy.key_utils when the cryptography package is installed,
+otherwise with ssh-keygen.
+"""
+
+import fcntl
+import glob
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+
+from contextlib import contextmanager
+from os.path import basename, join
+
+from . import defaults
+
+default_size = defaults.key_pool_size
+default_key_type = defaults.ephemeral_key_type
+default_lifetime = defaults.ephemeral_key_lifetime
+rsa_bits = 3072
+key_comment = 'eicproxy-ephemeral'
+# claimed keys and interrupted generations older than this are removed
+stale_seconds = 3600
+
+
+class EphemeralKey(object):
+    """
+    A claimed key pair: private key in private_key_file, OpenSSH public key line in public_key.
+    """
+    def __init__(self, path, key_type):
+        self.path = path
+        self.key_type = key_type
+        self.private_key_file = join(path, 'id')
+        with open(join(path, 'id.pub')) as f:
+            self.public_key = f.read()
+
+    def release(self):
+        """
+        Deletes the key files.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def write_key(directory, key_type=default_key_type):
+    """
+    Generates a key pair into directory/id (mode 0600) and directory/id.pub.
+    """
+    try:
+        from . import key_utils
+    except ImportError:
+        command = ['ssh-keygen', '-q', '-t', key_type, '-N', '', '-C', key_comment, '-f', join(directory, 'id')]
+        if key_type == 'rsa':
+            command.extend(['-b', str(rsa_bits)])
+        subprocess.run(command, check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+        return
+
+    key = key_utils.generate_key(rsa_bits, key_type=key_type)
+    fd = os.open(join(directory, 'id'), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key_utils.serialize_key(key, encoding='PEM', return_private=True))
+    with open(join(directory, 'id.pub'), 'wb') as f:
+        f.write(key_utils.serialize_key(key, encoding='OpenSSH') + f' {key_comment}\n'.encode())
+
+
+class KeyPool(object):
+    """
+    Directory of ready key pairs shared by all eicproxy processes.
+
+    Layout: tmp/ holds keys being generated, ready/ complete ones, claimed/ those in use.
+    Each key is a directory moved between them with os.rename, so no key is claimed twice
+    and no half written key is ever claimed.
+    """
+    def __init__(self, key_type=default_key_type, size=default_size, path=None):
+        """
+        :param key_type: 'ed25519' or 'rsa'
+        :type key_type: basestring
+        :param size: Number of ready keys refill() keeps
+        :type size: int
+        :param path: Pool directory, defaults to keys/<key_type> in the cache directory
+        :type path: basestring
+        """
+        self.key_type = key_type
+        self.size = size
+        self.path = path or join(defaults.cache_dir(), 'keys', key_type)
+        self.tmp_ = join(self.path, 'tmp')
+        self.ready_ = join(self.path, 'ready')
+        self.claimed_ = join(self.path, 'claimed')
+        for directory in (self.path, self.tmp_, self.ready_, self.claimed_):
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.refilling_ = False
+        self.lock_ = threading.Lock()
+
+    def available(self):
+        return len(os.listdir(self.ready_))
+
+    def _generate(self, destination):
+        name = uuid.uuid4().hex
+        tmp = join(self.tmp_, name)
+        os.mkdir(tmp, 0o700)
+        try:
+            write_key(tmp, self.key_type)
+            os.rename(tmp, join(destination, name))
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        return join(destination, name)
+
+    def claim(self):
+        """
+        Takes a ready key out of the pool, generating one right away if the pool is empty.
+
+        :return: The claimed key, release() it once ssh has it
+        :rtype: EphemeralKey
+        """
+        for name in os.listdir(self.ready_):
+            path = join(self.claimed_, name)
+            try:
+                os.rename(join(self.ready_, name), path)
+            except FileNotFoundError:
+                # another connection claimed it first
+                continue
+            os.utime(path)
+            return EphemeralKey(path, self.key_type)
+        return EphemeralKey(self._generate(self.claimed_), self.key_type)
+
+    def refill(self):
+        """
+        Generates keys until size are ready and removes stale leftovers.
+        """
+        self.purge()
+        while self.available() < self.size:
+            self._generate(self.ready_)
+
+    def refill_in_background(self):
+        """
+        Runs refill() in a daemon thread, unless one is running already.
+        """
+        with self.lock_:
+            if self.refilling_:
+                return
+            self.refilling_ = True
+
+        def run():
+            try:
+                self.refill()
+            except (OSError, subprocess.CalledProcessError):
+                # the next claim generates inline, nothing is lost
+                pass
+            finally:
+                with self.lock_:
+                    self.refilling_ = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def purge(self, max_age=stale_seconds):
+        """
+        Removes claimed keys and interrupted generations older than max_age seconds.
+        """
+        cutoff = time.time() - max_age
+        for directory in (self.tmp_, self.claimed_):
+            for name in os.listdir(directory):
+                path = join(directory, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        shutil.rmtree(path, ignore_errors=True)
+                except FileNotFoundError:
+                    pass
+
+
+def identity_path(os_user, host_token):
+    """
+    Returns the identity path ssh reads for a host, for `IdentityFile <cache dir>/identities/%r@%h`.
+    It is a symlink to the identity file of the latest connection to the host, see install_identity.
+    """
+    return join(defaults.cache_dir(), 'identities', f'{os_user}@{host_token}')
+
+
+@contextmanager
+def _identity_lock(path):
+    fd = os.open(f'{path}.lock', os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _point(path, identity_file):
+    link = f'{identity_file}.link'
+    if os.path.lexists(link):
+        os.unlink(link)
+    os.symlink(basename(identity_file), link)
+    os.replace(link, path)
+
+
+def _connection_files(path):
+    """
+    Returns the identity files of the live connections to a host, newest first, removing those
+    of connections that ended without cleaning up.
+    """
+    files = []
+    for name in glob.glob(f'{glob.escape(path)}.*'):
+        pid = name[len(path) + 1:]
+        if not pid.isdigit():
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            os.unlink(name)
+            continue
+        except PermissionError:
+            pass
+        files.append(name)
+    return sorted(files, key=lambda name: os.stat(name).st_mtime, reverse=True)
+
+
+def add_to_agent(key, lifetime=default_lifetime):
+    """
+    Adds the key to the running ssh-agent for lifetime seconds.
+
+    :raises subprocess.CalledProcessError: if ssh-add fails, e.g. no agent is running
+    """
+    subprocess.run(['ssh-add', '-q', '-t', str(lifetime), key.private_key_file], check=True,
+                   stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+
+def install_identity(key, os_user, host_token):
+    """
+    Moves the private key to an identity file of this connection and points
+    identity_path(os_user, host_token) at it.
+
+    Concurrent connections to the same host each keep their own file. ssh reads whichever the
+    path points at, all of them were pushed to the instance for the same user within the last
+    minute, so each is accepted.
+
+    :return: The connection's identity file, pass it to remove_identity when the connection ends
+    :rtype: basestring
+    """
+    path = identity_path(os_user, host_token)
+    identity_file = f'{path}.{os.getpid()}'
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    os.replace(key.private_key_file, identity_file)
+    with _identity_lock(path):
+        _point(path, identity_file)
+    return identity_file
+
+
+def remove_identity(identity_file):
+    """
+    Deletes a connection's identity file. If the host's identity path pointed at it, it is pointed
+    at the newest identity file of another live connection, or removed.
+    """
+    path = identity_file.rsplit('.', 1)[0]
+    with _identity_lock(path):
+        try:
+            os.unlink(identity_file)
+        except FileNotFoundError:
+            pass
+        try:
+            current = os.readlink(path)
+        except OSError:
+            return
+        if current != basename(identity_file):
+            return
+        others = _connection_files(path)
+        if others:
+            _point(path, others[0])
+        else:
+            os.unlink(path)
@@ -11,16 +11,107 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
-import sys
+import base64
+import binascii
+import hashlib
+import time
 
-def push_public_key(session, instance_id, user, pub_key, target_zone):
+from concurrent.futures import ThreadPoolExecutor
+
+from . import defaults, state
+
+default_reuse_seconds = defaults.key_reuse_seconds
+default_push_workers = defaults.push_workers
+
+LEDGER_DB_NAME = 'key_pushes.sqlite'
+LEDGER_SCHEMA_VERSION = 1
+LEDGER_SCHEMA = (
+    '''CREATE TABLE key_pushes (
+           instance_id TEXT NOT NULL,
+           os_user TEXT NOT NULL,
+           fingerprint TEXT NOT NULL,
+           pushed_at REAL NOT NULL,
+           PRIMARY KEY (instance_id, os_user, fingerprint)
+       ) WITHOUT ROWID''',
+)
+
+
+def key_fingerprint(pub_key):
+    """
+    Computes the OpenSSH style SHA256 fingerprint of a public key.
+
+    :param pub_key: OpenSSH encoded public key, e.g. 'ssh-rsa AAAA... comment'
+    :type pub_key: basestring
+    :return: Fingerprint formatted as 'SHA256:<base64>'
+    :rtype: basestring
+    """
+    fields = pub_key.split()
+    try:
+        blob = base64.b64decode(fields[1], validate=True)
+    except (IndexError, binascii.Error):
+        blob = pub_key.strip().encode()
+    return 'SHA256:' + base64.b64encode(hashlib.sha256(blob).digest()).decode().rstrip('=')
+
+
+class KeyPushLedger(object):
+    """
+    Records successful SendSSHPublicKey calls so concurrent and back to back eicproxy processes
+    can skip pushing a key the instance still holds.
+    """
+    def __init__(self, reuse_seconds=default_reuse_seconds, path=None):
+        """
+        :param reuse_seconds: How long a push is considered fresh. 0 disables the ledger.
+        :type reuse_seconds: int
+        :param path: Explicit database path, defaults to the eicproxy cache directory
+        :type path: basestring
+        """
+        self.reuse_seconds = reuse_seconds
+        self.db_ = None
+        if reuse_seconds > 0:
+            self.db_ = state.Database(LEDGER_DB_NAME, LEDGER_SCHEMA, LEDGER_SCHEMA_VERSION, path=path)
+
+    def is_fresh(self, instance_id, user, fingerprint):
+        """
+        Returns whether the key was pushed to instance_id for user within reuse_seconds.
+        """
+        if self.db_ is None:
+            return False
+        row = self.db_.execute(
+            'SELECT 1 FROM key_pushes WHERE instance_id = ? AND os_user = ? AND fingerprint = ? AND pushed_at > ?',
+            (instance_id, user, fingerprint, time.time() - self.reuse_seconds)).fetchone()
+        return row is not None
+
+    def record(self, instance_id, user, fingerprint, pushed_at=None):
+        """
+        Records a successful push, expiring stale rows along the way.
+        """
+        if self.db_ is None:
+            return
+        now = time.time()
+        with self.db_.transaction():
+            self.db_.execute('DELETE FROM key_pushes WHERE pushed_at <= ?', (now - self.reuse_seconds,))
+            self.db_.execute('INSERT OR REPLACE INTO key_pushes VALUES (?, ?, ?, ?)',
+                               (instance_id, user, fingerprint, pushed_at or now))
+
+    def forget(self, instance_id, user=None):
+        """
+        Drops records for an instance, e.g. after authentication with a supposedly fresh key failed.
+        """
+        if self.db_ is None:
+            return
+        if user is None:
+            self.db_.execute('DELETE FROM key_pushes WHERE instance_id = ?', (instance_id,))
+        else:
+            self.db_.execute('DELETE FROM key_pushes WHERE instance_id = ? AND os_user = ?', (instance_id, user))
+
+
+def push_public_key(session, instance_id, user, pub_key, target_zone, ledger=None):
     """
-    Creates a Boto3 client to make call to the EC2 Instance Connect Service and invokes the SendSSHPublicKey API
+    Creates a Boto3 client to make call to the EC2 Instance Connect Service and invokes the SendSSHPublicKey API.
+    The call is rate limited and retried on throttling, see libeicproxy.throttle.
 
     :param session: A Botocore session to use to generate the boto client
     :type session: botocore.session.Session
-    :param client_config: Contains AWS credentials, region and custom endpoint URL
-    :type client_config: dict
     :param instance_id: Instance ID of the EC2 instance
     :type instance_id: basestring
     :param user: EC2 user to publish to on-instance
@@ -29,13 +120,22 @@ def push_public_key(session, instance_id, user, pub_key, target_zone):
     :type pub_key: basestring
     :param target_zone: availability zone the instance lives in
     :type target_zone: basestring
+    :param ledger: Optional push ledger. A fresh push of the same key is reused instead of repeated.
+    :type ledger: KeyPushLedger
+    :return: True if the key was pushed, False if a fresh push was reused
+    :rtype: bool
+    :raises botocore.exceptions.ClientError: if the push failed for good, the caller decides whether to exit
     """
+    from .throttle import RateLimiter, Throttle
 
-    try:
-        client = session.create_client('ec2-instance-connect')
-    except Exception as e:
-        print("Error while trying to push the public key:\n" + str(e))
-        sys.exit(1)
+    if ledger is not None:
+        fingerprint = key_fingerprint(pub_key)
+        if ledger.is_fresh(instance_id, user, fingerprint):
+            return False
+
+    client = session.create_client('ec2-instance-connect')
+    Throttle(RateLimiter(), getattr(session, 'profile', None), client.meta.region_name,
+             'ec2-instance-connect').install(client)
 
     params = {
               'InstanceId': instance_id,
@@ -44,8 +144,57 @@ def push_public_key(session, instance_id, user, pub_key, target_zone):
               'AvailabilityZone': target_zone
              }
 
-    try:
-        client.send_ssh_public_key(**params)
-    except Exception as e:
-        print("Error while pushing the public key:\n" + str(e))
-        sys.exit(1)
+    pushed_at = time.time()
+    client.send_ssh_public_key(**params)
+
+    if ledger is not None:
+        ledger.record(instance_id, user, fingerprint, pushed_at)
+    return True
+
+
+def push_public_keys(client_for_region, instances, user, pub_key, ledger=None, max_workers=default_push_workers):
+    """
+    Pushes a public key to many instances in parallel, skipping fresh pushes recorded in the ledger.
+
+    :param client_for_region: Callable returning an ec2-instance-connect client for a region name
+    :type client_for_region: callable
+    :param instances: Instance records with instance_id, region and availability_zone
+    :type instances: list
+    :param user: EC2 user to publish to on-instance
+    :type user: basestring
+    :param pub_key: Public key to be pushed
+    :type pub_key: basestring
+    :param ledger: Optional push ledger, updated with every successful push
+    :type ledger: KeyPushLedger
+    :param max_workers: Maximum number of SendSSHPublicKey calls in flight
+    :type max_workers: int
+    :return: dict of instance id to True (pushed), False (fresh push reused) or the exception raised
+    :rtype: dict
+    """
+    fingerprint = key_fingerprint(pub_key)
+
+    def push(instance):
+        if ledger is not None and ledger.is_fresh(instance.instance_id, user, fingerprint):
+            return False
+        pushed_at = time.time()
+        client_for_region(instance.region).send_ssh_public_key(
+            InstanceId=instance.instance_id,
+            InstanceOSUser=user,
+            SSHPublicKey=pub_key,
+            AvailabilityZone=instance.availability_zone)
+        if ledger is not None:
+            ledger.record(instance.instance_id, user, fingerprint, pushed_at)
+        return True
+
+    results = {}
+    instances = list(instances)
+    if not instances:
+        return results
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(instances)))) as executor:
+        futures = {executor.submit(push, instance): instance.instance_id for instance in instances}
+        for future, instance_id in futures.items():
+            try:
+                results[instance_id] = future.result()
+            except Exception as e:
+                results[instance_id] = e
+    return results
@@ -11,43 +11,104 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
+from functools import lru_cache
+
 from cryptography.hazmat.backends import default_backend as crypto_default_backend
 from cryptography.hazmat.primitives import serialization as crypto_serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
 
 ssh_rsa_exponent = 65537
+default_rsa_bits = 3072
+key_types = ('ed25519', 'rsa')
+# parsed keys are kept so converting the same key again does not parse it again
+parsed_keys_max = 64
 
 private_str = "PRIVATE"
 public_str = "PUBLIC"
 begin_key = "-----BEGIN RSA {0} KEY-----"
 end_key = "-----END RSA {0} KEY-----"
 ssh_rsa = "ssh-rsa"
+ssh_ed25519 = "ssh-ed25519"
 
 
-def generate_key(bit_strength):
+def generate_key(bit_strength=default_rsa_bits, key_type='rsa'):
     """
-    Generates an RSA private key.
+    Generates a private key.
 
-    :param bit_strength: Bit strength to use for generation
+    :param bit_strength: Bit strength to use for RSA keys, ignored for Ed25519. Default: 3072
     :type bit_strength: int
-    :return: A Python Cryptography RSA key object
-    :rtype: cryptography.hazmat.primitives.asymmetric.rsa.RSAPrivateKey
+    :param key_type: 'rsa' or 'ed25519'. Ed25519 keys are generated in microseconds, RSA keys take
+       tens to hundreds of milliseconds. Default: 'rsa'
+    :type key_type: basestring
+    :return: A Python Cryptography private key object
+    :rtype: cryptography.hazmat.primitives.asymmetric.rsa.RSAPrivateKey or
+       cryptography.hazmat.primitives.asymmetric.ed25519.Ed25519PrivateKey
     """
+    if key_type == 'ed25519':
+        return ed25519.Ed25519PrivateKey.generate()
+    if key_type != 'rsa':
+        raise AssertionError('Unrecognized key type {0}'.format(key_type))
     return rsa.generate_private_key(
         backend=crypto_default_backend(),
         public_exponent=ssh_rsa_exponent,
         key_size=bit_strength)
 
 
+@lru_cache(maxsize=parsed_keys_max)
+def _load_key(data, encoding, is_private):
+    if encoding == 'PEM' and is_private and b'OPENSSH PRIVATE KEY' in data[:64]:
+        return crypto_serialization.load_ssh_private_key(data, password=None, backend=crypto_default_backend())
+    if encoding == 'OpenSSH':
+        return crypto_serialization.load_ssh_public_key(data, backend=crypto_default_backend())
+    loader = {
+        ('PEM', True): crypto_serialization.load_pem_private_key,
+        ('PEM', False): crypto_serialization.load_pem_public_key,
+        ('DER', True): crypto_serialization.load_der_private_key,
+        ('DER', False): crypto_serialization.load_der_public_key,
+    }[(encoding, is_private)]
+    if is_private:
+        return loader(data, password=None, backend=crypto_default_backend())
+    return loader(data, backend=crypto_default_backend())
+
+
+def load_key(data, encoding='PEM', is_private=False):
+    """
+    Parses an unencrypted key, reusing the result for keys parsed before.
+
+    :param data: Encoded key bytes
+    :type data: bytearray
+    :param encoding: 'PEM' (including OpenSSH private keys), 'DER' or 'OpenSSH' (public keys only)
+    :type encoding: basestring
+    :param is_private: Whether the key is public or private. Default: False
+    :type is_private: bool
+    :return: A Python Cryptography key object
+    """
+    return _load_key(bytes(data), encoding, is_private)
+
+
+def _private_format(key, enc):
+    # OpenSSL's traditional format has no Ed25519 encoding, OpenSSH's own format (PEM only) and PKCS8 do
+    if isinstance(key, ed25519.Ed25519PrivateKey):
+        if enc == crypto_serialization.Encoding.PEM:
+            return crypto_serialization.PrivateFormat.OpenSSH
+        return crypto_serialization.PrivateFormat.PKCS8
+    return crypto_serialization.PrivateFormat.TraditionalOpenSSL
+
+
+def _public_key(key):
+    return key.public_key() if hasattr(key, 'public_key') else key
+
+
 def serialize_key(key, encoding='PEM', return_private=False, password=None):
     """
-    Given an RSA private key object, return the public or private key in the requested encoding.
-    encoded in the requested formats.  Private keys will always use TraditionalOpenSSL format,
-    because that's the format supported by Paramiko
+    Given an RSA or Ed25519 private key object, return the public or private key in the requested encoding.
+    encoded in the requested formats.  RSA private keys will always use TraditionalOpenSSL format,
+    because that's the format supported by Paramiko, Ed25519 private keys use OpenSSH format
+    (PKCS8 for DER) because TraditionalOpenSSL cannot hold them.
     public keys will always use SubjectPublicKeyInfo format UNLESS
     the encoding is 'OpenSSH' (in which case, it will use OpenSSH format).
 
-    :param key: An RSA private key object
+    :param key: An RSA or Ed25519 private key object
     :type key: cryptography.hazmat.primitives.asymmetric.rsa.RSAPrivateKey
     :param encoding: The encoding to use for serializing the private key. Allowed: 'PEM', 'DER', 'OpenSSH'. Default: 'PEM'. \
        Note that if return_private is True then 'OpenSSH' is not allowed.
@@ -81,7 +142,7 @@ def serialize_key(key, encoding='PEM', return_private=False, password=None):
 
         return key.private_bytes(
             encoding=enc,
-            format=crypto_serialization.PrivateFormat.TraditionalOpenSSL,
+            format=_private_format(key, enc),
             encryption_algorithm=enc_alg
         )
 
@@ -91,7 +152,7 @@ def serialize_key(key, encoding='PEM', return_private=False, password=None):
         else:
             format = crypto_serialization.PublicFormat.SubjectPublicKeyInfo
 
-        return key.public_key().public_bytes(
+        return _public_key(key).public_bytes(
             encoding=enc,
             format=format
         )
@@ -108,13 +169,8 @@ def convert_der_to_pem(der_key, is_private=False):
     :return: PEM-encoded key bytes
     :rtype: bytearray
     """
-    if is_private:
-        loaded_key = crypto_serialization.load_der_private_key(der_key, backend=crypto_default_backend())
-        return serialize_key(loaded_key, encoding='PEM', return_private=is_private)
-    else:
-        loaded_key = crypto_serialization.load_der_public_key(der_key, backend=crypto_default_backend())
-        return loaded_key.public_bytes(encoding=crypto_serialization.Encoding.PEM,
-                                       format=crypto_serialization.PublicFormat.SubjectPublicKeyInfo)
+    loaded_key = load_key(der_key, encoding='DER', is_private=is_private)
+    return serialize_key(loaded_key, encoding='PEM', return_private=is_private)
 
 
 def convert_pem_to_der(pem_key):
@@ -126,15 +182,10 @@ def convert_pem_to_der(pem_key):
     :return: DER-encoded key bytes
     :rtype: bytearray
     """
-    first_line = pem_key.decode().split('\n', 1)[0]
-    is_private = first_line == begin_key.format(private_str)
-    if is_private:
-        loaded_key = crypto_serialization.load_pem_private_key(pem_key, backend=crypto_default_backend())
-        return serialize_key(loaded_key, encoding='DER', return_private=is_private)
-    else:
-        loaded_key = crypto_serialization.load_pem_public_key(pem_key, backend=crypto_default_backend())
-        return loaded_key.public_bytes(encoding=crypto_serialization.Encoding.DER,
-                                       format=crypto_serialization.PublicFormat.SubjectPublicKeyInfo)
+    first_line = bytes(pem_key).split(b'\n', 1)[0].decode()
+    is_private = first_line.startswith('-----BEGIN') and first_line.endswith('{0} KEY-----'.format(private_str))
+    loaded_key = load_key(pem_key, encoding='PEM', is_private=is_private)
+    return serialize_key(loaded_key, encoding='DER', return_private=is_private)
 
 
 def convert_pem_to_openssh(pem_key):
@@ -146,6 +197,4 @@ def convert_pem_to_openssh(pem_key):
     :return: OpenSSH-encoded key bytes
     :rtype: bytearray
     """
-    loaded_key = crypto_serialization.load_pem_public_key(pem_key, backend=crypto_default_backend())
-    return loaded_key.public_bytes(encoding=crypto_serialization.Encoding.OpenSSH,
-                                   format=crypto_serialization.PublicFormat.OpenSSH)
+    return serialize_key(load_key(pem_key, encoding='PEM'), encoding='OpenSSH')
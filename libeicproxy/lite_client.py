@@ -0,0 +1,688 @@
+"""
+Minimal boto3-free AWS client for the calls eicproxy makes.
+
+Supports EC2 DescribeInstances and EC2 Instance Connect SendSSHPublicKey with SigV4
+signing, and credentials from the environment, the shared credentials and config files, the
+ECS container endpoint and IMDS.  Only the response fields eicproxy uses are parsed, into
+the same shapes boto3 returns, so callers can use either.
+
+Profiles this module does not understand (assume role, SSO, credential_process, web
+identity) raise UnsupportedProfile and are left to boto3.
+"""
+
+import configparser
+import hashlib
+import hmac
+import json
+import os
+import socket
+import threading
+import time
+
+from datetime import datetime
+from os.path import expanduser
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit
+from xml.etree import ElementTree
+
+from . import instrument
+
+EC2_API_VERSION = '2016-11-15'
+ENDPOINT_URL_ENV = 'EICPROXY_ENDPOINT_URL'
+http_timeout_seconds = 60
+metadata_timeout_seconds = 1
+# refresh temporary credentials this long before they expire
+refresh_margin_seconds = 300
+
+unsupported_profile_keys = ('role_arn', 'credential_source', 'credential_process', 'web_identity_token_file',
+                            'sso_start_url', 'sso_session', 'sso_account_id', 'login_session')
+
+
+class UnsupportedProfile(Exception):
+    """
+    Raised when credentials for a profile cannot be resolved without boto3.
+    """
+
+
+class ClientError(Exception):
+    """
+    An error response from an AWS API, shaped like botocore.exceptions.ClientError.
+    """
+    def __init__(self, code, message, operation_name, status=None):
+        self.response = {'Error': {'Code': code, 'Message': message},
+                         'ResponseMetadata': {'HTTPStatusCode': status}}
+        self.operation_name = operation_name
+        super().__init__(f'An error occurred ({code}) when calling the {operation_name} operation: {message}')
+
+
+class Credentials(object):
+    """
+    An access key, secret key and optional session token with an optional expiry (epoch seconds).
+    """
+    __slots__ = ('access_key', 'secret_key', 'token', 'expiry_time')
+
+    def __init__(self, access_key, secret_key, token=None, expiry_time=None):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.token = token
+        self.expiry_time = expiry_time
+
+    def needs_refresh(self):
+        return self.expiry_time is not None and self.expiry_time - time.time() < refresh_margin_seconds
+
+
+def _read_ini(path):
+    parser = configparser.RawConfigParser()
+    try:
+        parser.read(path)
+    except configparser.Error as e:
+        raise UnsupportedProfile(f'cannot parse {path}: {e}')
+    return parser
+
+
+def _config_section(config, profile):
+    for section in (f'profile {profile}', profile if profile == 'default' else None):
+        if section and config.has_section(section):
+            return dict(config.items(section))
+    return None
+
+
+def _parse_expiry(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+class HttpConnection(object):
+    """
+    Minimal keep-alive HTTP/1.1 client connection.
+
+    http.client drags in the email package, which costs more at startup than everything else
+    this module imports, and eicproxy only needs simple request/response exchanges.
+    """
+    def __init__(self, host, port=None, use_tls=True, timeout=http_timeout_seconds):
+        self.host = host
+        self.port = port or (443 if use_tls else 80)
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.sock_ = None
+        self.file_ = None
+
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.use_tls:
+            import ssl
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+        self.sock_ = sock
+        self.file_ = sock.makefile('rb')
+
+    def close(self):
+        if self.sock_ is not None:
+            self.file_.close()
+            self.sock_.close()
+        self.sock_ = self.file_ = None
+
+    def request(self, method, path, headers=None, body=b''):
+        """
+        Sends a request and reads the complete response.
+
+        :return: (status, lowercased response headers, body)
+        :rtype: tuple
+        :raises OSError: on connection errors or malformed responses
+        """
+        if self.sock_ is None:
+            self.connect()
+        headers = dict(headers or {})
+        headers.setdefault('Host', self.host)
+        headers['Content-Length'] = str(len(body))
+        head = f'{method} {path} HTTP/1.1\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in headers.items()) + '\r\n'
+        self.sock_.sendall(head.encode() + body)
+
+        status_line = self.file_.readline(65537)
+        if not status_line:
+            raise ConnectionError('connection closed by peer')
+        try:
+            status = int(status_line.split(None, 2)[1])
+        except (IndexError, ValueError):
+            raise ConnectionError(f'malformed HTTP status line: {status_line!r}')
+        response_headers = {}
+        while True:
+            line = self.file_.readline(65537)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.file_.readline(65537).split(b';')[0], 16)
+                if size == 0:
+                    while self.file_.readline(65537) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(self._read_exactly(size))
+                self.file_.readline(65537)
+            data = b''.join(chunks)
+        elif 'content-length' in response_headers:
+            data = self._read_exactly(int(response_headers['content-length']))
+        else:
+            data = self.file_.read()
+            response_headers['connection'] = 'close'
+
+        if response_headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, response_headers, data
+
+    def _read_exactly(self, size):
+        data = self.file_.read(size)
+        if len(data) != size:
+            raise ConnectionError('connection closed mid-response')
+        return data
+
+
+def _http_get_json(host, path, port=80, headers=None, method='GET'):
+    conn = HttpConnection(host, port, use_tls=False, timeout=metadata_timeout_seconds)
+    try:
+        status, _headers, body = conn.request(method, path, headers)
+        if status != 200:
+            raise OSError(f'{host}{path} returned HTTP {status}')
+        return body
+    finally:
+        conn.close()
+
+
+def _container_credentials():
+    relative_uri = os.environ.get('AWS_CONTAINER_CREDENTIALS_RELATIVE_URI')
+    full_uri = os.environ.get('AWS_CONTAINER_CREDENTIALS_FULL_URI')
+    if relative_uri:
+        host, port, path = '169.254.170.2', 80, relative_uri
+    elif full_uri:
+        parts = urlsplit(full_uri)
+        if parts.scheme != 'http':
+            raise UnsupportedProfile('only http container credential endpoints are supported')
+        host, port, path = parts.hostname, parts.port or 80, parts.path or '/'
+    else:
+        return None
+    headers = {}
+    if os.environ.get('AWS_CONTAINER_AUTHORIZATION_TOKEN'):
+        headers['Authorization'] = os.environ['AWS_CONTAINER_AUTHORIZATION_TOKEN']
+    data = json.loads(_http_get_json(host, path, port, headers))
+    return Credentials(data['AccessKeyId'], data['SecretAccessKey'], data.get('Token'),
+                       _parse_expiry(data.get('Expiration')))
+
+
+def _instance_metadata_credentials():
+    if os.environ.get('AWS_EC2_METADATA_DISABLED', '').lower() == 'true':
+        return None
+    host = '169.254.169.254'
+    token = _http_get_json(host, '/latest/api/token', method='PUT',
+                           headers={'X-aws-ec2-metadata-token-ttl-seconds': '21600'}).decode()
+    headers = {'X-aws-ec2-metadata-token': token}
+    role = _http_get_json(host, '/latest/meta-data/iam/security-credentials/', headers=headers).decode().split()[0]
+    data = json.loads(_http_get_json(host, f'/latest/meta-data/iam/security-credentials/{role}', headers=headers))
+    return Credentials(data['AccessKeyId'], data['SecretAccessKey'], data.get('Token'),
+                       _parse_expiry(data.get('Expiration')))
+
+
+def resolve_credentials(profile=None):
+    """
+    Resolves credentials the way botocore does for the profile types supported here.
+
+    Environment credentials are only used when no profile was given explicitly, as in botocore.
+
+    :param profile: Profile name, None for the environment's default
+    :type profile: basestring
+    :return: Resolved credentials
+    :rtype: Credentials
+    :raises UnsupportedProfile: if the profile needs boto3 or no credentials were found
+    """
+    if profile is None:
+        if os.environ.get('AWS_ACCESS_KEY_ID') and os.environ.get('AWS_SECRET_ACCESS_KEY'):
+            return Credentials(os.environ['AWS_ACCESS_KEY_ID'], os.environ['AWS_SECRET_ACCESS_KEY'],
+                               os.environ.get('AWS_SESSION_TOKEN') or os.environ.get('AWS_SECURITY_TOKEN'))
+        profile = os.environ.get('AWS_PROFILE') or os.environ.get('AWS_DEFAULT_PROFILE') or 'default'
+
+    config = _config_section(_read_ini(expanduser(os.environ.get('AWS_CONFIG_FILE', '~/.aws/config'))), profile) or {}
+    if any(key in config for key in unsupported_profile_keys):
+        raise UnsupportedProfile(f'profile {profile} needs boto3')
+
+    shared = _read_ini(expanduser(os.environ.get('AWS_SHARED_CREDENTIALS_FILE', '~/.aws/credentials')))
+    for section in (dict(shared.items(profile)) if shared.has_section(profile) else {}, config):
+        if section.get('aws_access_key_id') and section.get('aws_secret_access_key'):
+            return Credentials(section['aws_access_key_id'], section['aws_secret_access_key'],
+                               section.get('aws_session_token') or section.get('aws_security_token'))
+
+    if profile != 'default' and not config and not shared.has_section(profile):
+        raise UnsupportedProfile(f'profile {profile} not found')
+
+    try:
+        credentials = _container_credentials() or _instance_metadata_credentials()
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        raise UnsupportedProfile(f'no credentials found for profile {profile}: {e}')
+    if credentials is None:
+        raise UnsupportedProfile(f'no credentials found for profile {profile}')
+    return credentials
+
+
+def resolve_region(profile=None):
+    """
+    Returns the region from AWS_REGION, AWS_DEFAULT_REGION or the profile's config, or None.
+    """
+    region = os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION')
+    if region:
+        return region
+    profile = profile or os.environ.get('AWS_PROFILE') or os.environ.get('AWS_DEFAULT_PROFILE') or 'default'
+    try:
+        config = _config_section(_read_ini(expanduser(os.environ.get('AWS_CONFIG_FILE', '~/.aws/config'))), profile)
+    except UnsupportedProfile:
+        return None
+    return (config or {}).get('region')
+
+
+def _hmac(key, msg):
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+
+def signing_key(secret_key, date, region, service):
+    """
+    Derives the SigV4 signing key for a date (YYYYMMDD), region and service.
+    """
+    key = _hmac(('AWS4' + secret_key).encode(), date)
+    key = _hmac(key, region)
+    key = _hmac(key, service)
+    return _hmac(key, 'aws4_request')
+
+
+def _canonical_query(query):
+    pairs = sorted((quote(k, safe='-_.~'), quote(v, safe='-_.~')) for k, v in query)
+    return '&'.join(f'{k}={v}' for k, v in pairs)
+
+
+def sign_request(method, url, region, service, credentials, headers=None, body=b'', amz_date=None):
+    """
+    Signs a request with AWS Signature Version 4.
+
+    :param method: HTTP method
+    :type method: basestring
+    :param url: Full request url, including any query string
+    :type url: basestring
+    :param region: Region to sign for
+    :type region: basestring
+    :param service: Signing name of the service
+    :type service: basestring
+    :param credentials: Credentials to sign with
+    :type credentials: Credentials
+    :param headers: Request headers to sign
+    :type headers: dict
+    :param body: Request payload
+    :type body: bytes
+    :param amz_date: Signing time as YYYYMMDDTHHMMSSZ, defaults to now
+    :type amz_date: basestring
+    :return: The headers to send, including Host, X-Amz-Date and Authorization
+    :rtype: dict
+    """
+    parts = urlsplit(url)
+    amz_date = amz_date or time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+    headers = dict(headers or {})
+    headers['Host'] = parts.netloc
+    headers['X-Amz-Date'] = amz_date
+    if credentials.token:
+        headers['X-Amz-Security-Token'] = credentials.token
+
+    canonical_headers = sorted((k.lower(), ' '.join(str(v).split())) for k, v in headers.items())
+    signed_headers = ';'.join(k for k, _ in canonical_headers)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    canonical_request = '\n'.join((
+        method,
+        quote(parts.path or '/', safe='/~'),
+        _canonical_query(query),
+        ''.join(f'{k}:{v}\n' for k, v in canonical_headers),
+        signed_headers,
+        hashlib.sha256(body).hexdigest(),
+    ))
+    scope = f'{amz_date[:8]}/{region}/{service}/aws4_request'
+    string_to_sign = '\n'.join(('AWS4-HMAC-SHA256', amz_date, scope,
+                                hashlib.sha256(canonical_request.encode()).hexdigest()))
+    signature = hmac.new(signing_key(credentials.secret_key, amz_date[:8], region, service),
+                         string_to_sign.encode(), hashlib.sha256).hexdigest()
+    headers['Authorization'] = (f'AWS4-HMAC-SHA256 Credential={credentials.access_key}/{scope}, '
+                                f'SignedHeaders={signed_headers}, Signature={signature}')
+    return headers
+
+
+def presign_url(method, url, region, service, credentials, expires=60, amz_date=None):
+    """
+    Signs a url with AWS Signature Version 4 in its query string, e.g. for a WebSocket handshake
+    that cannot carry an Authorization header.
+
+    :param url: Full url, including any query string
+    :type url: basestring
+    :param credentials: Credentials to sign with
+    :type credentials: Credentials
+    :param expires: Seconds the signature stays valid
+    :type expires: int
+    :param amz_date: Signing time as YYYYMMDDTHHMMSSZ, defaults to now
+    :type amz_date: basestring
+    :return: The signed url
+    :rtype: basestring
+    """
+    parts = urlsplit(url)
+    amz_date = amz_date or time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+    scope = f'{amz_date[:8]}/{region}/{service}/aws4_request'
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    query += [('X-Amz-Algorithm', 'AWS4-HMAC-SHA256'),
+              ('X-Amz-Credential', f'{credentials.access_key}/{scope}'),
+              ('X-Amz-Date', amz_date),
+              ('X-Amz-Expires', str(expires)),
+              ('X-Amz-SignedHeaders', 'host')]
+    if credentials.token:
+        query.append(('X-Amz-Security-Token', credentials.token))
+    canonical_query = _canonical_query(query)
+    canonical_request = '\n'.join((
+        method,
+        quote(parts.path or '/', safe='/~'),
+        canonical_query,
+        f'host:{parts.netloc}\n',
+        'host',
+        'UNSIGNED-PAYLOAD',
+    ))
+    string_to_sign = '\n'.join(('AWS4-HMAC-SHA256', amz_date, scope,
+                                hashlib.sha256(canonical_request.encode()).hexdigest()))
+    signature = hmac.new(signing_key(credentials.secret_key, amz_date[:8], region, service),
+                         string_to_sign.encode(), hashlib.sha256).hexdigest()
+    return f'{parts.scheme}://{parts.netloc}{parts.path or "/"}?{canonical_query}&X-Amz-Signature={signature}'
+
+
+def endpoint_url(service, region):
+    """
+    Returns the https endpoint of a service in a region, or EICPROXY_ENDPOINT_URL if set.
+    """
+    if os.environ.get(ENDPOINT_URL_ENV):
+        return os.environ[ENDPOINT_URL_ENV]
+    suffix = 'amazonaws.com.cn' if region.startswith('cn-') else 'amazonaws.com'
+    return f'https://{service}.{region}.{suffix}'
+
+
+class BaseClient(object):
+    """
+    Signs and sends requests to one service endpoint, keeping a connection per thread.
+    """
+    endpoint_prefix = None
+    signing_name = None
+    #: libeicproxy.throttle.Throttle the client's calls go through, None sends them straight away
+    throttle = None
+
+    def __init__(self, session, endpoint=None):
+        self.session = session
+        self.region_name = session.region_name
+        self.endpoint = endpoint or endpoint_url(self.endpoint_prefix, self.region_name)
+        self.local_ = threading.local()
+
+    def _connection(self):
+        conn = getattr(self.local_, 'conn', None)
+        if conn is None:
+            parts = urlsplit(self.endpoint)
+            conn = self.local_.conn = HttpConnection(parts.hostname, parts.port, use_tls=parts.scheme == 'https')
+        return conn
+
+    def _send(self, headers, body):
+        signed = sign_request('POST', self.endpoint, self.region_name, self.signing_name,
+                              self.session.get_credentials(), headers, body)
+        path = urlsplit(self.endpoint).path or '/'
+        for attempt in (0, 1):
+            conn = self._connection()
+            try:
+                status, _headers, data = conn.request('POST', path, signed, body)
+                return status, data
+            except OSError as e:
+                # a kept-alive connection the server already closed, retry once on a new one
+                conn.close()
+                self.local_.conn = None
+                if attempt:
+                    raise ClientError('RequestError', str(e), 'request')
+
+    def _call(self, operation_name, *args):
+        if self.throttle is None:
+            return self._request(operation_name, *args)
+        return self.throttle.call(operation_name, lambda: self._request(operation_name, *args))
+
+
+class JsonClient(BaseClient):
+    """
+    Client for AWS JSON 1.1 protocol services.
+    """
+    target_prefix = None
+
+    def _request(self, operation_name, params):
+        body = json.dumps(params).encode()
+        status, data = self._send({'Content-Type': 'application/x-amz-json-1.1',
+                                   'X-Amz-Target': f'{self.target_prefix}.{operation_name}'}, body)
+        parsed = json.loads(data) if data else {}
+        if status >= 300:
+            code = parsed.get('__type', str(status)).split('#')[-1]
+            raise ClientError(code, parsed.get('message') or parsed.get('Message', ''), operation_name, status)
+        return parsed
+
+
+class InstanceConnectClient(JsonClient):
+    endpoint_prefix = 'ec2-instance-connect'
+    signing_name = 'ec2-instance-connect'
+    target_prefix = 'AWSEC2InstanceConnectService'
+
+    def send_ssh_public_key(self, **kwargs):
+        return self._call('SendSSHPublicKey', kwargs)
+
+
+def _strip_ns(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _children(element):
+    return {_strip_ns(child.tag): child for child in element}
+
+
+def _text(element, *path):
+    for name in path:
+        if element is None:
+            return None
+        element = _children(element).get(name)
+    return element.text if element is not None else None
+
+
+def _items(element, name):
+    container = _children(element).get(name) if element is not None else None
+    return list(container) if container is not None else []
+
+
+# DescribeInstances XML element -> boto3 key, for the scalar fields eicproxy reads
+instance_fields = (
+    ('instanceId', 'InstanceId'),
+    ('ipAddress', 'PublicIpAddress'),
+    ('privateIpAddress', 'PrivateIpAddress'),
+    ('dnsName', 'PublicDnsName'),
+    ('privateDnsName', 'PrivateDnsName'),
+    ('ipv6Address', 'Ipv6Address'),
+    ('vpcId', 'VpcId'),
+    ('subnetId', 'SubnetId'),
+    ('launchTime', 'LaunchTime'),
+)
+
+
+def _parse_instance(item):
+    instance = {}
+    for element, key in instance_fields:
+        value = _text(item, element)
+        if value is not None:
+            instance[key] = value
+    instance['Placement'] = {'AvailabilityZone': _text(item, 'placement', 'availabilityZone')}
+    instance['State'] = {'Name': _text(item, 'instanceState', 'name')}
+    tags = [{'Key': _text(tag, 'key'), 'Value': _text(tag, 'value') or ''} for tag in _items(item, 'tagSet')]
+    if tags:
+        instance['Tags'] = tags
+    return instance
+
+
+# DescribeInstanceConnectEndpoints XML element -> boto3 key
+endpoint_fields = (
+    ('instanceConnectEndpointId', 'InstanceConnectEndpointId'),
+    ('dnsName', 'DnsName'),
+    ('fipsDnsName', 'FipsDnsName'),
+    ('state', 'State'),
+    ('vpcId', 'VpcId'),
+    ('subnetId', 'SubnetId'),
+)
+
+
+def parse_describe_instance_connect_endpoints(body):
+    """
+    Parses a DescribeInstanceConnectEndpoints XML response into the boto3 response shape.
+    """
+    root = ElementTree.fromstring(body)
+    endpoints = []
+    for item in _items(root, 'instanceConnectEndpointSet'):
+        endpoint = {}
+        for element, key in endpoint_fields:
+            value = _text(item, element)
+            if value is not None:
+                endpoint[key] = value
+        endpoints.append(endpoint)
+    response = {'InstanceConnectEndpoints': endpoints}
+    next_token = _text(root, 'nextToken')
+    if next_token:
+        response['NextToken'] = next_token
+    return response
+
+
+def parse_describe_instances(body):
+    """
+    Parses a DescribeInstances XML response into the boto3 response shape, keeping only the
+    fields eicproxy uses.
+    """
+    root = ElementTree.fromstring(body)
+    response = {'Reservations': []}
+    for reservation in _items(root, 'reservationSet'):
+        response['Reservations'].append({
+            'OwnerId': _text(reservation, 'ownerId'),
+            'Instances': [_parse_instance(item) for item in _items(reservation, 'instancesSet')],
+        })
+    next_token = _text(root, 'nextToken')
+    if next_token:
+        response['NextToken'] = next_token
+    return response
+
+
+def _parse_query_error(body, operation_name, status):
+    try:
+        root = ElementTree.fromstring(body)
+    except ElementTree.ParseError:
+        raise ClientError(str(status), body.decode(errors='replace'), operation_name, status)
+    error = next((e for e in root.iter() if _strip_ns(e.tag) == 'Error'), root)
+    raise ClientError(_text(error, 'Code') or str(status), _text(error, 'Message') or '', operation_name, status)
+
+
+def serialize_filters(filters, params):
+    for i, query_filter in enumerate(filters or [], 1):
+        params[f'Filter.{i}.Name'] = query_filter['Name']
+        for j, value in enumerate(query_filter['Values'], 1):
+            params[f'Filter.{i}.Value.{j}'] = value
+
+
+class Ec2Client(BaseClient):
+    endpoint_prefix = 'ec2'
+    signing_name = 'ec2'
+
+    def _request(self, operation_name, params, parse):
+        params = dict(params, Action=operation_name, Version=EC2_API_VERSION)
+        body = urlencode(params).encode()
+        status, data = self._send({'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'}, body)
+        if status >= 300:
+            _parse_query_error(data, operation_name, status)
+        return parse(data)
+
+    def describe_instances(self, InstanceIds=None, Filters=None, MaxResults=None, NextToken=None):
+        params = {}
+        for i, instance_id in enumerate(InstanceIds or [], 1):
+            params[f'InstanceId.{i}'] = instance_id
+        serialize_filters(Filters, params)
+        if MaxResults:
+            params['MaxResults'] = str(MaxResults)
+        if NextToken:
+            params['NextToken'] = NextToken
+        return self._call('DescribeInstances', params, parse_describe_instances)
+
+    def describe_instance_connect_endpoints(self, Filters=None, MaxResults=None, NextToken=None):
+        params = {}
+        serialize_filters(Filters, params)
+        if MaxResults:
+            params['MaxResults'] = str(MaxResults)
+        if NextToken:
+            params['NextToken'] = NextToken
+        return self._call('DescribeInstanceConnectEndpoints', params, parse_describe_instance_connect_endpoints)
+
+    def get_paginator(self, operation_name):
+        return Paginator(getattr(self, operation_name))
+
+
+class Paginator(object):
+    """
+    NextToken paginator with the boto3 paginate(**kwargs) interface.
+    """
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, **kwargs):
+        config = kwargs.pop('PaginationConfig', {}) or {}
+        if config.get('PageSize'):
+            kwargs['MaxResults'] = config['PageSize']
+        while True:
+            page = self.method(**kwargs)
+            yield page
+            if not page.get('NextToken'):
+                return
+            kwargs['NextToken'] = page['NextToken']
+
+
+service_clients = {
+    'ec2': Ec2Client,
+    'ec2-instance-connect': InstanceConnectClient,
+}
+
+
+class Session(object):
+    """
+    Stand-in for boto3.session.Session for the services eicproxy uses.
+    """
+    def __init__(self, profile_name=None, region_name=None, credentials_provider=None):
+        """
+        :param credentials_provider: Returns a profile's Credentials, initially and whenever they
+           are about to expire. Default: resolve_credentials
+        :type credentials_provider: callable
+        :raises UnsupportedProfile: if the profile's credentials need boto3
+        """
+        self.profile_name = profile_name
+        self.region_name = region_name or resolve_region(profile_name)
+        self.credentials_provider = credentials_provider or resolve_credentials
+        with instrument.phase('credentials', engine='lite', profile=profile_name,
+                              provider=getattr(self.credentials_provider, '__qualname__', None)):
+            self.credentials_ = self.credentials_provider(profile_name)
+        self.lock_ = threading.Lock()
+
+    def get_credentials(self):
+        """
+        Returns current credentials, refreshing temporary ones shortly before they expire.
+        """
+        with self.lock_:
+            if self.credentials_.needs_refresh():
+                self.credentials_ = self.credentials_provider(self.profile_name)
+            return self.credentials_
+
+    def client(self, service_name, region_name=None, endpoint_url=None):
+        if service_name not in service_clients:
+            raise UnsupportedProfile(f'service {service_name} is not supported by the lite client')
+        session = self
+        if region_name and region_name != self.region_name:
+            session = Session(self.profile_name, region_name, self.credentials_provider)
+        return service_clients[service_name](session, endpoint_url)
+
+    create_client = client
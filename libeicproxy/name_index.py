@@ -0,0 +1,248 @@
+"""
+Local index of EC2 Name tags.
+
+Each (profile, region) is indexed with one paginated DescribeInstances call filtered on the
+Name tag key, covering every instance that is not terminated.  A tag Name connection then
+resolves from the index without any API call.  An index older than refresh_after is still
+used but refreshed in a background thread, one older than max_age (or missing) is refreshed
+before answering.  A Name missing from an index older than miss_refresh_after refreshes it
+too, but at most once per miss_refresh_interval for all processes, so a mistyped Name does
+not list the region on every connect.  DescribeInstances has no way to ask for changes only,
+so a refresh lists the region in full, but writes only the instances that changed.
+
+Several instances may carry the same Name.  They are ranked deterministically: running
+first, then the most recently launched, then the lowest instance id.
+"""
+
+import threading
+import time
+
+from . import defaults, ec2_util, instrument, state
+
+DB_NAME = 'names.sqlite'
+SCHEMA_VERSION = 4
+SCHEMA = (
+    '''CREATE TABLE instances (
+           profile TEXT NOT NULL,
+           region TEXT NOT NULL,
+           instance_id TEXT NOT NULL,
+           name TEXT NOT NULL,
+           availability_zone TEXT,
+           state TEXT,
+           public_ip TEXT,
+           private_ip TEXT,
+           public_dns_name TEXT,
+           private_dns_name TEXT,
+           ipv6_address TEXT,
+           subnet_id TEXT,
+           vpc_id TEXT,
+           launch_time TEXT,
+           PRIMARY KEY (profile, region, instance_id)
+       ) WITHOUT ROWID''',
+    'CREATE INDEX instances_by_name ON instances (profile, region, name)',
+    '''CREATE TABLE regions (
+           profile TEXT NOT NULL,
+           region TEXT NOT NULL,
+           refreshed REAL NOT NULL DEFAULT 0,
+           claimed REAL NOT NULL DEFAULT 0,
+           miss_refreshed REAL NOT NULL DEFAULT 0,
+           PRIMARY KEY (profile, region)
+       ) WITHOUT ROWID''',
+)
+
+FIELDS = ('instance_id', 'name', 'availability_zone', 'state', 'public_ip', 'private_ip',
+          'public_dns_name', 'private_dns_name', 'ipv6_address', 'subnet_id', 'vpc_id', 'launch_time')
+
+default_refresh_after = defaults.name_index_refresh_after
+default_max_age = defaults.name_index_max_age
+# a miss in an index at least this old triggers one synchronous refresh, the name may be new
+miss_refresh_after = 30
+# seconds between miss triggered refreshes of a region, whichever process triggers them
+miss_refresh_interval = 60
+# a background refresh claimed longer ago than this is assumed to have died
+claim_timeout = 120
+
+
+def best_first(instances):
+    """
+    Orders instances sharing a Name: running first, then most recently launched, then lowest id.
+
+    :rtype: list
+    """
+    instances = sorted(instances, key=lambda info: info.instance_id)
+    instances.sort(key=lambda info: info.launch_time or '', reverse=True)
+    instances.sort(key=lambda info: info.state != 'running')
+    return instances
+
+
+class NameIndex(object):
+    """
+    sqlite backed (profile, region, Name) -> instances index.
+    """
+    def __init__(self, refresh_after=default_refresh_after, max_age=default_max_age, path=None):
+        """
+        :param refresh_after: Seconds after which an index is refreshed in the background
+        :type refresh_after: int
+        :param max_age: Seconds after which an index is refreshed before it is used
+        :type max_age: int
+        :param path: Explicit database path, defaults to the eicproxy cache directory
+        :type path: basestring
+        """
+        self.refresh_after = refresh_after
+        self.max_age = max_age
+        self.db_ = state.Database(DB_NAME, SCHEMA, SCHEMA_VERSION, path=path)
+        self.refreshing_ = set()
+        self.lock_ = threading.Lock()
+
+    def age(self, profile, region):
+        """
+        Returns the seconds since the region was last indexed, or None if it never was.
+        """
+        row = self.db_.execute('SELECT refreshed FROM regions WHERE profile = ? AND region = ?',
+                               (profile, region)).fetchone()
+        if row is None or not row[0]:
+            return None
+        return max(0.0, time.time() - row[0])
+
+    def candidates(self, profile, region, name):
+        """
+        Returns the indexed instances carrying a Name, best first (see best_first).
+
+        :rtype: list
+        """
+        rows = self.db_.execute(
+            f'SELECT {", ".join(FIELDS)} FROM instances WHERE profile = ? AND region = ? AND name = ?',
+            (profile, region, name)).fetchall()
+        return best_first(ec2_util.InstanceRecord(region=region, **dict(zip(FIELDS, row))) for row in rows)
+
+    def refresh(self, client, profile, region):
+        """
+        Brings the index of a region up to date with one paginated DescribeInstances call,
+        writing only the instances that were added, changed or are gone.
+
+        :param client: EC2 client for the region (boto3 or lite_client)
+        """
+        listed = {}
+        with instrument.phase('name_index_refresh', region=region) as timing:
+            for info in ec2_util.describe_named(client, region):
+                listed[info.instance_id] = tuple(getattr(info, field) for field in FIELDS)
+            timing.set(instances=len(listed))
+        now = time.time()
+        with self.db_.transaction() as conn:
+            indexed = {row[0]: row for row in conn.execute(
+                f'SELECT {", ".join(FIELDS)} FROM instances WHERE profile = ? AND region = ?', (profile, region))}
+            gone = [(profile, region, instance_id) for instance_id in indexed if instance_id not in listed]
+            changed = [(profile, region) + row for instance_id, row in listed.items() if indexed.get(instance_id) != row]
+            conn.executemany('DELETE FROM instances WHERE profile = ? AND region = ? AND instance_id = ?', gone)
+            conn.executemany(
+                f'INSERT OR REPLACE INTO instances (profile, region, {", ".join(FIELDS)}) '
+                f'VALUES (?, ?, {", ".join("?" * len(FIELDS))})', changed)
+            conn.execute('INSERT INTO regions (profile, region, refreshed) VALUES (?, ?, ?) '
+                         'ON CONFLICT (profile, region) DO UPDATE SET refreshed = excluded.refreshed, claimed = 0',
+                         (profile, region, now))
+        instrument.event('name_index_delta', region=region, changed=len(changed), gone=len(gone))
+
+    def _claim(self, profile, region):
+        # only one process refreshes a region in the background at a time
+        now = time.time()
+        with self.db_.transaction() as conn:
+            row = conn.execute('SELECT claimed FROM regions WHERE profile = ? AND region = ?',
+                               (profile, region)).fetchone()
+            if row is not None and row[0] > now - claim_timeout:
+                return False
+            conn.execute('INSERT INTO regions (profile, region, claimed) VALUES (?, ?, ?) '
+                         'ON CONFLICT (profile, region) DO UPDATE SET claimed = excluded.claimed',
+                         (profile, region, now))
+            return True
+
+    def _claim_miss(self, profile, region):
+        # a miss refreshes a region at most once per miss_refresh_interval across processes
+        now = time.time()
+        with self.db_.transaction() as conn:
+            row = conn.execute('SELECT miss_refreshed FROM regions WHERE profile = ? AND region = ?',
+                               (profile, region)).fetchone()
+            if row is not None and row[0] > now - miss_refresh_interval:
+                return False
+            conn.execute('INSERT INTO regions (profile, region, miss_refreshed) VALUES (?, ?, ?) '
+                         'ON CONFLICT (profile, region) DO UPDATE SET miss_refreshed = excluded.miss_refreshed',
+                         (profile, region, now))
+            return True
+
+    def refresh_in_background(self, client, profile, region):
+        """
+        Starts a daemon thread refreshing the region, unless a refresh is already running.
+        """
+        key = (profile, region)
+        with self.lock_:
+            if key in self.refreshing_:
+                return
+            self.refreshing_.add(key)
+
+        def run():
+            try:
+                if self._claim(profile, region):
+                    self.refresh(client, profile, region)
+            except Exception:
+                # the next lookup retries, until max_age is reached the old index keeps serving
+                pass
+            finally:
+                with self.lock_:
+                    self.refreshing_.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _shared_refresh(self, client, profile, region, flight, since, miss=False):
+        """
+        Refreshes a region once for all the processes needing it at the same time.
+
+        :return: Whether the index was refreshed, a miss refresh may not be due yet
+        :rtype: bool
+        """
+        def refresh():
+            if miss and not self._claim_miss(profile, region):
+                return False
+            self.refresh(client, profile, region)
+            return True
+
+        if flight is None:
+            return refresh()
+        return flight.run(('names', profile, region), refresh, since=since)
+
+    def lookup(self, client, profile, region, name, flight=None):
+        """
+        Returns the instances carrying a Name in a region, refreshing the index as needed.
+
+        :param client: EC2 client for the region, used only when the index needs refreshing
+        :param profile: AWS profile
+        :type profile: basestring
+        :param region: Region to look in
+        :type region: basestring
+        :param name: Name tag value
+        :type name: basestring
+        :param flight: Shares refreshes with other processes refreshing the same region at the same time
+        :type flight: libeicproxy.single_flight.SingleFlight
+        :return: Matching instances, best first, empty if there are none
+        :rtype: list
+        """
+        asked = time.time()
+        age = self.age(profile, region)
+        if age is None or age > self.max_age:
+            # a shared miss refresh that was not due leaves the index as old as it was
+            if not self._shared_refresh(client, profile, region, flight, asked):
+                self.refresh(client, profile, region)
+            return self.candidates(profile, region, name)
+
+        found = self.candidates(profile, region, name)
+        if not found and age > miss_refresh_after:
+            if self._shared_refresh(client, profile, region, flight, asked, miss=True):
+                return self.candidates(profile, region, name)
+            return found
+        if age > self.refresh_after:
+            self.refresh_in_background(client, profile, region)
+        return found
+
+    def forget(self, profile, instance_id):
+        """
+        Drops an instance from the index, e.g. after its indexed address failed.
+        """
+        self.db_.execute('DELETE FROM instances WHERE profile = ? AND instance_id = ?', (profile, instance_id))
@@ -11,46 +11,146 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
+"""
+Parses the User@HostName:Port string ssh passes to eicproxy and tells what kind of host it names.
+
+The kind of a host is detected from its format alone, no API call involved:
+
+- instance_id: i-0123456789abcdef0
+- ipv4, ipv6: a private, public or IPv6 address of the instance
+- private_dns: ip-10-0-0-1.ec2.internal, ip-10-0-0-1.eu-west-1.compute.internal or the
+  resource name form i-0123456789abcdef0.eu-west-1.compute.internal
+- public_dns: ec2-3-80-1-2.compute-1.amazonaws.com, ec2-3-80-1-2.eu-west-1.compute.amazonaws.com
+- tag: Key=Value, an instance carrying that tag
+- name: anything else, a Name tag (or one of the --tag-keys)
+
+With profile_prefix a host may be qualified with the AWS profile to use as <profile>+<host>.
+It is off by default: Name tags may contain '+' themselves.
+"""
+
 import re
 import socket
 
-INSTANCE_ID_RE = re.compile("i-[a-f0-9]+")
+from .ec2_util import INSTANCE_ID_RE
+
+HOST_KINDS = ('instance_id', 'ipv4', 'ipv6', 'private_dns', 'public_dns', 'tag', 'name')
 UNIX_USER_RE_STR = '[a-z_][a-z0-9_-]{0,31}'
 UNIX_USER_RE = re.compile(UNIX_USER_RE_STR)
-TCP_PORT_RE_STR = '()([1-9]|[1-5]?[0-9]{2,4}|6[1-4][0-9]{3}|65[1-4][0-9]{2}|655[1-2][0-9]|6553[1-5])'
-TCP_PORT_RE = re.compile(f'^{TCP_PORT_RE_STR}$')
-HOSTNAME_CHR_MAX_RE_STR = '.{0,255}'
-CONNECTION_STRING_RE = re.compile(f'^{UNIX_USER_RE_STR}@{HOSTNAME_CHR_MAX_RE_STR}:{TCP_PORT_RE_STR}$')
-def parse(connection_string=None,jumphost=None):
-
+HOSTNAME_MAX_LENGTH = 255
+_REGION_RE_STR = r'[a-z]{2}(?:-[a-z]+)+-\d'
+PRIVATE_DNS_RE = re.compile(
+    rf'^(?:ip-\d{{1,3}}(?:-\d{{1,3}}){{3}}|i-[0-9a-f]{{8,17}})\.(?:ec2|(?P<region>{_REGION_RE_STR})\.compute)\.internal\.?$')
+PUBLIC_DNS_RE = re.compile(
+    rf'^ec2-\d{{1,3}}(?:-\d{{1,3}}){{3}}\.(?:compute-1|(?P<region>{_REGION_RE_STR})\.compute)\.amazonaws\.com(?:\.cn)?\.?$')
+# tag keys may contain letters, digits, spaces and _.:/=+-@ but ssh host names no spaces
+TAG_HOST_RE = re.compile(r'^(?P<key>[A-Za-z0-9_.:/+\-@]{1,128})=(?P<value>.*)$')
+# region of the DNS names without one
+dns_default_region = 'us-east-1'
+PROFILE_SEPARATOR = '+'
+
+
+class ConnectionSpec(object):
+    """
+    What ssh asked eicproxy to connect to.
+    """
+    __slots__ = ('os_user', 'host', 'port', 'kind', 'profile')
+
+    def __init__(self, os_user, host, port, kind, profile=None):
+        """
+        :param os_user: User ssh authenticates as (%r)
+        :type os_user: basestring
+        :param host: Host token without its profile qualifier (%h)
+        :type host: basestring
+        :param port: TCP port (%p)
+        :type port: int
+        :param kind: One of HOST_KINDS
+        :type kind: basestring
+        :param profile: AWS profile the host was qualified with, None if it was not
+        :type profile: basestring
+        """
+        self.os_user = os_user
+        self.host = host
+        self.port = port
+        self.kind = kind
+        self.profile = profile
+
+    def __repr__(self):
+        return (f'ConnectionSpec(os_user={self.os_user!r}, host={self.host!r}, port={self.port!r}, '
+                f'kind={self.kind!r}, profile={self.profile!r})')
+
+
+def parse(connection_string, use_tag_name=False, profile_prefix=False):
     """
     Parses the connection string composed of User@HostName:Port passed from ssh into eicproxy.
 
-    :param connection_string: A string formmated 'User@HostName:Port'
-    :type connection_string: string
-    :param jumphost
-    :return: dict containing at least os_user, ssh_host_token, ssh_host_token_type, ssh_port. host_token_type will be one of private_ip,public_ip,
-    :rtype: conection_dict: dict
+    :param connection_string: A string formatted 'User@HostName:Port'
+    :type connection_string: basestring
+    :param use_tag_name: Take the host for a Name tag whatever it looks like
+    :type use_tag_name: bool
+    :param profile_prefix: Split a '<profile>+' prefix off HostName, the AWS profile to use
+    :type profile_prefix: bool
+    :return: The parsed connection
+    :rtype: ConnectionSpec
+    :raises ValueError: if the connection string is malformed
     """
-    connection_dict = dict()
-
-    if _is_valid_connection_str(connection_string):
-        os_user = connection_string.split('@')[0]
-        host_token = connection_string.split('@')[1].split(':')[0]
-        ssh_port = connection_string.split('@')[1].split(':')[1]
-    else:
-        raise ValueError(f'eicproxy recieved invalid conection string: {connection_string}')
+    os_user, at, rest = connection_string.partition('@')
+    # the port comes last, an IPv6 host has colons of its own
+    host, colon, port = rest.rpartition(':')
+    if not (at and colon and os_user and host) or not port.isdigit() or not 0 < int(port) < 65536:
+        raise ValueError(f'eicproxy received an invalid connection string: {connection_string}, '
+                         f'eicproxy %r@%h:%p or <ssh-user>@<ssh-host>:<ssh-port> is required')
+    profile = None
+    if profile_prefix:
+        qualifier, plus, unqualified = host.partition(PROFILE_SEPARATOR)
+        if plus and qualifier and unqualified and '=' not in qualifier:
+            profile, host = qualifier, unqualified
+    if host.startswith('[') and host.endswith(']'):
+        host = host[1:-1]
+    if len(host) > HOSTNAME_MAX_LENGTH:
+        raise ValueError(f'eicproxy received a host name longer than {HOSTNAME_MAX_LENGTH} characters')
+    return ConnectionSpec(os_user, host, int(port), 'name' if use_tag_name else host_kind(host), profile)
+
+
+def host_kind(host):
+    """
+    Tells what kind of host a host token names, see HOST_KINDS.
 
-    if _is_valid_target(jumphost):
+    :rtype: basestring
+    """
+    if INSTANCE_ID_RE.match(host):
+        return 'instance_id'
+    if _is_valid_ipv4_address(host):
+        return 'ipv4'
+    if _is_valid_ipv6_address(host):
+        return 'ipv6'
+    lowered = host.lower()
+    if PRIVATE_DNS_RE.match(lowered):
+        return 'private_dns'
+    if PUBLIC_DNS_RE.match(lowered):
+        return 'public_dns'
+    if TAG_HOST_RE.match(host):
+        return 'tag'
+    return 'name'
+
+
+def dns_region(host):
+    """
+    Returns the region an EC2 private or public DNS name lives in, None for other hosts.
+    """
+    host = host.lower()
+    match = PRIVATE_DNS_RE.match(host) or PUBLIC_DNS_RE.match(host)
+    if match is None:
+        return None
+    return match.group('region') or dns_default_region
 
 
-    return instance_bundles, flags, command
-    
-def _is_valid_connection_str(connection_string=None):
+def tag_filter(host):
     """
-    Validate if connection_str can be parsed
+    Returns the (key, value) of a Key=Value host token.
     """
-    return CONNECTION_STRING_RE.match(connection_string) is not None
+    match = TAG_HOST_RE.match(host)
+    return match.group('key'), match.group('value')
+
 
 def _is_valid_instance_id(instance_id):
     """
@@ -58,6 +158,7 @@ def _is_valid_instance_id(instance_id):
     """
     return INSTANCE_ID_RE.match(instance_id) is not None
 
+
 def _is_valid_username(username):
     """
     Validates if the provided username is a valid UNIX username
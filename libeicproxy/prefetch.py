@@ -0,0 +1,69 @@
+"""
+`eicproxy prefetch`: resolve a list of hosts in bulk and push the public key to all of them,
+so the ProxyCommand runs that follow find the lookup cache and key push ledger warm.
+"""
+
+import argparse
+import getpass
+import json
+import sys
+
+from . import cli, defaults, instrument
+
+
+def main(argv):
+    """
+    Entry point for `eicproxy prefetch`.
+    """
+    parser = argparse.ArgumentParser(prog='eicproxy prefetch',
+                                     description='Resolve many hosts with batched DescribeInstances calls and push the public key to them in parallel.')
+    parser.add_argument('hosts', type=str, nargs='*', help='Instance ids or Name tags to prefetch.')
+    parser.add_argument('--hosts-file', type=argparse.FileType('r'), default=None, metavar='',
+                        help='Read more hosts from this file, one per line, - for stdin.')
+    parser.add_argument('--user', type=str, default=getpass.getuser(), metavar='',
+                        help='OS user the key is pushed for. Default: the current user')
+    parser.add_argument('--no-push', action='store_true', help='Only resolve the hosts and fill the lookup cache.')
+    parser.add_argument('--max-workers', type=int, default=defaults.push_workers, metavar='',
+                        help=f'Maximum number of key pushes in flight. Default: {defaults.push_workers}')
+    parser.add_argument('--json', action='store_true', help='Print one JSON object per host.')
+    cli.add_common_arguments(parser)
+    args = parser.parse_args(argv)
+
+    hosts = cli.read_hosts(args.hosts, args.hosts_file)
+    if not hosts:
+        parser.error('no hosts given')
+    try:
+        instrument.configure(args.trace)
+    except (OSError, ValueError) as e:
+        parser.error(f'--trace: {e}')
+
+    from .broker import Broker, BrokerError
+
+    broker = Broker()
+    request = cli.request_from_args(args, os_user=args.user)
+    # a region that cannot be listed is reported after the hosts found in the others
+    errors = {}
+    try:
+        with instrument.phase('prefetch', hosts=len(hosts)):
+            results = broker.prefetch(request, hosts, push_keys=not args.no_push, max_workers=args.max_workers,
+                                      errors=errors)
+    except BrokerError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+
+    from .throttle import stats
+
+    failed = 0
+    for result in results:
+        if result['status'] == 'not found' or result['status'].startswith('key push failed'):
+            failed += 1
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"{result['host']:30} {result.get('instance_id') or '-':20} {result.get('region') or '-':15} "
+                  f"{result.get('ip') or '-':16} {result['status']}")
+    if errors:
+        print(broker.listing_errors(errors), file=sys.stderr)
+    if stats.summary() and not args.json:
+        print(stats.summary(), file=sys.stderr)
+    return 1 if failed or errors else 0
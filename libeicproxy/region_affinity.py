@@ -0,0 +1,121 @@
+"""
+What past instance lookups taught about where instances live.
+
+Three things are recorded per AWS profile:
+
+- the home of each instance id: the region (and account) it was found in, searched first and
+  alone the next time the id is looked up
+- misses: short lived (instance id, region) entries for regions the instance was not in,
+  skipped while fresh
+- the regions the profile ever found an instance in, searched before the regions it never did;
+  those are only searched when the used ones all missed
+
+So an instance living in the last of several --regions costs one DescribeInstances call once
+it has been found, and regions a profile has no instances in are not queried at all as long as
+the instance turns up in one that does.
+"""
+
+import time
+
+from . import defaults, state
+
+DB_NAME = 'regions.sqlite'
+SCHEMA_VERSION = 1
+SCHEMA = (
+    '''CREATE TABLE homes (
+           profile TEXT NOT NULL,
+           instance_id TEXT NOT NULL,
+           region TEXT NOT NULL,
+           account TEXT,
+           found REAL NOT NULL,
+           PRIMARY KEY (profile, instance_id)
+       ) WITHOUT ROWID''',
+    '''CREATE TABLE misses (
+           profile TEXT NOT NULL,
+           instance_id TEXT NOT NULL,
+           region TEXT NOT NULL,
+           expires REAL NOT NULL,
+           PRIMARY KEY (profile, instance_id, region)
+       ) WITHOUT ROWID''',
+    '''CREATE TABLE used_regions (
+           profile TEXT NOT NULL,
+           region TEXT NOT NULL,
+           hits INTEGER NOT NULL DEFAULT 0,
+           last_hit REAL NOT NULL,
+           PRIMARY KEY (profile, region)
+       ) WITHOUT ROWID''',
+)
+
+default_miss_ttl = defaults.region_miss_ttl
+
+
+class RegionAffinity(object):
+    """
+    sqlite backed instance homes, region misses and per profile used regions.
+    """
+    def __init__(self, miss_ttl=default_miss_ttl, path=None):
+        """
+        :param miss_ttl: Seconds a region miss is remembered
+        :type miss_ttl: int
+        :param path: Explicit database path, defaults to the eicproxy cache directory
+        :type path: basestring
+        """
+        self.miss_ttl = miss_ttl
+        self.db_ = state.Database(DB_NAME, SCHEMA, SCHEMA_VERSION, path=path)
+
+    def stages(self, profile, instance_id, regions, ignore_misses=False):
+        """
+        Splits the regions to search for an instance into stages, each searched only if every
+        region of the stages before it missed: the instance's home, then the regions the profile
+        used before, then the rest. Regions that recently missed are left out.
+
+        :param regions: Regions to search, in the requested order
+        :type regions: list
+        :param ignore_misses: Keep recently missed regions, e.g. for --refresh-cache
+        :type ignore_misses: bool
+        :return: List of non-empty region lists
+        :rtype: list
+        """
+        home = self.db_.execute('SELECT region FROM homes WHERE profile = ? AND instance_id = ?',
+                                (profile, instance_id)).fetchone()
+        missed = set() if ignore_misses else {row[0] for row in self.db_.execute(
+            'SELECT region FROM misses WHERE profile = ? AND instance_id = ? AND expires > ?',
+            (profile, instance_id, time.time()))}
+        used = {row[0] for row in self.db_.execute('SELECT region FROM used_regions WHERE profile = ?', (profile,))}
+        remaining = [region for region in regions if region not in missed]
+        stages = []
+        if home is not None and home[0] in remaining:
+            stages.append([home[0]])
+            remaining.remove(home[0])
+        if used:
+            stages.append([region for region in remaining if region in used])
+            stages.append([region for region in remaining if region not in used])
+        else:
+            stages.append(remaining)
+        return [stage for stage in stages if stage]
+
+    def hit(self, profile, instance_id, region, account=None):
+        """
+        Records where an instance was found.
+        """
+        now = time.time()
+        with self.db_.transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO homes (profile, instance_id, region, account, found) VALUES (?, ?, ?, ?, ?)',
+                         (profile, instance_id, region, account, now))
+            conn.execute('DELETE FROM misses WHERE profile = ? AND instance_id = ?', (profile, instance_id))
+            conn.execute('INSERT INTO used_regions (profile, region, hits, last_hit) VALUES (?, ?, 1, ?) '
+                         'ON CONFLICT (profile, region) DO UPDATE SET hits = hits + 1, last_hit = excluded.last_hit',
+                         (profile, region, now))
+
+    def miss(self, profile, instance_id, region):
+        """
+        Records that an instance is not in a region. A miss in its home region drops the home,
+        the instance was terminated.
+        """
+        now = time.time()
+        with self.db_.transaction() as conn:
+            conn.execute('DELETE FROM misses WHERE expires <= ?', (now,))
+            conn.execute('INSERT OR REPLACE INTO misses (profile, instance_id, region, expires) VALUES (?, ?, ?, ?)',
+                         (profile, instance_id, region, now + self.miss_ttl))
+            conn.execute('DELETE FROM homes WHERE profile = ? AND instance_id = ? AND region = ?',
+                         (profile, instance_id, region))
@@ -0,0 +1,79 @@
+"""
+Concurrent search for an instance across several regions.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from . import defaults
+
+default_max_workers = defaults.max_region_workers
+
+
+class RegionSearchError(Exception):
+    """
+    Raised when no region returned a hit and at least one region failed, or in an ordered search
+    when a region failed before the first hit.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(f'{region}: {error}' for region, error in errors.items()))
+
+
+def first_hit(find, regions, max_workers=default_max_workers, ordered=False, errors=None):
+    """
+    Calls find(region) for the given regions concurrently and returns the first non-None result.
+
+    Lookups that have not started yet are cancelled once a hit is found, lookups already in
+    flight are left to finish in the background and their results are ignored.
+
+    :param find: Callable taking a region name, returning a result or None on a miss
+    :type find: callable
+    :param regions: Regions to search
+    :type regions: list
+    :param max_workers: Maximum number of lookups running at the same time
+    :type max_workers: int
+    :param ordered: If True, a hit only wins once every region listed before it has missed, so
+       the result is the same as a sequential search (use when names can exist in several regions).
+       A region failing before the hit ends the search, a later region must not win in its place.
+    :type ordered: bool
+    :param errors: dict the regions that failed are added to, also when a hit is returned
+    :type errors: dict
+    :return: The winning result, or None if every region missed
+    :raises RegionSearchError: if nothing was found and one or more regions raised, or if ordered
+       and a region before the first hit raised
+    """
+    if not regions:
+        return None
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(regions))))
+    futures = [executor.submit(find, region) for region in regions]
+    outcomes = {}
+    errors = {} if errors is None else errors
+    try:
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    outcomes[future] = future.result()
+                except Exception as e:
+                    outcomes[future] = None
+                    errors[regions[futures.index(future)]] = e
+
+            for region, future in zip(regions, futures):
+                if future not in outcomes:
+                    if ordered:
+                        break
+                    continue
+                if ordered and region in errors:
+                    raise RegionSearchError({region: errors[region]})
+                if outcomes[future] is not None:
+                    return outcomes[future]
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+    if errors:
+        raise RegionSearchError(errors)
+    return None
@@ -0,0 +1,390 @@
+"""
+Relays ssh's ProxyCommand stdin/stdout to a TCP connection.
+
+On Linux each direction is moved with splice(2) in its own thread, so the bytes never enter
+Python.  Elsewhere a single selectors loop copies through one large reusable buffer.  Half-close
+is honoured both ways: EOF on stdin shuts down the socket's write side and the relay keeps
+delivering the server's data until the server closes.
+
+A Gate lets the relay start before the instance is ready to authenticate the user: the
+client's cleartext SSH stream (version line and key exchange) is followed until its NEWKEYS
+message, and everything the client sends after it, authentication included, is held back
+until the gate opens.  The TCP handshake, version exchange and key exchange so overlap with
+the key push.
+"""
+
+import errno
+import os
+import selectors
+import socket
+import sys
+import threading
+import time
+
+default_buffer_size = 256 * 1024
+default_connect_timeout = 30
+
+modes = ('splice', 'select')
+# no SPLICE_F_MORE: it corks the socket like MSG_MORE and would stall small interactive writes
+splice_flags = getattr(os, 'SPLICE_F_MOVE', 0)
+# errors meaning an fd cannot be spliced, rather than that the peer went away
+splice_unsupported = (errno.EINVAL, errno.ENOSYS, errno.EBADF, errno.ESPIPE)
+# errors that end a direction of the relay like an EOF
+peer_gone = (errno.EPIPE, errno.ECONNRESET, errno.ENOTCONN, errno.ESHUTDOWN)
+
+SSH_MSG_NEWKEYS = 21
+# larger cleartext packets are not SSH key exchange, the gate closes right there
+max_kex_packet = 256 * 1024
+
+
+class RelayAborted(Exception):
+    """
+    Raised by relay() when its gate opened with an error, the connection was closed.
+    """
+
+
+class Gate(object):
+    """
+    Holds the client's authentication until open() is called, see relay().
+    """
+    def __init__(self):
+        self.error = None
+        self.event_ = threading.Event()
+        self.read_fd_, self.write_fd_ = os.pipe()
+
+    def open(self, error=None):
+        """
+        Lets the held client data through, or with an error aborts the relay instead.
+
+        :param error: Why the connection cannot go on, e.g. the key push failed
+        :type error: basestring
+        """
+        self.error = error
+        self.event_.set()
+        os.write(self.write_fd_, b'.')
+
+    def wait(self):
+        """
+        Blocks until the gate is open and returns its error, or None.
+        """
+        self.event_.wait()
+        return self.error
+
+    def fileno(self):
+        """
+        fd that becomes readable once the gate is open, for selectors.
+        """
+        return self.read_fd_
+
+    def close(self):
+        os.close(self.read_fd_)
+        os.close(self.write_fd_)
+
+
+class KexWatcher(object):
+    """
+    Follows the client side of a cleartext SSH stream (RFC 4253) up to its NEWKEYS message.
+    """
+    def __init__(self):
+        self.buf_ = bytearray()
+        self.version_seen_ = False
+
+    def feed(self, data):
+        """
+        Consumes client data.
+
+        :return: Offset into data just past the client's NEWKEYS packet (or past the point the
+           stream stopped looking like SSH key exchange), None if it has not been reached yet
+        :rtype: int
+        """
+        start = len(self.buf_)
+        self.buf_ += data
+        pos = 0
+        if not self.version_seen_:
+            end = self.buf_.find(b'\n')
+            if end < 0:
+                return None if len(self.buf_) < max_kex_packet else 0
+            self.version_seen_ = True
+            pos = end + 1
+        while len(self.buf_) - pos >= 6:
+            packet_length = int.from_bytes(self.buf_[pos:pos + 4], 'big')
+            if packet_length < 2 or packet_length > max_kex_packet:
+                return max(0, pos - start)
+            end = pos + 4 + packet_length
+            if end > len(self.buf_):
+                break
+            if self.buf_[pos + 5] == SSH_MSG_NEWKEYS:
+                return end - start
+            pos = end
+        del self.buf_[:pos]
+        return None
+
+
+class RelayStats(object):
+    """
+    Byte counts and timing of a relay session.
+    """
+    def __init__(self, mode):
+        self.mode = mode
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.aborted = None
+        # monotonic time the first byte from the server arrived
+        self.first_byte = None
+
+    def duration(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def summary(self):
+        """
+        Returns a one line human readable summary, e.g. for stderr.
+        """
+        duration = self.duration()
+        rate = (self.bytes_up + self.bytes_down) / duration / 1e6 if duration > 0 else 0.0
+        return (f'eicproxy relay ({self.mode}): sent {self.bytes_up} bytes, received {self.bytes_down} bytes '
+                f'in {duration:.3f}s ({rate:.2f} MB/s)')
+
+
+def default_mode():
+    """
+    Returns 'splice' where os.splice is available (Linux, Python 3.10+), otherwise 'select'.
+    """
+    return 'splice' if hasattr(os, 'splice') and sys.platform.startswith('linux') else 'select'
+
+
+def tune_socket(sock, buffer_size=0):
+    """
+    Applies the socket options used for relayed connections.
+
+    :param sock: A connected TCP socket
+    :type sock: socket.socket
+    :param buffer_size: SO_SNDBUF/SO_RCVBUF size in bytes. 0 keeps the kernel default, on Linux
+       a fixed size also turns off buffer autotuning.
+    :type buffer_size: int
+    """
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if buffer_size:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_size)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+
+
+def connect(host, port, timeout=default_connect_timeout, buffer_size=0):
+    """
+    Opens a tuned, blocking TCP connection.
+
+    :raises OSError: if the connection fails
+    """
+    sock = socket.create_connection((host, port), timeout=timeout)
+    sock.settimeout(None)
+    tune_socket(sock, buffer_size)
+    return sock
+
+
+def _write_all(fd, view):
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _splice_loop(src_fd, dst_fd, count, add):
+    """
+    Moves bytes from src_fd to dst_fd with splice until EOF.
+
+    :return: Bytes moved, or None if the fds cannot be spliced (then the copy loop has to take over)
+    """
+    # always splice through a private pipe: a blocking splice holds the lock of the pipe it
+    # works on while it waits, and on ssh's own stdin/stdout pipes that stalls ssh's reads and
+    # writes until the socket has data (or room) again
+    pipe_r, pipe_w = os.pipe()
+    moved = 0
+    try:
+        while True:
+            n = pending = 0
+            try:
+                n = pending = os.splice(src_fd, pipe_w, count, flags=splice_flags)
+                while pending:
+                    pending -= os.splice(pipe_r, dst_fd, pending, flags=splice_flags)
+            except OSError as e:
+                if moved == 0 and e.errno in splice_unsupported:
+                    if pending:
+                        # dst_fd refused the first splice, hand over what already left src_fd
+                        _write_all(dst_fd, os.read(pipe_r, pending))
+                        add(pending)
+                    return None
+                if e.errno in peer_gone:
+                    return moved
+                raise
+            if n == 0:
+                return moved
+            moved += n
+            add(n)
+    finally:
+        os.close(pipe_r)
+        os.close(pipe_w)
+
+
+def _copy_loop(src_fd, dst_fd, buffer_size, add):
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    while True:
+        try:
+            n = os.readv(src_fd, [buf])
+            if n == 0:
+                return
+            _write_all(dst_fd, view[:n])
+        except OSError as e:
+            if e.errno in peer_gone:
+                return
+            raise
+        add(n)
+
+
+def _pump(src_fd, dst_fd, buffer_size, add):
+    if _splice_loop(src_fd, dst_fd, buffer_size, add) is None:
+        _copy_loop(src_fd, dst_fd, buffer_size, add)
+
+
+def _pass_gate(sock, in_fd, buffer_size, gate, add):
+    """
+    Copies client data to sock up to the client's NEWKEYS, waits for the gate, then sends
+    whatever was held back.
+
+    :return: False if in_fd reached EOF before the gate
+    """
+    watcher = KexWatcher()
+    while True:
+        data = os.read(in_fd, buffer_size)
+        if not data:
+            return False
+        cut = watcher.feed(data)
+        if cut is not None:
+            break
+        sock.sendall(data)
+        add(len(data))
+    sock.sendall(data[:cut])
+    if gate.wait() is not None:
+        raise RelayAborted(gate.error)
+    sock.sendall(data[cut:])
+    add(len(data))
+    return True
+
+
+def _splice_relay(sock, in_fd, out_fd, buffer_size, stats, gate):
+    def add_up(n):
+        stats.bytes_up += n
+
+    def add_down(n):
+        if not stats.bytes_down:
+            stats.first_byte = time.monotonic()
+        stats.bytes_down += n
+
+    def upstream():
+        try:
+            if gate is None or _pass_gate(sock, in_fd, buffer_size, gate, add_up):
+                _pump(in_fd, sock.fileno(), buffer_size, add_up)
+        except (RelayAborted, OSError) as e:
+            # the server went away first: a quiet end, like in _select_relay, other errors are
+            # raised by relay() in the calling thread
+            if isinstance(e, RelayAborted) or e.errno not in peer_gone:
+                stats.aborted = e
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        finally:
+            try:
+                sock.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+    # the upstream thread is a daemon: once the server closed there is nothing left to relay
+    threading.Thread(target=upstream, daemon=True).start()
+    _pump(sock.fileno(), out_fd, buffer_size, add_down)
+
+
+def _select_relay(sock, in_fd, out_fd, buffer_size, stats, gate):
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    watcher = KexWatcher() if gate is not None else None
+    held = b''
+    selector = selectors.DefaultSelector()
+    selector.register(in_fd, selectors.EVENT_READ, 'up')
+    selector.register(sock, selectors.EVENT_READ, 'down')
+    try:
+        while True:
+            for key, _events in selector.select():
+                try:
+                    if key.data == 'up':
+                        n = os.readv(in_fd, [buf])
+                        if n == 0:
+                            selector.unregister(in_fd)
+                            sock.shutdown(socket.SHUT_WR)
+                            continue
+                        cut = watcher.feed(view[:n]) if watcher is not None else None
+                        if cut is not None:
+                            # hold the rest until the gate opens, see Gate
+                            watcher = None
+                            held = bytes(view[cut:n])
+                            n = cut
+                            selector.unregister(in_fd)
+                            selector.register(gate, selectors.EVENT_READ, 'gate')
+                        sock.sendall(view[:n])
+                        stats.bytes_up += n
+                    elif key.data == 'gate':
+                        selector.unregister(gate)
+                        if gate.error is not None:
+                            sock.shutdown(socket.SHUT_RDWR)
+                            raise RelayAborted(gate.error)
+                        sock.sendall(held)
+                        stats.bytes_up += len(held)
+                        selector.register(in_fd, selectors.EVENT_READ, 'up')
+                    else:
+                        n = sock.recv_into(buf)
+                        if n == 0:
+                            return
+                        _write_all(out_fd, view[:n])
+                        if not stats.bytes_down:
+                            stats.first_byte = time.monotonic()
+                        stats.bytes_down += n
+                except OSError as e:
+                    if e.errno in peer_gone:
+                        return
+                    raise
+    finally:
+        selector.close()
+
+
+def relay(sock, in_fd=0, out_fd=1, buffer_size=default_buffer_size, mode=None, gate=None):
+    """
+    Relays in_fd to sock and sock to out_fd until the server closes the connection.
+
+    :param sock: A connected, blocking socket
+    :type sock: socket.socket
+    :param in_fd: fd to read client data from. Default: stdin
+    :type in_fd: int
+    :param out_fd: fd to write server data to. Default: stdout
+    :type out_fd: int
+    :param buffer_size: Bytes moved per splice or copied per read
+    :type buffer_size: int
+    :param mode: 'splice' or 'select', see default_mode()
+    :type mode: basestring
+    :param gate: Hold the client's data after its SSH NEWKEYS until this gate opens
+    :type gate: Gate
+    :return: Byte counts and timing of the session
+    :rtype: RelayStats
+    :raises RelayAborted: if the gate opened with an error
+    """
+    mode = mode or default_mode()
+    stats = RelayStats(mode)
+    try:
+        if mode == 'splice':
+            _splice_relay(sock, in_fd, out_fd, buffer_size, stats, gate)
+        else:
+            _select_relay(sock, in_fd, out_fd, buffer_size, stats, gate)
+    finally:
+        stats.finished = time.monotonic()
+    if stats.aborted is not None:
+        raise stats.aborted
+    return stats
@@ -0,0 +1,147 @@
+"""
+The resolver chain: finds the instance behind the host ssh was given.
+
+parse_connection tells the kind of a host from its format, locally and for free.  Each resolver
+handles some kinds and looks a host up in one region; the chain holds them in order and a host
+goes to every resolver handling its kind until one finds it.  Resolvers answering from local
+state come before the ones needing an API call:
+
+- InstanceIdResolver: DescribeInstances by id
+- DnsNameResolver: private-dns-name or dns-name filter, in the region the name carries
+- AddressResolver: private-ip-address, ip-address or ipv6-address filter
+- TagResolver: Key=Value hosts, tag:Key filter
+- NameIndexResolver: the local Name tag index, see name_index
+- TagKeyResolver: one per --tag-keys key, tag:<key> filter, for names the Name tag missed
+
+The instance cache is consulted before the chain runs, see Broker.resolve.
+"""
+
+import ipaddress
+
+from . import parse_connection
+
+
+class Resolver(object):
+    """
+    Looks up hosts of some kinds, one region at a time.
+    """
+    #: Host kinds handled, see parse_connection.HOST_KINDS
+    kinds = ()
+    #: Whether a hit only counts once every region listed before it missed, for hosts that are
+    #: not unique across regions
+    ordered = True
+
+    def handles(self, kind):
+        return kind in self.kinds
+
+    def regions(self, host, regions):
+        """
+        Returns the regions to search for host, by default the requested ones.
+        """
+        return regions
+
+    def find(self, broker, region, host, request):
+        """
+        Looks host up in one region.
+
+        :param broker: The broker doing the lookup, for its clients and indexes
+        :type broker: libeicproxy.broker.Broker
+        :return: Instance record, with the ids of other matches in duplicates, or None
+        :rtype: libeicproxy.ec2_util.InstanceRecord
+        """
+        raise NotImplementedError
+
+
+class InstanceIdResolver(Resolver):
+    kinds = ('instance_id',)
+    # instance ids are unique, the first region to answer wins
+    ordered = False
+
+    def find(self, broker, region, host, request):
+        return broker.describe_instance(region, host, request)
+
+
+class FilterResolver(Resolver):
+    """
+    Resolves hosts with one filtered DescribeInstances call per region.
+    """
+    def filters(self, host):
+        """
+        Returns the DescribeInstances filters matching host.
+        """
+        raise NotImplementedError
+
+    def find(self, broker, region, host, request):
+        return broker.find_matching(region, request, self.filters(host))
+
+
+class DnsNameResolver(FilterResolver):
+    kinds = ('private_dns', 'public_dns')
+
+    def regions(self, host, regions):
+        # the region is part of the name, no other region can have it
+        return [parse_connection.dns_region(host)]
+
+    def filters(self, host):
+        name = 'private-dns-name' if parse_connection.host_kind(host) == 'private_dns' else 'dns-name'
+        return [{'Name': name, 'Values': [host.lower().rstrip('.')]}]
+
+
+class AddressResolver(FilterResolver):
+    kinds = ('ipv4', 'ipv6')
+
+    def filters(self, host):
+        address = ipaddress.ip_address(host)
+        if address.version == 6:
+            name = 'ipv6-address'
+        elif address.is_private:
+            name = 'private-ip-address'
+        else:
+            name = 'ip-address'
+        return [{'Name': name, 'Values': [str(address)]}]
+
+
+class TagResolver(FilterResolver):
+    kinds = ('tag',)
+
+    def filters(self, host):
+        key, value = parse_connection.tag_filter(host)
+        return [{'Name': f'tag:{key}', 'Values': [value]}]
+
+
+class NameIndexResolver(Resolver):
+    kinds = ('name',)
+
+    def find(self, broker, region, host, request):
+        return broker.find_named(region, request)
+
+
+class TagKeyResolver(FilterResolver):
+    kinds = ('name',)
+
+    def __init__(self, key):
+        """
+        :param key: Tag key whose value the host is, e.g. Hostname
+        :type key: basestring
+        """
+        self.key = key
+
+    def filters(self, host):
+        return [{'Name': f'tag:{self.key}', 'Values': [host]}]
+
+
+default_chain = (InstanceIdResolver(), DnsNameResolver(), AddressResolver(), TagResolver(), NameIndexResolver())
+
+
+def chain(kind, tag_keys=()):
+    """
+    Returns the resolvers to try for a host of a kind, in order.
+
+    :param kind: See parse_connection.HOST_KINDS
+    :type kind: basestring
+    :param tag_keys: Tag keys besides Name a name may be the value of, see --tag-keys
+    :type tag_keys: list
+    :rtype: list
+    """
+    resolvers = list(default_chain) + [TagKeyResolver(key) for key in tag_keys or () if key != 'Name']
+    return [resolver for resolver in resolvers if resolver.handles(kind)]
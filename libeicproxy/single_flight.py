@@ -0,0 +1,180 @@
+"""
+Cross-process single flight: concurrent identical requests share one AWS call.
+
+When ssh, scp or ansible start many eicproxy processes for the same host at once, they all
+miss the instance cache and the key push ledger at the same moment.  Each flight key (the
+identical request) has a lock file: the process that gets the lock makes the call and stores
+its result, or its error, in flights.sqlite.  The others wait for the lock and take the stored
+result of a flight that finished after they started waiting, instead of calling again.  Threads
+of the eicproxy agent coordinate the same way, flock locks are per open file.
+
+The flight's own state is an optimization: when its lock file or database cannot be used the
+process just makes the call.  The process holding a lock removes its file when done, so the lock
+directory only holds the flights in progress.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from os.path import dirname, join
+
+from . import defaults, instrument, state
+
+DB_NAME = 'flights.sqlite'
+SCHEMA_VERSION = 1
+SCHEMA = (
+    '''CREATE TABLE flights (
+           key TEXT NOT NULL PRIMARY KEY,
+           finished REAL NOT NULL,
+           result TEXT,
+           error TEXT
+       ) WITHOUT ROWID''',
+)
+
+# seconds a finished flight's result is kept for processes that were waiting on it
+keep_seconds = 60
+# seconds between attempts to take a lock another flight holds, growing up to poll_max
+poll_min = 0.001
+poll_max = 0.02
+
+
+class FlightFailed(Exception):
+    """
+    Raised in the processes that waited on a flight whose call failed, with its error message.
+    """
+
+
+class SingleFlight(object):
+    """
+    Runs a call once for all the processes asking for the same flight key at the same time.
+    """
+    def __init__(self, max_wait=defaults.single_flight_wait, path=None):
+        """
+        :param max_wait: Seconds to wait for another process's flight before making the call anyway
+        :type max_wait: float
+        :param path: Explicit database path, defaults to the eicproxy cache directory
+        :type path: basestring
+        """
+        self.max_wait = max_wait
+        self.path = path
+        self.db_ = None
+
+    def _db(self):
+        # opened on first use, see _shared and _store for what happens when that fails
+        if self.db_ is None:
+            db = state.Database(DB_NAME, SCHEMA, SCHEMA_VERSION, path=self.path)
+            os.makedirs(join(dirname(db.path), 'flights'), mode=0o700, exist_ok=True)
+            self.db_ = db
+        return self.db_
+
+    def _lock(self, digest):
+        """
+        Opens the flight's lock file and takes its lock, waiting up to max_wait.
+
+        A lock taken on a file its holder removed in the meantime is dropped and taken again on
+        the new file, so every process holding the lock holds it on the same file.
+
+        :return: (lock file path, file descriptor, whether the lock is held)
+        :rtype: tuple
+        """
+        path = join(dirname(self._db().path), 'flights', f'{digest}.lock')
+        deadline = time.monotonic() + self.max_wait
+        delay = poll_min
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    return path, fd, False
+                time.sleep(delay)
+                delay = min(delay * 2, poll_max)
+                continue
+            try:
+                current = os.stat(path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current == os.fstat(fd).st_ino:
+                return path, fd, True
+            os.close(fd)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    def _unlock(self, path, fd, locked):
+        if locked:
+            # removed while still locked, waiters notice the file is gone once they get the lock
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        # closing the file releases the lock
+        os.close(fd)
+
+    def run(self, key, call, encode=None, decode=None, since=None):
+        """
+        Returns the result of call(), made by this process or by another one that was making the
+        same call at the same time.
+
+        :param key: Flight key, identical requests have equal keys
+        :type key: tuple
+        :param call: Makes the request
+        :type call: callable
+        :param encode: Turns the result into something json can store, defaults to the result itself
+        :type encode: callable
+        :param decode: Turns a stored result back, defaults to the stored value itself
+        :type decode: callable
+        :param since: Time the caller last found no result (e.g. missed its cache), flights finished
+           after it are shared. Defaults to now
+        :type since: float
+        :raises FlightFailed: if the shared call failed
+        """
+        name = json.dumps(key)
+        digest = hashlib.sha256(name.encode()).hexdigest()[:32]
+        since = since or time.time()
+        with instrument.phase('single_flight', flight=key[0]) as timing:
+            try:
+                path, fd, locked = self._lock(digest)
+            except (OSError, sqlite3.Error) as e:
+                timing.set(unavailable=str(e))
+                return call()
+            try:
+                row = self._shared(name, since)
+                timing.set(shared=row is not None, locked=locked)
+                if row is not None:
+                    result, error = row
+                    if error is not None:
+                        raise FlightFailed(error)
+                    result = json.loads(result)
+                    return decode(result) if decode else result
+                try:
+                    result = call()
+                except Exception as e:
+                    if locked:
+                        self._store(name, error=str(e))
+                    raise
+                if locked:
+                    self._store(name, result=json.dumps(encode(result) if encode else result))
+                return result
+            finally:
+                self._unlock(path, fd, locked)
+
+    def _shared(self, name, since):
+        # a flight finishing after the caller looked is as fresh as a call made now
+        try:
+            return self._db().execute('SELECT result, error FROM flights WHERE key = ? AND finished >= ?',
+                                    (name, since)).fetchone()
+        except sqlite3.Error:
+            return None
+
+    def _store(self, name, result=None, error=None):
+        # a result that cannot be stored leaves the waiters to make the call themselves
+        now = time.time()
+        try:
+            with self._db().transaction():
+                self._db().execute('DELETE FROM flights WHERE finished < ?', (now - keep_seconds,))
+                self._db().execute('INSERT OR REPLACE INTO flights VALUES (?, ?, ?, ?)', (name, now, result, error))
+        except sqlite3.Error:
+            pass
@@ -3,6 +3,9 @@ Statically included library: sshconf v0.1.2
 Github Project: https://github.com/sorend/sshconf
 tag: 0.1.2, Hash: d5ac68f5d4038a15544eb108b60d7a3775009014
 
+Modified for eicproxy: lines are kept in per-Host blocks with host and key indexes so edits
+of configs with tens of thousands of hosts do not rescan the whole file.
+
 Copy of License provided:
 ----------------------------------------------------------------------------
 The MIT License (MIT)
@@ -29,8 +32,9 @@ SOFTWARE.
 ----------------------------------------------------------------------------
 """
 
+import gc
 import re
-from collections import defaultdict, namedtuple
+from collections import defaultdict
 
 # taken from "man ssh"
 KNOWN_PARAMS = (
@@ -153,9 +157,11 @@ def empty_ssh_config():
     """
     return SshConfig([])
 
+_whitespace = re.compile(r"\s+")  # pylint: disable=invalid-name
+
 def _key_value(line):
     no_comment = line.split("#")[0]
-    return [x.strip() for x in re.split(r"\s+", no_comment.strip(), 1)]
+    return [x.strip() for x in _whitespace.split(no_comment.strip(), 1)]
 
 def _remap_key(key):
     """ Change key into correct casing if we know the parameter """
@@ -165,28 +171,79 @@ def _remap_key(key):
         return KNOWN_PARAMS[known_params.index(key.lower())]
     return key
 
+class _Block(object):  # pylint: disable=too-few-public-methods
+    """
+    The lines of one Host entry, up to the next one, or the lines before the first.
+    """
+    __slots__ = ("host", "lines", "keys")
+
+    def __init__(self, host=None):
+        self.host = host
+        self.lines = []
+        self.keys = defaultdict(list)
+
+    def append(self, line):
+        self.lines.append(line)
+        if line.key is not None:
+            self.keys[line.key.lower()].append(line)
+
+    def insert(self, idx, line):
+        self.lines.insert(idx, line)
+        lower_key = line.key.lower()
+        self.keys[lower_key] = [x for x in self.lines if x.key is not None and x.key.lower() == lower_key]
+
+    def remove(self, line):
+        self.lines.remove(line)
+        self.keys[line.key.lower()].remove(line)
+
+    def last_key_index(self):
+        """ Index of the last line with a setting, trailing comments and blank lines follow it """
+        for idx in range(len(self.lines) - 1, -1, -1):
+            if self.lines[idx].key is not None:
+                return idx
+        return -1
+
 class SshConfig(object):
     """
     Class for manipulating SSH configuration.
+
+    Lines are kept in blocks, one per Host entry, with an index of the blocks of each Host
+    value and of the settings in each block, so that editing one host costs the size of its
+    entry rather than of the whole file.  As in sshconf a Match line and the lines after it
+    belong to the Host entry before it.
     """
     def __init__(self, lines):
-        self.lines_ = []
-        self.hosts_ = set()
+        self.blocks_ = [_Block()]
+        # Host value -> its blocks, a Host value may be repeated
+        self.hosts_ = {}
         self.parse(lines)
 
+    def _new_block(self, host):
+        block = _Block(host)
+        self.blocks_.append(block)
+        self.hosts_.setdefault(host, []).append(block)
+        return block
+
     def parse(self, lines):
         """Parse lines from ssh config file"""
-        cur_entry = None
-        for line in lines:
-            kv_ = _key_value(line)
-            if len(kv_) > 1:
-                key, value = kv_
-                if key.lower() == "host":
-                    cur_entry = value
-                    self.hosts_.add(value)
-                self.lines_.append(ConfigLine(line=line, host=cur_entry, key=key, value=value))
-            else:
-                self.lines_.append(ConfigLine(line=line))
+        cur_block = self.blocks_[-1]
+        # parsing creates no reference cycles, but enough objects for the cyclic garbage collector
+        # to rescan the growing heap over and over, more than doubling the time on large configs
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for line in lines:
+                kv_ = _key_value(line)
+                if len(kv_) > 1:
+                    key, value = kv_
+                    if key.lower() == "host":
+                        cur_block = self._new_block(value)
+                    cur_block.append(ConfigLine(line=line, host=cur_block.host, key=key, value=value))
+                else:
+                    cur_block.append(ConfigLine(line=line))
+        finally:
+            if gc_enabled:
+                gc.enable()
 
     def hosts(self):
         """
@@ -212,14 +269,13 @@ class SshConfig(object):
         -------
         dict of key value pairs, excluding "Host", empty map if host is not found.
         """
-        if host in self.hosts_:
-            vals = defaultdict(list)
-            for k, value in [(x.key.lower(), x.value) for x in self.lines_
-                             if x.host == host and x.key.lower() != "host"]:
-                vals[k].append(value)
-            flatten = lambda x: x[0] if len(x) == 1 else x
-            return {k: flatten(v) for k, v in vals.items()}
-        return {}
+        vals = defaultdict(list)
+        for block in self.hosts_.get(host, ()):
+            for line in block.lines:
+                if line.key is not None and line.key.lower() != "host":
+                    vals[line.key.lower()].append(line.value)
+        flatten = lambda x: x[0] if len(x) == 1 else x
+        return {k: flatten(v) for k, v in vals.items()}
 
     def set(self, host, **kwargs):
         """
@@ -237,32 +293,30 @@ class SshConfig(object):
             """Produce new config line"""
             return "  %s %s" % (key, value)
 
+        blocks = self.hosts_[host]
         for key, values in kwargs.items():
             if type(values) not in [list, tuple]:  # pylint: disable=unidiomatic-typecheck
                 values = [values]
+            values = list(values)
 
             lower_key = key.lower()
-            update_idx = [idx for idx, x in enumerate(self.lines_)
-                          if x.host == host and x.key.lower() == lower_key]
-            extra_remove = []
-            for idx in update_idx:
-                if values:  # values available, update the line
-                    value = values.pop()
-                    self.lines_[idx].line = update_line(self.lines_[idx].key, value)
-                    self.lines_[idx].value = value
-                else:                # no more values available, remove the line
-                    extra_remove.append(idx)
-
-            for idx in reversed(sorted(extra_remove)):
-                del self.lines_[idx]
+            for block in blocks:
+                for line in list(block.keys.get(lower_key, ())):
+                    if values:  # values available, update the line
+                        value = values.pop()
+                        line.line = update_line(line.key, value)
+                        line.value = value
+                    else:                # no more values available, remove the line
+                        block.remove(line)
 
             if values:
                 mapped_key = _remap_key(key)
-                max_idx = max([idx for idx, line in enumerate(self.lines_) if line.host == host])
+                block = blocks[-1]
+                max_idx = block.last_key_index()
                 for value in values:
-                    self.lines_.insert(max_idx + 1, ConfigLine(line=update_line(mapped_key, value),
-                                                               host=host, key=mapped_key,
-                                                               value=value))
+                    block.insert(max_idx + 1, ConfigLine(line=update_line(mapped_key, value),
+                                                         host=host, key=mapped_key,
+                                                         value=value))
 
     def unset(self, host, *args):
         """
@@ -274,10 +328,10 @@ class SshConfig(object):
         *args : list of settings to removes.
         """
         self.__check_host_args(host, args)
-        remove_idx = [idx for idx, x in enumerate(self.lines_)
-                      if x.host == host and x.key.lower() in args]
-        for idx in reversed(sorted(remove_idx)):
-            del self.lines_[idx]
+        for block in self.hosts_[host]:
+            for key in args:
+                for line in list(block.keys.get(key.lower(), ())):
+                    block.remove(line)
 
     def __check_host_args(self, host, keys):
         """Checks parameters"""
@@ -298,14 +352,16 @@ class SshConfig(object):
         """
         if new_host in self.hosts_:
             raise ValueError("Host %s: already exists." % new_host)
-        for line in self.lines_:  # update lines
-            if line.host == old_host:
-                line.host = new_host
-                if line.key.lower() == "host":
-                    line.value = new_host
-                    line.line = "Host %s" % new_host
-        self.hosts_.remove(old_host)  # update host cache
-        self.hosts_.add(new_host)
+        blocks = self.hosts_.pop(old_host)
+        for block in blocks:
+            block.host = new_host
+            for line in block.lines:  # update lines
+                if line.key is not None:
+                    line.host = new_host
+                    if line.key.lower() == "host":
+                        line.value = new_host
+                        line.line = "Host %s" % new_host
+        self.hosts_[new_host] = blocks
 
     def add(self, host, **kwargs):
         """
@@ -318,16 +374,16 @@ class SshConfig(object):
         """
         if host in self.hosts_:
             raise ValueError("Host %s: exists (use update)." % host)
-        self.hosts_.add(host)
-        self.lines_.append(ConfigLine(line="", host=None))
-        self.lines_.append(ConfigLine(line="Host %s" % host, host=host, key="Host", value=host))
+        self.blocks_[-1].append(ConfigLine(line="", host=None))
+        block = self._new_block(host)
+        block.append(ConfigLine(line="Host %s" % host, host=host, key="Host", value=host))
         for k, v in kwargs.items():
             if type(v) not in [list, tuple]:
                 v = [v]
             mapped_k = _remap_key(k)
             for value in v:
-                self.lines_.append(ConfigLine(line="  %s %s" % (mapped_k, str(value)), host=host, key=mapped_k, value=value))
-        self.lines_.append(ConfigLine(line="", host=None))
+                block.append(ConfigLine(line="  %s %s" % (mapped_k, str(value)), host=host, key=mapped_k, value=value))
+        block.append(ConfigLine(line="", host=None))
 
     def remove(self, host):
         """
@@ -339,18 +395,25 @@ class SshConfig(object):
         """
         if host not in self.hosts_:
             raise ValueError("Host %s: not found." % host)
-        self.hosts_.remove(host)
-        # remove lines, including comments inside the host lines
-        host_lines = [ idx for idx, x in enumerate(self.lines_) if x.host == host ]
-        remove_range = reversed(range(min(host_lines), max(host_lines) + 1))
-        for idx in remove_range:
-            del self.lines_[idx]
+        for block in self.hosts_.pop(host):
+            # remove lines, including comments inside the host lines, keep what trails them
+            block.lines = block.lines[block.last_key_index() + 1:]
+            block.keys = defaultdict(list)
+            block.host = None
+
+    def iter_lines(self):
+        """
+        Yield the lines of the configuration, without line endings.
+        """
+        for block in self.blocks_:
+            for line in block.lines:
+                yield line.line
 
     def config(self):
         """
         Return the configuration as a string.
         """
-        return "\n".join([x.line for x in self.lines_])
+        return "\n".join(self.iter_lines())
 
     def write(self, path):
         """
@@ -0,0 +1,90 @@
+"""
+On-disk state shared between eicproxy invocations.
+
+Each kind of state lives in its own small sqlite database inside the eicproxy cache
+directory.  sqlite gives us indexed lookups and safe concurrent access from the many
+ProxyCommand processes ssh, scp or ansible start at the same time.
+"""
+
+import sqlite3
+import threading
+
+from contextlib import contextmanager
+from os.path import join
+
+from .defaults import cache_dir
+
+busy_timeout_seconds = 10
+
+
+class Database(object):
+    """
+    A state database, opened lazily with one sqlite connection per thread.
+
+    State is disposable, so a database whose schema version does not match is simply
+    dropped and recreated instead of being migrated.
+    """
+    def __init__(self, name, schema, version, path=None):
+        """
+        :param name: File name of the database inside the cache directory
+        :type name: basestring
+        :param schema: CREATE statements for the database
+        :type schema: tuple
+        :param version: Schema version, stored in PRAGMA user_version
+        :type version: int
+        :param path: Explicit database path, overrides name
+        :type path: basestring
+        """
+        self.path = path or join(cache_dir(), name)
+        self.schema = schema
+        self.version = version
+        self.local_ = threading.local()
+        self._prepare(self.connection())
+
+    def connection(self):
+        """
+        Returns this thread's autocommit connection to the database.
+        """
+        conn = getattr(self.local_, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=busy_timeout_seconds, isolation_level=None)
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self.local_.conn = conn
+        return conn
+
+    def _prepare(self, conn):
+        if conn.execute('PRAGMA user_version').fetchone()[0] == self.version:
+            return
+        with self.transaction():
+            if conn.execute('PRAGMA user_version').fetchone()[0] != self.version:
+                tables = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+                for (table,) in tables:
+                    conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+                for statement in self.schema:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {int(self.version)}')
+        conn.execute('PRAGMA journal_mode = WAL')
+
+    def execute(self, sql, params=()):
+        """
+        Executes a single statement on this thread's connection.
+
+        :return: The sqlite cursor
+        :rtype: sqlite3.Cursor
+        """
+        return self.connection().execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the enclosed statements in a write-locked (BEGIN IMMEDIATE) transaction.
+        """
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
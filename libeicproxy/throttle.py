@@ -0,0 +1,271 @@
+"""
+Client side rate limiting of the EC2 and EC2 Instance Connect API calls.
+
+Every (profile, region, service) gets a token bucket shared by all eicproxy processes through a
+small sqlite database, so a few hundred ProxyCommands started by one ansible run draw from the
+same budget instead of each assuming it has the account's whole API rate to itself.  A call
+takes a token before it is sent; when the bucket is empty the token is reserved ahead and the
+caller sleeps until it is due, so waiting callers queue up in order instead of polling.
+
+The buckets adapt: a throttling response halves the bucket's rate and drops the tokens saved
+up, and the rate then recovers linearly back to the service default.  Retryable errors
+(throttling, 5xx, connection failures) are retried with full jitter exponential backoff.
+
+Time spent waiting for tokens and backing off is counted in stats and reported to
+libeicproxy.instrument as throttle_wait events.
+"""
+
+import random
+import threading
+import time
+
+from . import defaults, instrument, state
+
+DB_NAME = 'throttle.sqlite'
+SCHEMA_VERSION = 1
+SCHEMA = (
+    '''CREATE TABLE buckets (
+           key TEXT PRIMARY KEY,
+           rate REAL NOT NULL,
+           tokens REAL NOT NULL,
+           updated REAL NOT NULL,
+           cut REAL NOT NULL DEFAULT 0,
+           throttled INTEGER NOT NULL DEFAULT 0
+       ) WITHOUT ROWID''',
+)
+
+# (tokens per second, burst) per service, after the EC2 API request token buckets for
+# non-mutating actions; EC2 Instance Connect does not publish its limits
+service_limits = {
+    'ec2': (20.0, 100.0),
+    'ec2-instance-connect': (10.0, 20.0),
+}
+default_limit = (10.0, 20.0)
+# a throttled bucket's rate is multiplied by this, but never goes below min_rate
+decrease_factor = 0.5
+min_rate = 0.5
+# the calls of one burst are throttled together, their responses only cut the rate once
+cut_interval = 1.0
+# share of the service rate a throttled bucket gains back per second
+recovery_per_second = 0.05
+# longest a caller sleeps for a reserved token before giving up on the bucket and just sending
+max_wait_seconds = 30.0
+
+throttling_codes = frozenset((
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottled',
+    'RequestThrottledException', 'RequestLimitExceeded', 'TooManyRequestsException',
+    'EC2ThrottledException', 'SlowDown',
+))
+transient_codes = frozenset((
+    'RequestError', 'RequestTimeout', 'RequestTimeoutException', 'ServiceUnavailable',
+    'Unavailable', 'InternalError', 'InternalFailure',
+))
+
+
+class Stats(object):
+    """
+    Process wide totals of the time spent waiting on rate limits.
+    """
+    def __init__(self):
+        self.waited = 0.0
+        self.retries = 0
+        self.throttled = 0
+        self.lock_ = threading.Lock()
+
+    def add(self, waited=0.0, retries=0, throttled=0):
+        with self.lock_:
+            self.waited += waited
+            self.retries += retries
+            self.throttled += throttled
+
+    def snapshot(self):
+        """
+        Returns the totals as a dict: waited_ms, retries and throttled responses.
+        """
+        with self.lock_:
+            return {'waited_ms': round(self.waited * 1000, 3), 'retries': self.retries, 'throttled': self.throttled}
+
+    def summary(self):
+        """
+        Returns a one line account of the waiting for humans, None if there was none.
+        """
+        with self.lock_:
+            if not (self.waited or self.retries):
+                return None
+            return (f'waited {self.waited:.1f}s on AWS API rate limits, {self.retries} retries, '
+                    f'{self.throttled} throttled responses')
+
+
+stats = Stats()
+
+
+def error_code(error):
+    """
+    Returns the AWS error code of an API exception, or None for other exceptions.
+    """
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
+
+
+def is_throttling(code):
+    return code in throttling_codes
+
+
+def is_retryable(error):
+    """
+    Returns whether an API exception is worth retrying: throttling, a transient error or a 5xx.
+    """
+    code = error_code(error)
+    if code in throttling_codes or code in transient_codes:
+        return True
+    status = getattr(error, 'response', {}).get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return status is not None and status >= 500
+
+
+def backoff(attempt, base=defaults.retry_base_delay, cap=defaults.retry_max_delay):
+    """
+    Returns the full jitter delay before retry number attempt (1 for the first retry).
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class RateLimiter(object):
+    """
+    sqlite backed adaptive token buckets shared between processes.
+    """
+    def __init__(self, path=None):
+        """
+        :param path: Explicit database path, defaults to the eicproxy cache directory
+        :type path: basestring
+        """
+        self.db_ = state.Database(DB_NAME, SCHEMA, SCHEMA_VERSION, path=path)
+
+    def _refill(self, conn, key, service, now):
+        rate_limit, burst = service_limits.get(service, default_limit)
+        row = conn.execute('SELECT rate, tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return rate_limit, burst
+        rate, tokens, updated = row
+        elapsed = max(0.0, now - updated)
+        rate = min(rate_limit, rate + rate_limit * recovery_per_second * elapsed)
+        return rate, min(burst, tokens + rate * elapsed)
+
+    def acquire(self, key, service):
+        """
+        Takes a token from a bucket, reserving one ahead if the bucket is empty.
+
+        :param key: Bucket key, see bucket_key
+        :type key: basestring
+        :param service: Service the call goes to, picks the bucket's default rate and burst
+        :type service: basestring
+        :return: Seconds to wait before sending the call
+        :rtype: float
+        """
+        now = time.time()
+        with self.db_.transaction() as conn:
+            rate, tokens = self._refill(conn, key, service, now)
+            tokens -= 1
+            conn.execute('INSERT INTO buckets (key, rate, tokens, updated) VALUES (?, ?, ?, ?) '
+                         'ON CONFLICT (key) DO UPDATE SET rate = excluded.rate, tokens = excluded.tokens, '
+                         'updated = excluded.updated', (key, rate, tokens, now))
+        return min(max_wait_seconds, -tokens / rate) if tokens < 0 else 0.0
+
+    def throttled(self, key, service):
+        """
+        Slows a bucket down after a throttling response: the rate is cut by decrease_factor and
+        tokens saved up are dropped, at most once per cut_interval.
+        """
+        now = time.time()
+        with self.db_.transaction() as conn:
+            rate, tokens = self._refill(conn, key, service, now)
+            row = conn.execute('SELECT cut FROM buckets WHERE key = ?', (key,)).fetchone()
+            cut = row[0] if row is not None else 0.0
+            if now - cut >= cut_interval:
+                rate, tokens, cut = max(min_rate, rate * decrease_factor), min(tokens, 0.0), now
+            conn.execute('INSERT INTO buckets (key, rate, tokens, updated, cut, throttled) VALUES (?, ?, ?, ?, ?, 1) '
+                         'ON CONFLICT (key) DO UPDATE SET rate = excluded.rate, tokens = excluded.tokens, '
+                         'updated = excluded.updated, cut = excluded.cut, throttled = throttled + 1',
+                         (key, rate, tokens, now, cut))
+
+
+def bucket_key(profile, region, service):
+    return f'{profile or "default"}|{region}|{service}'
+
+
+class Throttle(object):
+    """
+    The rate limit and retry policy of one client.
+    """
+    def __init__(self, limiter, profile, region, service, max_attempts=defaults.api_max_attempts):
+        """
+        :param limiter: Shared token buckets
+        :type limiter: RateLimiter
+        :param max_attempts: Attempts per call, the first one included
+        :type max_attempts: int
+        """
+        self.limiter = limiter
+        self.service = service
+        self.key = bucket_key(profile, region, service)
+        self.max_attempts = max_attempts
+
+    def wait(self, seconds, reason, operation=None):
+        if seconds <= 0:
+            return
+        stats.add(waited=seconds)
+        instrument.event('throttle_wait', key=self.key, reason=reason, operation=operation, ms=round(seconds * 1000, 3))
+        time.sleep(seconds)
+
+    def acquire(self, operation=None):
+        """
+        Waits for a token of the client's bucket.
+        """
+        self.wait(self.limiter.acquire(self.key, self.service), 'rate', operation)
+
+    def throttled(self):
+        stats.add(throttled=1)
+        self.limiter.throttled(self.key, self.service)
+
+    def call(self, operation, send):
+        """
+        Sends a call through the rate limit, retrying retryable errors with backoff.
+
+        :param operation: API operation name, for instrumentation
+        :type operation: basestring
+        :param send: Makes one attempt at the call
+        :type send: callable
+        :return: What send returned
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            self.acquire(operation)
+            try:
+                return send()
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.max_attempts:
+                    raise
+                if is_throttling(error_code(e)):
+                    self.throttled()
+                stats.add(retries=1)
+                self.wait(backoff(attempt), 'backoff', operation)
+
+    def _before_send(self, event_name=None, **kwargs):
+        # the event is before-send.<service>.<Operation>
+        self.acquire((event_name or '').rpartition('.')[2] or None)
+
+    def _needs_retry(self, response=None, **kwargs):
+        # botocore's own retry handler decides on and sleeps for the retry, this only feeds the bucket
+        if response is not None and is_throttling(response[1].get('Error', {}).get('Code')):
+            self.throttled()
+            stats.add(retries=1)
+
+    def install(self, client):
+        """
+        Puts a client under this throttle: lite clients send through call(), boto3 clients take
+        tokens in a before-send hook and report throttling responses from needs-retry.
+
+        :return: The client
+        """
+        if hasattr(client, 'meta'):
+            client.meta.events.register('before-send', self._before_send, unique_id='eicproxy-throttle')
+            client.meta.events.register('needs-retry', self._needs_retry, unique_id='eicproxy-throttle')
+        else:
+            client.throttle = self
+        return client
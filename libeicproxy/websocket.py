@@ -0,0 +1,207 @@
+"""
+A small RFC 6455 WebSocket implementation, enough for the EC2 Instance Connect Endpoint tunnel.
+
+Only what a byte stream tunnel needs: the opening handshake (client side), binary messages,
+fragmented messages, ping/pong and the closing handshake.  No extensions, no subprotocols.
+"""
+
+import base64
+import hashlib
+import os
+import socket
+import ssl
+import threading
+
+from urllib.parse import urlsplit
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+default_timeout = 30
+max_handshake_bytes = 64 * 1024
+# a peer announcing a larger frame is not talking to a byte stream tunnel
+max_frame_bytes = 16 * 1024 * 1024
+
+
+class WebSocketError(OSError):
+    """
+    Raised when the handshake fails or the peer breaks the protocol.
+    """
+
+
+def accept_key(key):
+    """
+    Returns the Sec-WebSocket-Accept value answering a Sec-WebSocket-Key.
+    """
+    return base64.b64encode(hashlib.sha1((key + GUID).encode()).digest()).decode()
+
+
+def _mask(data, key):
+    # xor as one big integer, a byte at a time would be slow for bulk data
+    length = len(data)
+    if not length:
+        return b''
+    repeated = (key * (length // 4 + 1))[:length]
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(length, 'big')
+
+
+class WebSocket(object):
+    """
+    A WebSocket over a connected socket, after the opening handshake.
+    """
+    def __init__(self, sock, client=True, buffered=b''):
+        """
+        :param sock: The connected (TLS) socket
+        :type sock: socket.socket
+        :param client: Whether this is the client end, which masks its frames
+        :type client: bool
+        :param buffered: Bytes already read past the handshake
+        :type buffered: bytes
+        """
+        self.sock = sock
+        self.client = client
+        # close frame sent, and received: data still arrives in between
+        self.closed = False
+        self.peer_closed = False
+        self.buf_ = bytearray(buffered)
+        self.send_lock_ = threading.Lock()
+
+    def _read_exactly(self, size):
+        while len(self.buf_) < size:
+            chunk = self.sock.recv(max(65536, size - len(self.buf_)))
+            if not chunk:
+                raise WebSocketError('connection closed in the middle of a WebSocket frame')
+            self.buf_ += chunk
+        data = bytes(self.buf_[:size])
+        del self.buf_[:size]
+        return data
+
+    def _read_frame(self):
+        first, second = self._read_exactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length = int.from_bytes(self._read_exactly(2), 'big')
+        elif length == 127:
+            length = int.from_bytes(self._read_exactly(8), 'big')
+        if length > max_frame_bytes:
+            raise WebSocketError(f'WebSocket frame of {length} bytes')
+        key = self._read_exactly(4) if second & 0x80 else None
+        payload = self._read_exactly(length)
+        if key is not None:
+            payload = _mask(payload, key)
+        return bool(first & 0x80), first & 0x0F, payload
+
+    def send(self, data, opcode=OP_BINARY):
+        """
+        Sends one message in a single frame.
+        """
+        length = len(data)
+        header = bytearray([0x80 | opcode])
+        mask_bit = 0x80 if self.client else 0
+        if length < 126:
+            header.append(mask_bit | length)
+        elif length < 1 << 16:
+            header.append(mask_bit | 126)
+            header += length.to_bytes(2, 'big')
+        else:
+            header.append(mask_bit | 127)
+            header += length.to_bytes(8, 'big')
+        if self.client:
+            key = os.urandom(4)
+            header += key
+            data = _mask(data, key)
+        with self.send_lock_:
+            self.sock.sendall(bytes(header) + bytes(data))
+
+    def recv(self):
+        """
+        Returns the next data message, answering pings on the way; b'' once the peer closed.
+        """
+        message = bytearray()
+        while True:
+            if self.peer_closed:
+                return b''
+            final, opcode, payload = self._read_frame()
+            if opcode == OP_PING:
+                self.send(payload, OP_PONG)
+            elif opcode == OP_PONG:
+                continue
+            elif opcode == OP_CLOSE:
+                self.peer_closed = True
+                self.close(payload[:2] or (1000).to_bytes(2, 'big'))
+                return b''
+            elif opcode in (OP_BINARY, OP_TEXT, OP_CONTINUATION):
+                message += payload
+                if final:
+                    if message:
+                        return bytes(message)
+            else:
+                raise WebSocketError(f'unknown WebSocket opcode {opcode}')
+
+    def close(self, status=(1000).to_bytes(2, 'big')):
+        """
+        Sends a close frame, once. Messages the peer sent before answering it are still received.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.send(status, OP_CLOSE)
+        except OSError:
+            pass
+
+
+def connect(url, headers=None, timeout=default_timeout):
+    """
+    Opens a WebSocket to a ws:// or wss:// url.
+
+    :param headers: Extra handshake headers
+    :type headers: dict
+    :param timeout: Seconds the TCP connect, TLS and WebSocket handshakes may take
+    :type timeout: float
+    :rtype: WebSocket
+    :raises OSError: if the connection or the handshake fails
+    """
+    parts = urlsplit(url)
+    secure = parts.scheme == 'wss'
+    port = parts.port or (443 if secure else 80)
+    sock = socket.create_connection((parts.hostname, port), timeout=timeout)
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if secure:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=parts.hostname)
+        key = base64.b64encode(os.urandom(16)).decode()
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        lines = [f'GET {target} HTTP/1.1', f'Host: {parts.netloc}', 'Upgrade: websocket',
+                 'Connection: Upgrade', f'Sec-WebSocket-Key: {key}', 'Sec-WebSocket-Version: 13']
+        lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        sock.sendall(('\r\n'.join(lines) + '\r\n\r\n').encode())
+        response = bytearray()
+        while b'\r\n\r\n' not in response:
+            chunk = sock.recv(4096)
+            if not chunk:
+                raise WebSocketError('connection closed during the WebSocket handshake')
+            response += chunk
+            if len(response) > max_handshake_bytes:
+                raise WebSocketError('WebSocket handshake response too large')
+        head, _, rest = bytes(response).partition(b'\r\n\r\n')
+        status_line, *header_lines = head.decode('iso-8859-1').split('\r\n')
+        fields = {}
+        for line in header_lines:
+            name, _, value = line.partition(':')
+            fields[name.strip().lower()] = value.strip()
+        status = status_line.split(' ', 2)
+        if len(status) < 2 or status[1] != '101':
+            raise WebSocketError(f'WebSocket handshake refused: {status_line}')
+        if fields.get('sec-websocket-accept') != accept_key(key):
+            raise WebSocketError('WebSocket handshake answered with a wrong Sec-WebSocket-Accept')
+        sock.settimeout(None)
+        return WebSocket(sock, client=True, buffered=rest)
+    except BaseException:
+        sock.close()
+        raise
@@ -38,7 +38,8 @@ setup(
         'Programming Language :: Python :: 3.7',
     ],
     keywords='aws ec2 instance connect ssh rsync scp ansible proxycommand proxy openssh nc',
-    packages=[],
+    packages=['libeicproxy'],
+    package_data={'libeicproxy': ['ansible_plugins/inventory/*.py']},
     python_requires='>=3.0, <4',
     install_requires=['boto3'],
     scripts=['eicproxy'],
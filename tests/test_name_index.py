@@ -0,0 +1,40 @@
+from libeicproxy.ec2_util import InstanceRecord
+from libeicproxy.name_index import best_first
+
+
+def record(instance_id, state='running', launch_time='2024-01-01T00:00:00Z'):
+    return InstanceRecord(instance_id=instance_id, state=state, launch_time=launch_time)
+
+
+def ids(instances):
+    return [info.instance_id for info in best_first(instances)]
+
+
+def test_running_first():
+    assert ids([record('i-1', 'stopped', '2024-06-01T00:00:00Z'), record('i-2')]) == ['i-2', 'i-1']
+
+
+def test_most_recently_launched_first():
+    assert ids([record('i-1', launch_time='2024-01-01T00:00:00Z'),
+                record('i-2', launch_time='2024-03-01T00:00:00Z'),
+                record('i-3', launch_time='2024-02-01T00:00:00Z')]) == ['i-2', 'i-3', 'i-1']
+
+
+def test_lowest_id_breaks_ties():
+    assert ids([record('i-b'), record('i-c'), record('i-a')]) == ['i-a', 'i-b', 'i-c']
+
+
+def test_unknown_launch_time_last():
+    assert ids([record('i-1', launch_time=None), record('i-2', launch_time='')]) == ['i-1', 'i-2']
+    assert ids([record('i-1', launch_time=None), record('i-2')]) == ['i-2', 'i-1']
+
+
+def test_state_outranks_launch_time_outranks_id():
+    instances = [record('i-4', 'stopped', '2024-05-01T00:00:00Z'),
+                 record('i-3', 'pending', '2024-04-01T00:00:00Z'),
+                 record('i-2', launch_time='2024-01-01T00:00:00Z'),
+                 record('i-1', launch_time='2024-01-01T00:00:00Z'),
+                 record('i-0', launch_time='2023-01-01T00:00:00Z')]
+    assert ids(instances) == ['i-1', 'i-2', 'i-0', 'i-4', 'i-3']
+    # the input order does not matter
+    assert ids(instances[::-1]) == ids(instances)
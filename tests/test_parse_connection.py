@@ -0,0 +1,101 @@
+import pytest
+
+from libeicproxy import parse_connection
+from libeicproxy.parse_connection import dns_region, host_kind, parse, tag_filter
+
+
+@pytest.mark.parametrize('host, kind', [
+    ('i-0123456789abcdef0', 'instance_id'),
+    ('i-01234567', 'instance_id'),
+    ('10.0.1.5', 'ipv4'),
+    ('2600:1f18::5', 'ipv6'),
+    ('ip-10-0-1-5.ec2.internal', 'private_dns'),
+    ('ip-10-0-1-5.eu-west-1.compute.internal', 'private_dns'),
+    ('i-0123456789abcdef0.eu-west-1.compute.internal', 'private_dns'),
+    ('ec2-3-80-1-2.compute-1.amazonaws.com', 'public_dns'),
+    ('EC2-3-80-1-2.eu-west-1.compute.amazonaws.com', 'public_dns'),
+    ('Role=bastion', 'tag'),
+    ('aws:autoscaling:groupName=web', 'tag'),
+    ('web-1', 'name'),
+    ('web+blue', 'name'),
+    ('i-xyz', 'name'),
+    ('10.0.1', 'name'),
+])
+def test_host_kind(host, kind):
+    assert host_kind(host) == kind
+
+
+@pytest.mark.parametrize('host, region', [
+    ('ip-10-0-1-5.ec2.internal', 'us-east-1'),
+    ('ip-10-0-1-5.eu-west-1.compute.internal', 'eu-west-1'),
+    ('ec2-3-80-1-2.compute-1.amazonaws.com', 'us-east-1'),
+    ('ec2-3-80-1-2.ap-southeast-2.compute.amazonaws.com', 'ap-southeast-2'),
+    ('web-1', None),
+])
+def test_dns_region(host, region):
+    assert dns_region(host) == region
+
+
+def test_tag_filter_splits_at_the_first_equals_sign():
+    assert tag_filter('Role=a=b') == ('Role', 'a=b')
+    assert tag_filter('Role=') == ('Role', '')
+
+
+def test_parse():
+    spec = parse('ec2-user@i-0123456789abcdef0:22')
+    assert (spec.os_user, spec.host, spec.port, spec.kind, spec.profile) == \
+        ('ec2-user', 'i-0123456789abcdef0', 22, 'instance_id', None)
+
+
+def test_parse_bracketed_ipv6():
+    spec = parse('ec2-user@[2600:1f18::5]:2222')
+    assert (spec.host, spec.port, spec.kind) == ('2600:1f18::5', 2222, 'ipv6')
+
+
+@pytest.mark.parametrize('connection_string, host, kind', [
+    ('u@web+blue:22', 'web+blue', 'name'),
+    ('u@a+b=c:22', 'a+b=c', 'tag'),
+    ('u@dev+i-0123456789abcdef0:22', 'dev+i-0123456789abcdef0', 'name'),
+])
+def test_parse_keeps_plus_in_hosts(connection_string, host, kind):
+    spec = parse(connection_string)
+    assert (spec.host, spec.kind, spec.profile) == (host, kind, None)
+
+
+def test_parse_profile_prefix():
+    spec = parse('u@dev+i-0123456789abcdef0:22', profile_prefix=True)
+    assert (spec.host, spec.kind, spec.profile) == ('i-0123456789abcdef0', 'instance_id', 'dev')
+    spec = parse('u@dev+web+blue:22', profile_prefix=True)
+    assert (spec.host, spec.profile) == ('web+blue', 'dev')
+    spec = parse('u@dev+Role=web:22', profile_prefix=True)
+    assert (spec.host, spec.kind, spec.profile) == ('Role=web', 'tag', 'dev')
+    # a '+' after the '=' of a tag is part of the tag
+    spec = parse('u@Role=a+b:22', profile_prefix=True)
+    assert (spec.host, spec.kind, spec.profile) == ('Role=a+b', 'tag', None)
+
+
+def test_parse_use_tag_name():
+    spec = parse('u@i-0123456789abcdef0:22', use_tag_name=True)
+    assert (spec.host, spec.kind) == ('i-0123456789abcdef0', 'name')
+
+
+@pytest.mark.parametrize('connection_string', [
+    'i-0123456789abcdef0:22',
+    'u@i-0123456789abcdef0',
+    '@i-0123456789abcdef0:22',
+    'u@:22',
+    'u@host:0',
+    'u@host:65536',
+    'u@host:ssh',
+    'u@host:-1',
+    'u@' + 'a' * (parse_connection.HOSTNAME_MAX_LENGTH + 1) + ':22',
+])
+def test_parse_rejects(connection_string):
+    with pytest.raises(ValueError):
+        parse(connection_string)
+
+
+def test_parse_port_range():
+    assert parse('u@host:1').port == 1
+    assert parse('u@host:60022').port == 60022
+    assert parse('u@host:65535').port == 65535
@@ -0,0 +1,57 @@
+from libeicproxy.relay import KexWatcher, max_kex_packet
+
+SSH_MSG_KEXINIT = 20
+SSH_MSG_NEWKEYS = 21
+SSH_MSG_KEX_ECDH_INIT = 30
+
+
+def packet(message_type, payload=b'', padding=4):
+    """
+    An unencrypted SSH binary packet (RFC 4253, section 6).
+    """
+    body = bytes([padding, message_type]) + payload + b'\0' * padding
+    return len(body).to_bytes(4, 'big') + body
+
+
+VERSION = b'SSH-2.0-OpenSSH_9.6\r\n'
+KEX = VERSION + packet(SSH_MSG_KEXINIT, b'k' * 300) + packet(SSH_MSG_KEX_ECDH_INIT, b'e' * 32)
+NEWKEYS = packet(SSH_MSG_NEWKEYS)
+ENCRYPTED = b'\x8f\x13' * 64
+
+
+def test_cut_after_newkeys_in_one_feed():
+    assert KexWatcher().feed(KEX + NEWKEYS + ENCRYPTED) == len(KEX + NEWKEYS)
+
+
+def test_cut_offset_is_relative_to_the_last_feed():
+    data = KEX + NEWKEYS + ENCRYPTED
+    for size in (1, 7, 64, 1000):
+        watcher = KexWatcher()
+        fed = 0
+        cut = None
+        while cut is None:
+            chunk = data[fed:fed + size]
+            cut = watcher.feed(chunk)
+            if cut is None:
+                fed += len(chunk)
+        assert fed + cut == len(KEX + NEWKEYS), size
+
+
+def test_no_cut_before_newkeys():
+    watcher = KexWatcher()
+    assert watcher.feed(KEX) is None
+    assert watcher.feed(NEWKEYS[:3]) is None
+    assert watcher.feed(NEWKEYS[3:] + ENCRYPTED) == len(NEWKEYS) - 3
+
+
+def test_cut_where_the_stream_stops_looking_like_key_exchange():
+    oversized = (max_kex_packet + 1).to_bytes(4, 'big') + b'\0\x14'
+    assert KexWatcher().feed(KEX + oversized) == len(KEX)
+    # packet_length below the padding length and message type bytes
+    assert KexWatcher().feed(VERSION + b'\0\0\0\1\0\0') == len(VERSION)
+
+
+def test_cut_when_there_is_no_version_line():
+    watcher = KexWatcher()
+    assert watcher.feed(b'x' * (max_kex_packet - 1)) is None
+    assert watcher.feed(b'x') == 0
@@ -0,0 +1,54 @@
+import os
+import time
+
+import pytest
+
+from libeicproxy.single_flight import FlightFailed, SingleFlight
+
+
+def flights(tmp_path):
+    return SingleFlight(max_wait=1, path=str(tmp_path / 'flights.sqlite'))
+
+
+def test_result_of_a_later_flight_is_shared(tmp_path):
+    asked = time.time()
+    assert flights(tmp_path).run(('describe', 'web'), lambda: {'id': 'i-1'}) == {'id': 'i-1'}
+    calls = []
+    shared = flights(tmp_path).run(('describe', 'web'), lambda: calls.append(1), since=asked)
+    assert shared == {'id': 'i-1'}
+    assert calls == []
+
+
+def test_flight_finished_before_the_caller_looked_is_not_shared(tmp_path):
+    flights(tmp_path).run(('describe', 'web'), lambda: 'old')
+    assert flights(tmp_path).run(('describe', 'web'), lambda: 'new', since=time.time() + 1) == 'new'
+
+
+def test_encode_and_decode(tmp_path):
+    asked = time.time()
+    flights(tmp_path).run(('k',), lambda: {1, 2}, encode=sorted)
+    assert flights(tmp_path).run(('k',), lambda: None, decode=set, since=asked) == {1, 2}
+
+
+def test_errors_are_shared(tmp_path):
+    asked = time.time()
+
+    def fail():
+        raise RuntimeError('Did not find web')
+
+    with pytest.raises(RuntimeError):
+        flights(tmp_path).run(('describe', 'web'), fail)
+    with pytest.raises(FlightFailed, match='Did not find web'):
+        flights(tmp_path).run(('describe', 'web'), lambda: 'unused', since=asked)
+
+
+def test_lock_files_are_removed(tmp_path):
+    flight = flights(tmp_path)
+    for i in range(5):
+        flight.run(('push', i), lambda: True)
+    assert os.listdir(tmp_path / 'flights') == []
+
+
+def test_unusable_database_falls_back_to_the_call(tmp_path):
+    (tmp_path / 'flights.sqlite').write_bytes(b'not a database' * 100)
+    assert flights(tmp_path).run(('describe', 'web'), lambda: 'called') == 'called'
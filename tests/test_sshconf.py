@@ -0,0 +1,130 @@
+import pytest
+
+from libeicproxy import sshconf
+
+CONFIG = """# generated by hand
+ServerAliveInterval 30
+
+Host web-1 web-one
+\tHostName i-0123456789abcdef0   # trailing comment
+  User ec2-user
+  IdentityFile ~/.ssh/a
+  IdentityFile ~/.ssh/b
+  # inside the entry
+
+Host db
+    User admin
+    ProxyCommand eicproxy %r@%h:%p
+Match user root
+    Port 2222
+
+Host web-1 web-one
+  Port 22
+# trailing
+"""
+
+
+def read(tmp_path, text=CONFIG):
+    path = tmp_path / 'config'
+    path.write_text(text)
+    return sshconf.read_ssh_config(str(path))
+
+
+def test_round_trip_is_exact(tmp_path):
+    config = read(tmp_path)
+    assert config.config() == CONFIG.rstrip('\n')
+    config.write(str(tmp_path / 'copy'))
+    assert (tmp_path / 'copy').read_text() == CONFIG.rstrip('\n')
+
+
+def test_hosts_and_host(tmp_path):
+    config = read(tmp_path)
+    assert set(config.hosts()) == {'web-1 web-one', 'db'}
+    assert config.host('web-1 web-one') == {'hostname': 'i-0123456789abcdef0', 'user': 'ec2-user',
+                                            'identityfile': ['~/.ssh/a', '~/.ssh/b'], 'port': '22'}
+    assert config.host('nope') == {}
+
+
+def test_match_belongs_to_the_host_before_it(tmp_path):
+    assert read(tmp_path).host('db') == {'user': 'admin', 'proxycommand': 'eicproxy %r@%h:%p',
+                                         'match': 'user root', 'port': '2222'}
+
+
+def test_set_updates_and_adds_values(tmp_path):
+    config = read(tmp_path)
+    config.set('db', User='ec2-user', connecttimeout=5)
+    assert config.host('db')['user'] == 'ec2-user'
+    assert config.host('db')['connecttimeout'] == 5
+    lines = config.config().splitlines()
+    # new settings go after the last setting of the entry, with the key's canonical casing
+    assert lines[lines.index('    Port 2222') + 1] == '  ConnectTimeout 5'
+    config.set('web-1 web-one', IdentityFile='~/.ssh/c')
+    assert config.host('web-1 web-one')['identityfile'] == '~/.ssh/c'
+    assert '  IdentityFile ~/.ssh/b' not in config.config()
+
+
+def test_unset(tmp_path):
+    config = read(tmp_path)
+    config.unset('web-1 web-one', 'port', 'identityfile')
+    assert config.host('web-1 web-one') == {'hostname': 'i-0123456789abcdef0', 'user': 'ec2-user'}
+    assert '  # inside the entry' in config.config()
+
+
+def test_add_and_remove(tmp_path):
+    config = read(tmp_path)
+    config.add('web-2', HostName='i-0000000000000002', User='ec2-user')
+    assert config.host('web-2') == {'hostname': 'i-0000000000000002', 'user': 'ec2-user'}
+    assert config.config().endswith('Host web-2\n  HostName i-0000000000000002\n  User ec2-user\n')
+    config.remove('web-2')
+    config.remove('db')
+    # the blank lines add() put around the entry stay
+    assert config.config() == CONFIG.replace(
+        'Host db\n    User admin\n    ProxyCommand eicproxy %r@%h:%p\nMatch user root\n    Port 2222\n', '') + '\n'
+    assert set(config.hosts()) == {'web-1 web-one'}
+
+
+def test_remove_keeps_what_trails_the_last_setting(tmp_path):
+    config = read(tmp_path)
+    config.remove('web-1 web-one')
+    # both entries of the repeated Host go, the db entry between them stays
+    assert config.config() == ('# generated by hand\nServerAliveInterval 30\n\n  # inside the entry\n\n'
+                               'Host db\n    User admin\n    ProxyCommand eicproxy %r@%h:%p\n'
+                               'Match user root\n    Port 2222\n\n# trailing')
+
+
+def test_rename(tmp_path):
+    config = read(tmp_path)
+    config.rename('db', 'database')
+    assert config.host('db') == {}
+    assert config.host('database')['user'] == 'admin'
+    assert 'Host database' in config.config().splitlines()
+    config.set('database', User='root')
+    assert config.host('database')['user'] == 'root'
+
+
+def test_errors(tmp_path):
+    config = read(tmp_path)
+    with pytest.raises(ValueError):
+        config.set('nope', User='x')
+    with pytest.raises(ValueError):
+        config.set('db', Host='x')
+    with pytest.raises(ValueError):
+        config.add('db')
+    with pytest.raises(ValueError):
+        config.rename('db', 'web-1 web-one')
+    with pytest.raises(ValueError):
+        config.remove('nope')
+
+
+def test_many_hosts_round_trip():
+    lines = []
+    for i in range(2000):
+        lines += [f'Host web-{i}', f'  HostName i-{i:017x}', '']
+    config = sshconf.SshConfig(list(lines))
+    for i in range(0, 2000, 2):
+        config.set(f'web-{i}', User='admin')
+    for i in range(1, 2000, 2):
+        config.remove(f'web-{i}')
+    assert len(config.hosts()) == 1000
+    assert config.host('web-1998') == {'hostname': f'i-{1998:017x}', 'user': 'admin'}
+    assert sshconf.SshConfig(config.config().split('\n')).config() == config.config()
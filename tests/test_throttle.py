@@ -0,0 +1,26 @@
+import pytest
+
+from libeicproxy import throttle
+
+
+@pytest.fixture
+def upper_bound(monkeypatch):
+    # full jitter draws from [0, window], take the window itself
+    monkeypatch.setattr(throttle.random, 'uniform', lambda low, high: high)
+
+
+def test_backoff_window_starts_at_base(upper_bound):
+    assert throttle.backoff(1, base=0.1, cap=5.0) == 0.1
+    assert throttle.backoff(2, base=0.1, cap=5.0) == 0.2
+    assert throttle.backoff(4, base=0.1, cap=5.0) == 0.8
+
+
+def test_backoff_is_capped(upper_bound):
+    assert throttle.backoff(10, base=0.1, cap=5.0) == 5.0
+    assert throttle.backoff(100, base=0.1, cap=5.0) == 5.0
+
+
+def test_backoff_jitter_stays_in_the_window():
+    for attempt in range(1, 8):
+        for _ in range(50):
+            assert 0 <= throttle.backoff(attempt, base=0.1, cap=1.0) <= min(1.0, 0.1 * 2 ** (attempt - 1))